@@ -0,0 +1,199 @@
+import sys
+
+import click
+
+import db
+from attendance_matrix import RECORDED_STATUSES, report_scope
+
+
+# The periods of the rollups, as SQL turning a session date into the first
+# day of its period (weeks start on Monday)
+PERIODS = {
+    'week': "date({}, 'weekday 0', '-6 days')",
+    'month': "date({}, 'start of month')",
+}
+
+# The counted statuses, those of the attendance rate
+STATUSES = tuple(RECORDED_STATUSES)
+
+# attendance_rollup computed from scratch, one period at a time: the counts
+# of each status per (period, group of the session, student)
+RECOMPUTE_ROLLUP = '''
+    SELECT ? AS period, {period_start} AS period_start, se.group_id, a.student_id,
+           SUM(a.status IS 'present'), SUM(a.status IS 'absent'), SUM(a.status IS 'justified')
+    FROM attendance a
+    JOIN sessions se ON se.id = a.session_id
+    WHERE a.status IN ('present', 'absent', 'justified')
+    GROUP BY period_start, se.group_id, a.student_id
+'''
+
+
+def _recompute_queries():
+    for period, start in PERIODS.items():
+        yield RECOMPUTE_ROLLUP.format(period_start=start.format('se.date')), (period,)
+
+
+# Refill attendance_rollup from the attendance table (the caller commits)
+def rebuild_rollups(conn):
+    conn.execute('DELETE FROM attendance_rollup')
+    for sql, params in _recompute_queries():
+        conn.execute(f'''
+            INSERT INTO attendance_rollup (period, period_start, group_id, student_id, present, absent, justified)
+            {sql}
+        ''', params)
+
+
+# Delete the rows left at zero by deletes and moved sessions, returns how many
+def prune_rollups(conn):
+    return conn.execute('DELETE FROM attendance_rollup WHERE present = 0 AND absent = 0 AND justified = 0').rowcount
+
+
+# Rollup rows that differ from a full recount, as (key, stored counts,
+# recounted counts) tuples. Rows left at zero by deletes count as missing.
+def verify_rollups(conn):
+    stored = {tuple(row[:4]): tuple(row[4:]) for row in conn.execute('''
+        SELECT period, period_start, group_id, student_id, present, absent, justified
+        FROM attendance_rollup
+        WHERE present != 0 OR absent != 0 OR justified != 0
+    ''')}
+    recounted = {}
+    for sql, params in _recompute_queries():
+        recounted.update((tuple(row[:4]), tuple(row[4:])) for row in conn.execute(sql, params))
+
+    return [
+        (key, stored.get(key, (0, 0, 0)), recounted.get(key, (0, 0, 0)))
+        for key in sorted(set(stored) | set(recounted), key=str)
+        if stored.get(key) != recounted.get(key)
+    ]
+
+
+MAX_ROWS = 10000
+
+# What the rollups can be grouped by: the key columns and their joins
+DIMENSIONS = {
+    'students': {
+        'columns': ['r.student_id AS id', 's.name', 's.surname', 's.group_id'],
+        'joins': 'JOIN students s ON s.id = r.student_id',
+        'key': 'r.student_id',
+    },
+    'groups': {
+        'columns': ['r.group_id AS id', 'g.name', 'g.type', 'g.class_id'],
+        'joins': '',
+        'key': 'r.group_id',
+    },
+    'classes': {
+        'columns': ['g.class_id AS id', 'c.name', 'c.specialty', 'c.level', 'c.year'],
+        'joins': '',
+        'key': 'g.class_id',
+    },
+}
+
+# Narrowing of the rows, like the attendance report's scope plus a student
+FILTERS = {
+    'class_id': 'g.class_id = ?',
+    'group_id': 'r.group_id = ?',
+    'specialty': 'c.specialty = ?',
+    'student_id': 'r.student_id = ?',
+}
+
+
+# Build the query of GET /analytics/<by> from its arguments:
+#   period             week or month (default)
+#   from, to           dates, the periods containing them and those between
+#   class_id, group_id, specialty, student_id
+#   min_<status>, max_<status>   bounds on a count, e.g. min_absent=4
+#   limit              most rows returned (up to MAX_ROWS)
+# Returns (sql, params, limit). Raises ValueError for a bad argument.
+def build_rollup_query(by, args):
+    dimension = DIMENSIONS[by]
+    period = args.get('period') or 'month'
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of: {', '.join(PERIODS)}")
+
+    where, params = ['r.period = ?'], [period]
+    for name, operator in (('from', '>='), ('to', '<=')):
+        if args.get(name):
+            where.append(f"r.period_start {operator} {PERIODS[period].format('?')}")
+            params.append(args[name])
+
+    values = dict(report_scope(args))
+    if args.get('student_id') not in (None, ''):
+        try:
+            values['student_id'] = int(args['student_id'])
+        except ValueError:
+            raise ValueError('Invalid parameter: student_id')
+    for name, value in values.items():
+        where.append(FILTERS[name])
+        params.append(value)
+
+    having, having_params = [], []
+    for status in STATUSES:
+        for prefix, operator in (('min', '>='), ('max', '<=')):
+            value = args.get(f'{prefix}_{status}')
+            if value not in (None, ''):
+                try:
+                    having_params.append(int(value))
+                except ValueError:
+                    raise ValueError(f'{prefix}_{status} must be a number')
+                having.append(f'SUM(r.{status}) {operator} ?')
+
+    try:
+        limit = max(1, min(int(args.get('limit') or MAX_ROWS), MAX_ROWS))
+    except ValueError:
+        raise ValueError('limit must be a number')
+
+    sql = f'''
+        SELECT r.period_start, {', '.join(dimension['columns'])},
+               SUM(r.present) AS present, SUM(r.absent) AS absent, SUM(r.justified) AS justified
+        FROM attendance_rollup r
+        JOIN groups g ON g.id = r.group_id
+        JOIN classes c ON c.id = g.class_id
+        {dimension['joins']}
+        WHERE {' AND '.join(where)}
+        GROUP BY r.period_start, {dimension['key']}
+    '''
+    if having:
+        sql += f" HAVING {' AND '.join(having)}"
+    sql += f" ORDER BY r.period_start, {dimension['key']} LIMIT ?"
+    return sql, params + having_params + [limit + 1], limit
+
+
+# Rows of a rollup query with their recorded count and attendance rate
+# (present over RECORDED_STATUSES, as in the attendance statistics)
+def rollup(conn, by, args):
+    sql, params, limit = build_rollup_query(by, args)
+    rows = conn.execute(sql, params).fetchall()
+    truncated = len(rows) > limit
+
+    data = []
+    for row in rows[:limit]:
+        item = dict(row)
+        recorded = sum(item[status] for status in STATUSES)
+        item['recorded'] = recorded
+        item['attendance_rate'] = round(item['present'] / recorded, 4) if recorded else None
+        data.append(item)
+    return {'period': args.get('period') or 'month', 'data': data, 'truncated': truncated}
+
+
+def init_app(app):
+    @app.cli.command('attendance-rollups')
+    @click.option('--rebuild', is_flag=True, help='Recompute the rollups from the attendance table.')
+    def attendance_rollups_command(rebuild):
+        """Check (or rebuild) the weekly and monthly attendance rollups."""
+        conn = db.get_pool(app).connect()
+        try:
+            if rebuild:
+                conn.execute('BEGIN IMMEDIATE')
+                rebuild_rollups(conn)
+                conn.commit()
+                click.echo('attendance_rollup rebuilt.')
+            mismatches = verify_rollups(conn)
+        finally:
+            conn.close()
+
+        for key, stored, expected in mismatches[:20]:
+            click.echo(f'{key}: stored {stored}, recounted {expected}', err=True)
+        if mismatches:
+            click.echo(f'{len(mismatches)} rollup rows out of sync, run with --rebuild.', err=True)
+            sys.exit(1)
+        click.echo('attendance_rollup matches the attendance table.')
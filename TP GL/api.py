@@ -0,0 +1,210 @@
+import base64
+import binascii
+import json
+import re
+
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# What the JSON API can list.
+#   source   FROM clause
+#   fields   selectable field -> SQL expression
+#   filters  query argument -> column compared with '='
+#   ranges   query argument -> (column, operator)
+#   sorts    sort key -> columns of the keyset, always ending with the id so
+#            every row has a distinct position; each one matches an index
+#            (see migrations.create_api_indexes)
+RESOURCES = {
+    'classes': {
+        'source': 'classes c',
+        'fields': {'id': 'c.id', 'name': 'c.name', 'specialty': 'c.specialty', 'level': 'c.level', 'year': 'c.year'},
+        'filters': {'specialty': 'c.specialty', 'level': 'c.level', 'year': 'c.year'},
+        'ranges': {},
+        'sorts': {'id': ('c.id',), 'name': ('c.name', 'c.id')},
+    },
+    'groups': {
+        'source': 'groups g',
+        'fields': {'id': 'g.id', 'name': 'g.name', 'type': 'g.type', 'class_id': 'g.class_id'},
+        'filters': {'class_id': 'g.class_id', 'type': 'g.type'},
+        'ranges': {},
+        'sorts': {'id': ('g.id',), 'name': ('g.name', 'g.type', 'g.id')},
+    },
+    'students': {
+        'source': 'students s LEFT JOIN attendance_summary sm ON sm.student_id = s.id',
+        'fields': {
+            'id': 's.id', 'name': 's.name', 'surname': 's.surname', 'group_id': 's.group_id',
+            'sessions_attended': 'IFNULL(sm.present, 0)',
+            'absences': 'IFNULL(sm.absent, 0)',
+            'justified_absences': 'IFNULL(sm.justified, 0)',
+        },
+        'filters': {'group_id': 's.group_id'},
+        'ranges': {},
+        'sorts': {'id': ('s.id',), 'name': ('s.name', 's.surname', 's.id')},
+    },
+    'sessions': {
+        'source': 'sessions se',
+        'fields': {'id': 'se.id', 'group_id': 'se.group_id', 'date': 'se.date', 'time': 'se.time'},
+        'filters': {'group_id': 'se.group_id'},
+        'ranges': {'date_from': ('se.date', '>='), 'date_to': ('se.date', '<=')},
+        'sorts': {'id': ('se.id',), 'date': ('se.date', 'se.time', 'se.id')},
+    },
+}
+
+
+def _limit(args):
+    try:
+        limit = int(args.get('limit') or DEFAULT_LIMIT)
+    except ValueError:
+        raise ValueError('limit must be a number')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def encode_cursor(sort, values):
+    payload = json.dumps([sort, list(values)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort, size):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort or not isinstance(values, list) or len(values) != size:
+        raise ValueError('Cursor does not match the requested sort')
+    if not all(isinstance(value, (str, int, float)) for value in values):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+# Build the SELECT for one page of a resource from the query arguments.
+# Returns (sql, params, fields, keyset size, limit). Pages are found by
+# comparing the sort columns with the last row of the previous page (a row
+# value comparison the index can seek to), never by OFFSET.
+def build_query(resource, args):
+    spec = RESOURCES[resource]
+
+    fields = list(spec['fields'])
+    if args.get('fields'):
+        fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in spec['fields']]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+    sort = args.get('sort') or 'id'
+    descending = sort.startswith('-')
+    if sort.lstrip('-') not in spec['sorts']:
+        raise ValueError(f"Cannot sort by {sort.lstrip('-')}, use one of: {', '.join(spec['sorts'])}")
+    keyset = spec['sorts'][sort.lstrip('-')]
+
+    limit = _limit(args)
+
+    where, params = [], []
+    for name, column in spec['filters'].items():
+        if args.get(name) not in (None, ''):
+            where.append(f'{column} = ?')
+            params.append(args[name])
+    for name, (column, operator) in spec['ranges'].items():
+        if args.get(name) not in (None, ''):
+            where.append(f'{column} {operator} ?')
+            params.append(args[name])
+    if args.get('cursor'):
+        values = decode_cursor(args['cursor'], sort, len(keyset))
+        placeholders = ', '.join('?' * len(keyset))
+        where.append(f"({', '.join(keyset)}) {'<' if descending else '>'} ({placeholders})")
+        params.extend(values)
+
+    columns = [f"{spec['fields'][field]} AS {field}" for field in fields]
+    columns += [f'{column} AS _key{index}' for index, column in enumerate(keyset)]
+    order = ', '.join(f"{column} {'DESC' if descending else 'ASC'}" for column in keyset)
+
+    sql = f"SELECT {', '.join(columns)} FROM {spec['source']}"
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY {order} LIMIT ?'
+    params.append(limit + 1)
+
+    return sql, params, fields, len(keyset), limit
+
+
+# One page of a resource: {'data': [...], 'next_cursor': ... or None}.
+# Raises KeyError for an unknown resource, ValueError for bad arguments.
+def list_resource(conn, resource, args):
+    sql, params, fields, keyset_size, limit = build_query(resource, args)
+    rows = conn.execute(sql, params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(args.get('sort') or 'id', [last[f'_key{index}'] for index in range(keyset_size)])
+
+    return {
+        'data': [{field: row[field] for field in fields} for row in rows],
+        'next_cursor': next_cursor,
+        'limit': limit,
+    }
+
+
+# Students of every group matching a name search, best matches first, each
+# with its group and class. Goes through the students_fts index (see
+# migrations.create_student_search), never a scan of the students.
+SEARCH_STUDENTS = '''
+    SELECT s.id, s.name, s.surname, s.group_id,
+           g.name AS group_name, g.type AS group_type, g.class_id,
+           c.name AS class_name, c.specialty,
+           f.rank AS rank
+    FROM students_fts f
+    JOIN students s ON s.id = f.rowid
+    JOIN groups g ON g.id = s.group_id
+    JOIN classes c ON c.id = g.class_id
+    WHERE students_fts MATCH ?{after}
+    ORDER BY f.rank, f.rowid
+    LIMIT ?
+'''
+SEARCH_AFTER = ' AND (f.rank, f.rowid) > (?, ?)'
+
+SEARCH_FIELDS = ('id', 'name', 'surname', 'group_id', 'group_name', 'group_type', 'class_id', 'class_name', 'specialty')
+
+
+# The FTS5 query for what the user typed: every word must start one of the
+# names, in any order ("ben sa" finds "Saidi Benali"). Words are quoted so
+# FTS5 operators and punctuation in the input are taken literally.
+def match_expression(text):
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        raise ValueError('q must contain at least one letter or digit')
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+# Build the search query from ?q=, ?limit= and ?cursor=. Returns (sql,
+# params, limit); pages follow each other on (rank, id) like the keysets of
+# build_query.
+def build_search(args):
+    params = [match_expression(args.get('q'))]
+    limit = _limit(args)
+    after = ''
+    if args.get('cursor'):
+        params.extend(decode_cursor(args['cursor'], 'rank', 2))
+        after = SEARCH_AFTER
+    params.append(limit + 1)
+    return SEARCH_STUDENTS.format(after=after), params, limit
+
+
+# One page of search results, like list_resource. Raises ValueError for bad
+# arguments.
+def search_students(conn, args):
+    sql, params, limit = build_search(args)
+    rows = conn.execute(sql, params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor('rank', [rows[-1]['rank'], rows[-1]['id']])
+
+    return {
+        'data': [{field: row[field] for field in SEARCH_FIELDS} for row in rows],
+        'next_cursor': next_cursor,
+        'limit': limit,
+    }
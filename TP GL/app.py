@@ -1,688 +1,884 @@
-from flask import Flask, render_template, request, redirect, url_for,Response,flash,send_file, jsonify,  send_from_directory
-import sqlite3
-import os
-import xlsxwriter
-import io
-import openpyxl
-from io import BytesIO
-
-
-app = Flask(__name__)
-# Use an environment variable to set the secret key
-app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'default_secret_key')
-
-
-# Function to connect to the database
-def get_db_connection():
-    conn = sqlite3.connect('school.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-@app.route('/')
-def welcome():
-    return render_template('index.html')  # Render the welcome page
-
-
-
-# Route to display all classes
-@app.route('/classes')
-def classes():
-    conn = get_db_connection()
-    classes = conn.execute('SELECT * FROM classes').fetchall()
-    conn.close()
-    return render_template('classes.html', classes=classes)
-
-# Add a new class
-@app.route('/add-class', methods=['GET', 'POST'])
-def add_class():
-    if request.method == 'POST':
-        name = request.form['class-name']
-        specialty = request.form['specialty']
-        level = request.form['level']
-        year = request.form['year']
-
-        conn = get_db_connection()
-        conn.execute(
-            'INSERT INTO classes (name, specialty, level, year) VALUES (?, ?, ?, ?)',
-            (name, specialty, level, year)
-        )
-        conn.commit()
-        conn.close()
-        return redirect('/classes')
-
-    return render_template('add-class.html')
-
-# Edit a class
-@app.route('/edit-class/<int:class_id>', methods=['GET', 'POST'])
-def edit_class(class_id):
-    conn = get_db_connection()
-    class_data = conn.execute('SELECT * FROM classes WHERE id = ?', (class_id,)).fetchone()
-
-    if request.method == 'POST':
-        name = request.form['class-name']
-        specialty = request.form['specialty']
-        level = request.form['level']
-        year = request.form['year']
-
-        conn.execute(
-            'UPDATE classes SET name = ?, specialty = ?, level = ?, year = ? WHERE id = ?',
-            (name, specialty, level, year, class_id)
-        )
-        conn.commit()
-        conn.close()
-        return redirect('/classes')
-
-    conn.close()
-    return render_template('edit-class.html', class_data=class_data)
-
-# Delete a class
-@app.route('/delete-class/<int:class_id>', methods=['POST'])
-def delete_class(class_id):
-    conn = get_db_connection()
-    conn.execute('DELETE FROM classes WHERE id = ?', (class_id,))
-    conn.commit()
-    conn.close()
-    return redirect('/classes')
-
-# Display groups for a specific class
-@app.route('/class/<int:class_id>/groups')
-def groups(class_id):
-    conn = get_db_connection()
-    class_data = conn.execute('SELECT * FROM classes WHERE id = ?', (class_id,)).fetchone()
-    groups = conn.execute('SELECT * FROM groups WHERE class_id = ?', (class_id,)).fetchall()
-    conn.close()
-    return render_template('groups.html', class_data=class_data, groups=groups, class_id=class_id)
-
-# Add a group to a class
-@app.route('/class/<int:class_id>/add-group', methods=['GET', 'POST'])
-def add_group(class_id):
-    if request.method == 'POST':
-        name = request.form['group-name']
-        group_type = request.form['group-type']
-
-        conn = get_db_connection()
-        conn.execute(
-            'INSERT INTO groups (name, type, class_id) VALUES (?, ?, ?)',
-            (name, group_type, class_id)
-        )
-        conn.commit()
-        conn.close()
-        return redirect(url_for('groups', class_id=class_id))
-
-    return render_template('add-group.html', class_id=class_id)
-
-# Edit a group
-@app.route('/edit-group/<int:group_id>', methods=['GET', 'POST'])
-def edit_group(group_id):
-    conn = get_db_connection()
-    group_data = conn.execute('SELECT * FROM groups WHERE id = ?', (group_id,)).fetchone()
-
-    if request.method == 'POST':
-        name = request.form['group-name']
-        group_type = request.form['group-type']
-
-        conn.execute(
-            'UPDATE groups SET name = ?, type = ? WHERE id = ?',
-            (name, group_type, group_id)
-        )
-        conn.commit()
-        conn.close()
-        return redirect(url_for('groups', class_id=group_data['class_id']))
-
-    conn.close()
-    return render_template('edit-group.html', group_data=group_data)
-
-# Delete a group
-@app.route('/delete-group/<int:group_id>', methods=['POST'])
-def delete_group(group_id):
-    conn = get_db_connection()
-    group_data = conn.execute('SELECT * FROM groups WHERE id = ?', (group_id,)).fetchone()
-
-    conn.execute('DELETE FROM groups WHERE id = ?', (group_id,))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('groups', class_id=group_data['class_id']))
-
-# Display students in a group
-@app.route('/export-attendance', methods=['GET', 'POST'])
-def export_attendance():
-    if request.method == 'POST':
-        # Get date range from the form
-        date_debut = request.form.get('date_debut')
-        date_fin = request.form.get('date_fin')
-
-        if not date_debut or not date_fin:
-            return "Please provide both start and end dates.", 400
-
-        # Connect to the database
-        conn = get_db_connection()
-
-        # Fetch sessions within the date range
-        sessions = conn.execute('''
-            SELECT id, date 
-            FROM sessions 
-            WHERE date BETWEEN ? AND ?
-            ORDER BY date
-        ''', (date_debut, date_fin)).fetchall()
-
-        # If no sessions found, return a message
-        if not sessions:
-            conn.close()
-            return "No sessions found in the selected date range.", 404
-
-        # Fetch all students
-        students = conn.execute('SELECT id, name, surname FROM students ORDER BY id').fetchall()
-
-        # Fetch attendance records for the sessions
-        session_ids = tuple(session['id'] for session in sessions)
-        attendance_data = conn.execute(f'''
-            SELECT 
-                attendance.student_id,
-                attendance.session_id,
-                attendance.status
-            FROM attendance
-            WHERE attendance.session_id IN ({','.join('?' * len(session_ids))})
-        ''', session_ids).fetchall()
-        conn.close()
-
-        # Organize attendance data by student and session
-        attendance_dict = {}
-        for record in attendance_data:
-            student_id = record['student_id']
-            session_id = record['session_id']
-            attendance_dict[(student_id, session_id)] = record['status']
-
-        # Create Excel workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Attendance Report"
-
-        # Define headers with session names and dates
-        headers = ['Student Name', 'Student Surname']
-        headers.extend([f" ({session['date']})" for session in sessions])
-        ws.append(headers)
-
-        # Fill rows with attendance data
-        for student in students:
-            row = [student['name'], student['surname']]
-            for session in sessions:
-                status = attendance_dict.get((student['id'], session['id']), 'Present')  # Default to 'Present'
-                row.append(status)
-            ws.append(row)
-
-        # Save the workbook
-        filepath = "attendance_report.xlsx"
-        wb.save(filepath)
-
-        # Send the file for download
-        return send_file(filepath, as_attachment=True, download_name='Attendance_Report.xlsx')
-
-    # Render form to input date range
-    return render_template('export-attendance.html')
-
-
-@app.route('/group/<int:group_id>/students')
-def view_students(group_id):
-    try:
-        conn = get_db_connection()
-
-        # Fetch group details
-        group = conn.execute('SELECT * FROM groups WHERE id = ?', (group_id,)).fetchone()
-        if not group:
-            return f"Group with ID {group_id} not found.", 404
-
-        # Fetch students in the group
-        students = conn.execute('''
-            SELECT s.id, s.name, s.surname, 
-                   (SELECT COUNT(*) FROM attendance WHERE attendance.student_id = s.id AND attendance.status = 'present') AS sessions_attended
-            FROM students s
-            WHERE s.group_id = ?
-        ''', (group_id,)).fetchall()
-
-        conn.close()
-
-        return render_template('students.html', group=group, students=students)
-    except Exception as e:
-        return f"An error occurred: {str(e)}"
-
-@app.route('/group/<int:group_id>/student/new', methods=['GET', 'POST'])
-def add_student(group_id):
-    conn = get_db_connection()
-    group = conn.execute('SELECT * FROM groups WHERE id = ?', (group_id,)).fetchone()
-
-    if not group:
-        conn.close()
-        return f"Group with ID {group_id} not found.", 404
-
-    if request.method == 'POST':
-        # Extract form data
-        name = request.form.get('name')
-        surname = request.form.get('surname')
-
-        # Validate input
-        if not name or not surname:
-            conn.close()
-            return "Name and surname are required.", 400
-
-        # Insert new student into the database
-        conn.execute(
-            'INSERT INTO students (name, surname, group_id) VALUES (?, ?, ?)',
-            (name, surname, group_id)
-        )
-        conn.commit()
-        conn.close()
-
-        # Redirect to the students view page
-        return redirect(url_for('view_students', group_id=group_id))
-
-    conn.close()
-    # Render the add-student form
-    return render_template('add-student.html', group=group)
-@app.route('/add_students_excel/<int:group_id>', methods=['POST'])
-def add_students_excel(group_id):
-    if 'excel_file' not in request.files:
-        return "No file part", 400
-
-    file = request.files['excel_file']
-    if file.filename == '':
-        return "No selected file", 400
-
-    if not (file.filename.endswith('.xlsx') or file.filename.endswith('.xls')):
-        return "Invalid file format. Please upload an Excel file.", 400
-
-    # Load the Excel file
-    workbook = openpyxl.load_workbook(file)
-    sheet = workbook.active
-
-    # Parse the data and insert into the database
-    uploaded_students = []
-    with get_db_connection() as conn:
-        for row in sheet.iter_rows(min_row=2, values_only=True):  # Skip header row
-            name, surname = row
-            if name and surname:  # Ensure both fields are provided
-                conn.execute(
-                    'INSERT INTO students (name, surname, group_id) VALUES (?, ?, ?)',
-                    (name, surname, group_id)
-                )
-                uploaded_students.append({'name': name, 'surname': surname})
-        conn.commit()
-
-    # Fetch the group and render the template
-    with get_db_connection() as conn:
-        group = conn.execute('SELECT * FROM groups WHERE id = ?', (group_id,)).fetchone()
-    return render_template('add-student.html', group=group, uploaded_students=uploaded_students)
-
-
-
-@app.route('/export_students/<int:group_id>')
-def export_students(group_id):
-    # Fetch students from the database
-    conn = get_db_connection()
-    students = conn.execute(
-        'SELECT name, surname FROM students WHERE group_id = ?', (group_id,)
-    ).fetchall()
-    conn.close()
-
-    # Create an Excel workbook
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = "Students"
-
-    # Add headers
-    sheet.append(["Name", "Surname"])
-
-    # Add student data
-    for student in students:
-        sheet.append([student["name"], student["surname"]])
-
-    # Save the workbook to a BytesIO object
-    output = BytesIO()
-    workbook.save(output)
-    output.seek(0)
-
-    # Send the file as a response
-    return Response(
-        output,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment;filename=students_group_{group_id}.xlsx"}
-    )
-
-@app.route('/edit_student/<int:student_id>/<int:group_id>', methods=['GET', 'POST'])
-def edit_student(student_id, group_id):
-    conn = get_db_connection()
-
-    # Fetch the student details
-    student = conn.execute(
-        'SELECT * FROM students WHERE id = ?', (student_id,)
-    ).fetchone()
-
-    if not student:
-        conn.close()
-        flash('Student not found.', 'error')
-        return redirect(url_for('view_students', group_id=group_id))
-    
-    if request.method == 'POST':
-        # Get the updated data from the form
-        name = request.form.get('name')
-        surname = request.form.get('surname')
-
-        if not name or not surname:
-            flash('Name and surname are required.', 'error')
-        else:
-            try:
-                # Update the student's details in the database
-                conn.execute(
-                    'UPDATE students SET name = ?, surname = ? WHERE id = ?',
-                    (name, surname, student_id)
-                )
-                conn.commit()
-                flash('Student updated successfully!', 'success')
-            except Exception as e:
-                flash(f'Error updating student: {str(e)}', 'error')
-        
-        conn.close()
-        return redirect(url_for('view_students', group_id=group_id))
-    
-    conn.close()
-    # Render the edit form
-    return render_template('edit-student.html', student=student, group_id=group_id)
-@app.route('/group/<int:group_id>/student/<int:student_id>/delete', methods=['GET'])
-def delete_student(group_id, student_id):
-    conn = get_db_connection()
-    conn.execute('DELETE FROM students WHERE id = ?', (student_id,))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('view_students', group_id=group_id))
-
-
-@app.route('/session/<int:session_id>/manage_students', methods=['GET', 'POST'])
-def manage_students(session_id):
-    conn = get_db_connection()
-
-    # Fetch session details
-    session_data = conn.execute(
-        'SELECT id, date, time FROM sessions WHERE id = ?', (session_id,)
-    ).fetchone()
-
-    if not session_data:
-        conn.close()
-        return "Session not found", 404
-
-    # Fetch students in the group associated with this session
-    group_id = conn.execute(
-        'SELECT group_id FROM sessions WHERE id = ?', (session_id,)
-    ).fetchone()['group_id']
-
-    students = conn.execute(
-        '''
-        SELECT s.id, s.name, s.surname, a.status, a.observation
-        FROM students s
-        LEFT JOIN attendance a ON s.id = a.student_id AND a.session_id = ?
-        WHERE s.group_id = ?
-        ''', (session_id, group_id)
-    ).fetchall()
-
-    conn.close()
-
-    return render_template('manage_student.html', group_id=group_id,session_id=session_id, students=students)
-
-
-
-@app.route('/save_attendance/<group_id>/<session_id>', methods=['POST'])
-def save_attendance(group_id, session_id):
-    conn = get_db_connection()
-    
-    try:
-        # Get the list of students in the group
-        students = conn.execute('SELECT * FROM students WHERE group_id = ?', (group_id,)).fetchall()
-
-        for student in students:
-            student_id = student['id']
-            status = request.form.get(f'attendance_{student_id}[status]')
-            observation = request.form.get(f'attendance_{student_id}[observation]')
-
-            # Check if attendance record already exists for this student and session
-            existing_attendance = conn.execute('SELECT * FROM attendance WHERE student_id = ? AND session_id = ?',
-                                               (student_id, session_id)).fetchone()
-
-            if existing_attendance:
-                # Update the existing attendance record
-                conn.execute('''UPDATE attendance 
-                                SET status = ?, observation = ? 
-                                WHERE student_id = ? AND session_id = ?''',
-                             (status, observation, student_id, session_id))
-            else:
-                # Insert a new attendance record
-                conn.execute('''INSERT INTO attendance (student_id, session_id, status, observation) 
-                                VALUES (?, ?, ?, ?)''',
-                             (student_id, session_id, status, observation))
-
-            # If student is present, update the number of sessions attended
-            if status == 'present':
-                conn.execute('UPDATE students SET sessions_attended = sessions_attended + 1 WHERE id = ?',
-                             (student_id,))
-
-        # Commit the changes
-        conn.commit()
-
-        return redirect(url_for('view_sessions', group_id=group_id))
-    except Exception as e:
-        conn.rollback()
-        return f"An error occurred: {str(e)}", 500
-    finally:
-        conn.close()
-
-
-@app.route('/group/<int:group_id>/sessions', methods=['GET'])
-def view_sessions(group_id):
-    conn = get_db_connection()
-    try:
-        # Fetch all sessions for the given group
-        sessions = conn.execute('SELECT * FROM sessions WHERE group_id = ?', (group_id,)).fetchall()
-
-        # Fetch the group name and class_id for navigation
-        group_info = conn.execute('SELECT name, class_id FROM groups WHERE id = ?', (group_id,)).fetchone()
-        if not group_info:
-            return "Group not found", 404
-
-        group_name = group_info['name']
-        class_id = group_info['class_id']
-        return render_template('sessions.html', sessions=sessions, group_id=group_id, group_name=group_name, class_id=class_id)
-
-    except Exception as e:
-        return f"An error occurred: {e}"
-
-    finally:
-        conn.close()
-
-@app.route('/group/<int:group_id>/session/add', methods=['GET', 'POST'])
-def add_session(group_id):
-    if request.method == 'POST':
-        session_date = request.form['session-date']
-        session_time = request.form['session-time']
-
-        conn = get_db_connection()
-        conn.execute(
-            'INSERT INTO sessions (group_id, date, time) VALUES (?, ?, ?)',
-            (group_id, session_date, session_time)
-        )
-        conn.commit()
-        conn.close()
-
-        return redirect(url_for('view_sessions', group_id=group_id))
-
-    return render_template('add-session.html', group_id=group_id)
-
-@app.route('/group/<int:group_id>/session/edit/<int:session_id>', methods=['GET', 'POST'])
-def edit_session(group_id, session_id):
-    conn = get_db_connection()
-    session = conn.execute('SELECT * FROM sessions WHERE id = ?', (session_id,)).fetchone()
-
-    if request.method == 'POST':
-        session_date = request.form['session-date']
-        session_time = request.form['session-time']
-
-        conn.execute(
-            'UPDATE sessions SET  date = ?, time = ? WHERE id = ?',
-            ( session_date, session_time, session_id)
-        )
-        conn.commit()
-        conn.close()
-
-        return redirect(url_for('view_sessions', group_id=group_id))
-
-    conn.close()
-    return render_template('edit-session.html', session=session, group_id=group_id)
-
-@app.route('/group/<int:group_id>/session/delete/<int:session_id>', methods=['POST'])
-def delete_session(group_id, session_id):
-    try:
-        conn = get_db_connection()
-        conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
-        conn.commit()
-        conn.close()
-        return redirect(url_for('view_sessions', group_id=group_id))
-    except Exception as e:
-        return f"An error occurred while deleting the session: {e}"
-
-
-
-@app.route('/export_session/<int:session_id>')
-def export_session(session_id):
-    conn = get_db_connection()
-
-    # Retrieve session details
-    session = conn.execute('SELECT * FROM sessions WHERE id = ?', (session_id,)).fetchone()
-    if not session:
-        return "Session not found", 404
-
-    # Retrieve student attendance for the session
-    students = conn.execute('''
-        SELECT s.name, s.surname, a.status, a.observation
-        FROM students s
-        JOIN attendance a ON s.id = a.student_id
-        WHERE a.session_id = ?
-    ''', (session_id,)).fetchall()
-
-    conn.close()
-
-    # Create Excel file in memory
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-    worksheet = workbook.add_worksheet('Session Attendance')
-
-    # Write session details
-    worksheet.write('A1', 'Session ID')
-    worksheet.write('B1', session['id'])
-    worksheet.write('A2', 'Group ID')
-    worksheet.write('B2', session['group_id'] if 'group_id' in session.keys() else 'N/A')
-    worksheet.write('A3', 'Name')
-    worksheet.write('B3', session['name'] if 'name' in session.keys() else 'N/A')
-    worksheet.write('A4', 'Date')
-    worksheet.write('B4', session['date'] if 'date' in session.keys() else 'N/A')
-    worksheet.write('A5', 'Time')
-    worksheet.write('B5', session['time'] if 'time' in session.keys() else 'N/A')
-
-    # Write attendance table header
-    worksheet.write('A7', 'Name')
-    worksheet.write('B7', 'Surname')
-    worksheet.write('C7', 'Status')
-    worksheet.write('D7', 'Observation')
-
-    # Write attendance data
-    row = 7
-    for student in students:
-        worksheet.write(row, 0, student['name'])
-        worksheet.write(row, 1, student['surname'])
-        worksheet.write(row, 2, student['status'])
-        worksheet.write(row, 3, student['observation'])
-        row += 1
-
-    workbook.close()
-    output.seek(0)
-
-    # Send the file as a response
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=f'session_{session_id}_attendance.xlsx',
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-
-
-
-@app.route('/')
-def index():
-    return redirect('/classes')
-DOSSER_PATH = "./uploads"
-
-@app.route('/notification')
-def notification():
-    return render_template('notification.html')
-
-@app.route('/files')
-def list_files():
-    files = [f for f in os.listdir(DOSSER_PATH) if os.path.isfile(os.path.join(DOSSER_PATH, f))]
-    return jsonify(files)
-
-@app.route('/download/<filename>')
-def download_file(filename):
-    return send_from_directory(DOSSER_PATH, filename, as_attachment=True)
-
-
-
-if __name__ == '__main__':
-
-    # Initialize database tables if they do not exist
-    
-    conn = get_db_connection()
-    conn.execute('''CREATE TABLE IF NOT EXISTS classes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        specialty TEXT NOT NULL,
-        level TEXT NOT NULL,
-        year TEXT NOT NULL
-    )''')
-    conn.execute('''CREATE TABLE IF NOT EXISTS groups (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        type TEXT NOT NULL,
-        class_id INTEGER NOT NULL,
-        FOREIGN KEY (class_id) REFERENCES classes (id)
-    )''')
-    conn.execute('''CREATE TABLE IF NOT EXISTS students (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        surname TEXT NOT NULL,
-        sessions_attended INTEGER DEFAULT 0,
-        group_id INTEGER NOT NULL,
-        FOREIGN KEY (group_id) REFERENCES groups (id)
-                 
-    )''')
-
-    conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    group_id INTEGER NOT NULL,
-    date DATE NOT NULL,
-    time TIME NOT NULL,
-    FOREIGN KEY (group_id) REFERENCES groups (id)
-);
-''')
-    
-    conn.execute('''CREATE TABLE IF NOT EXISTS attendance (
-    student_id INTEGER,
-    session_id INTEGER,
-    status TEXT, -- 'present', 'absent', or 'justified'
-    observation TEXT,
-    PRIMARY KEY (student_id, session_id),
-    FOREIGN KEY (student_id) REFERENCES students(id),
-    FOREIGN KEY (session_id) REFERENCES sessions(id)
-);
-
-''')
-    conn.close()
-    
-
-    app.run(debug=True)
-    
-    
\ No newline at end of file
+from flask import Flask, render_template, request, redirect, url_for,Response,flash,send_file, jsonify,  send_from_directory, stream_with_context
+import sqlite3
+import os
+import xlsxwriter
+import io
+import openpyxl
+from io import BytesIO
+
+import analytics
+import api
+import db
+import downloads
+import file_watcher
+import http_cache
+import jobs
+import metrics
+import migrations
+import attendance
+import attendance_writer
+import compression
+import rendering
+import snapshot
+import repository
+import scheduling
+from db import get_db_connection
+from attendance import save_session_attendance
+from student_import import read_student_rows, import_students, summarize as summarize_import
+from attendance_matrix import load_attendance_matrix, report_scope
+from exports import ROSTER_LAYOUTS, roster_filters, stream_attendance_report, stream_students_roster
+from xlsx_stream import XLSX_MIMETYPE
+
+
+app = Flask(__name__)
+# Use an environment variable to set the secret key
+app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'default_secret_key')
+
+# Pooled SQLite connections, released automatically at the end of each request
+db.init_app(app)
+
+# Create or upgrade the schema at startup (also under a WSGI server)
+migrations.init_app(app)
+
+# Route, query and template timings for /metrics (after the migrations, so
+# the schema statements are not counted)
+metrics.init_app(app)
+
+# 'flask attendance-summary' check/rebuild command
+attendance.init_app(app)
+
+# 'flask attendance-rollups' check/rebuild command
+analytics.init_app(app)
+
+# Point-in-time copies of the database that the exports and reports read,
+# refreshed every SNAPSHOT_REFRESH seconds (before jobs, which reads them)
+snapshot.init_app(app)
+
+# Background export jobs and their on-disk result cache
+jobs.init_app(app)
+
+# Single writer committing the JSON API's attendance changes in batches
+attendance_writer.init_app(app)
+
+# Rendered pages cached per entity version, with ETags (see http_cache.cached)
+http_cache.init_app(app)
+
+# Templates compiled at startup, and the cached row fragments of the long
+# pages (see rendering.fragment)
+rendering.init_app(app)
+
+# gzip/brotli responses, static files compressed once in memory
+compression.init_app(app)
+
+@app.route('/')
+def welcome():
+    return render_template('index.html')  # Render the welcome page
+
+
+
+# Route to display all classes
+@app.route('/classes')
+@http_cache.cached(lambda: [('classes', 0)])
+def classes():
+    conn = get_db_connection()
+    classes = repository.all_classes(conn)
+    return render_template('classes.html', classes=classes)
+
+# Add a new class
+@app.route('/add-class', methods=['GET', 'POST'])
+def add_class():
+    if request.method == 'POST':
+        name = request.form['class-name']
+        specialty = request.form['specialty']
+        level = request.form['level']
+        year = request.form['year']
+
+        conn = get_db_connection()
+        conn.execute(
+            'INSERT INTO classes (name, specialty, level, year) VALUES (?, ?, ?, ?)',
+            (name, specialty, level, year)
+        )
+        conn.commit()
+        return redirect('/classes')
+
+    return render_template('add-class.html')
+
+# Edit a class
+@app.route('/edit-class/<int:class_id>', methods=['GET', 'POST'])
+def edit_class(class_id):
+    conn = get_db_connection()
+    class_data = repository.get_class(conn, class_id)
+
+    if request.method == 'POST':
+        name = request.form['class-name']
+        specialty = request.form['specialty']
+        level = request.form['level']
+        year = request.form['year']
+
+        conn.execute(
+            'UPDATE classes SET name = ?, specialty = ?, level = ?, year = ? WHERE id = ?',
+            (name, specialty, level, year, class_id)
+        )
+        conn.commit()
+        return redirect('/classes')
+
+    return render_template('edit-class.html', class_data=class_data)
+
+# Delete a class
+@app.route('/delete-class/<int:class_id>', methods=['POST'])
+def delete_class(class_id):
+    conn = get_db_connection()
+    # Its groups and everything under them go with it (ON DELETE CASCADE)
+    conn.execute('DELETE FROM classes WHERE id = ?', (class_id,))
+    conn.commit()
+    return redirect('/classes')
+
+# Display groups for a specific class
+@app.route('/class/<int:class_id>/groups')
+@http_cache.cached(lambda class_id: [('class', class_id)])
+def groups(class_id):
+    conn = get_db_connection()
+    class_data = repository.get_class(conn, class_id)
+    groups = repository.groups_of_class(conn, class_id)
+    return render_template('groups.html', class_data=class_data, groups=groups, class_id=class_id)
+
+# Add a group to a class
+@app.route('/class/<int:class_id>/add-group', methods=['GET', 'POST'])
+def add_group(class_id):
+    if request.method == 'POST':
+        name = request.form['group-name']
+        group_type = request.form['group-type']
+
+        conn = get_db_connection()
+        conn.execute(
+            'INSERT INTO groups (name, type, class_id) VALUES (?, ?, ?)',
+            (name, group_type, class_id)
+        )
+        conn.commit()
+        return redirect(url_for('groups', class_id=class_id))
+
+    return render_template('add-group.html', class_id=class_id)
+
+# Edit a group
+@app.route('/edit-group/<int:group_id>', methods=['GET', 'POST'])
+def edit_group(group_id):
+    conn = get_db_connection()
+    group_data = repository.get_group(conn, group_id)
+
+    if request.method == 'POST':
+        name = request.form['group-name']
+        group_type = request.form['group-type']
+
+        conn.execute(
+            'UPDATE groups SET name = ?, type = ? WHERE id = ?',
+            (name, group_type, group_id)
+        )
+        conn.commit()
+        return redirect(url_for('groups', class_id=group_data['class_id']))
+
+    return render_template('edit-group.html', group_data=group_data)
+
+# Delete a group
+@app.route('/delete-group/<int:group_id>', methods=['POST'])
+def delete_group(group_id):
+    conn = get_db_connection()
+    # The group's students, sessions and attendance go with it (ON DELETE CASCADE)
+    deleted = conn.execute('DELETE FROM groups WHERE id = ? RETURNING class_id', (group_id,)).fetchall()
+    conn.commit()
+    if not deleted:
+        return redirect('/classes')
+    return redirect(url_for('groups', class_id=deleted[0]['class_id']))
+
+# Display students in a group
+@app.route('/export-attendance', methods=['GET', 'POST'])
+def export_attendance():
+    if request.method == 'POST':
+        # Get date range from the form
+        date_debut = request.form.get('date_debut')
+        date_fin = request.form.get('date_fin')
+
+        if not date_debut or not date_fin:
+            return "Please provide both start and end dates.", 400
+
+        # Optional class_id / group_id / specialty, from the form or the URL
+        try:
+            scope = report_scope(request.values)
+        except ValueError as e:
+            return str(e), 400
+
+        if jobs.get_queue().processes:
+            return offloaded_export('attendance', request.values)
+
+        # Read the latest snapshot of the database
+        conn = snapshot.get_report_connection()
+
+        # Students of the groups that held sessions in the range, with their attendance
+        matrix = load_attendance_matrix(conn, date_debut, date_fin, scope)
+
+        # If no sessions found, return a message
+        if not matrix.sessions:
+            return "No sessions found in the selected date range.", 404
+
+        # Stream the workbook row by row
+        return Response(
+            stream_attendance_report(matrix),
+            mimetype=XLSX_MIMETYPE,
+            headers={"Content-Disposition": "attachment;filename=Attendance_Report.xlsx"}
+        )
+
+    # Render form to input date range
+    return render_template('export-attendance.html')
+
+
+STUDENTS_PAGE_SIZE = 100
+
+@app.route('/group/<int:group_id>/students')
+@http_cache.cached(lambda group_id: [('group', group_id)])
+def view_students(group_id):
+    try:
+        conn = get_db_connection()
+
+        # Fetch group details
+        group = repository.get_group(conn, group_id)
+        if not group:
+            return f"Group with ID {group_id} not found.", 404
+
+        # First page of the students with their attendance counts, the page
+        # loads the rest from /api/students as the user asks for them
+        page = api.list_resource(conn, 'students', {'group_id': group_id, 'sort': 'name', 'limit': STUDENTS_PAGE_SIZE})
+
+        return render_template('students.html', group=group, students=page['data'], next_cursor=page['next_cursor'])
+    except Exception as e:
+        return f"An error occurred: {str(e)}"
+
+@app.route('/group/<int:group_id>/student/new', methods=['GET', 'POST'])
+def add_student(group_id):
+    conn = get_db_connection()
+    group = repository.get_group(conn, group_id)
+
+    if not group:
+        return f"Group with ID {group_id} not found.", 404
+
+    if request.method == 'POST':
+        # Extract form data
+        name = request.form.get('name')
+        surname = request.form.get('surname')
+
+        # Validate input
+        if not name or not surname:
+            return "Name and surname are required.", 400
+
+        # Insert new student into the database
+        conn.execute(
+            'INSERT INTO students (name, surname, group_id) VALUES (?, ?, ?)',
+            (name, surname, group_id)
+        )
+        conn.commit()
+
+        # Redirect to the students view page
+        return redirect(url_for('view_students', group_id=group_id))
+
+    # Render the add-student form
+    return render_template('add-student.html', group=group)
+@app.route('/add_students_excel/<int:group_id>', methods=['POST'])
+def add_students_excel(group_id):
+    if 'excel_file' not in request.files:
+        return "No file part", 400
+
+    file = request.files['excel_file']
+    if file.filename == '':
+        return "No selected file", 400
+
+    conn = get_db_connection()
+    group = repository.get_group(conn, group_id)
+    if not group:
+        return f"Group with ID {group_id} not found.", 404
+
+    # Stream the rows from the file and insert them in batches
+    try:
+        rows = read_student_rows(file.stream, file.filename)
+        import_report = import_students(conn, group_id, rows)
+    except ValueError as e:
+        return str(e), 400
+
+    return render_template('add-student.html', group=group, import_report=import_report,
+                           import_counts=summarize_import(import_report))
+
+
+
+@app.route('/export_students/<int:group_id>')
+@http_cache.cached(lambda group_id: [('group', group_id)])
+def export_students(group_id):
+    if jobs.get_queue().processes:
+        return offloaded_export('students', {'group_id': group_id})
+
+    # Fetch students from the database
+    conn = get_db_connection()
+    students = conn.execute(
+        'SELECT name, surname FROM students WHERE group_id = ?', (group_id,)
+    ).fetchall()
+
+    # Create an Excel workbook
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Students"
+
+    # Add headers
+    sheet.append(["Name", "Surname"])
+
+    # Add student data
+    for student in students:
+        sheet.append([student["name"], student["surname"]])
+
+    # Save the workbook to a BytesIO object
+    output = BytesIO()
+    workbook.save(output)
+    output.seek(0)
+
+    # Send the file as a response
+    return Response(
+        output,
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment;filename=students_group_{group_id}.xlsx"}
+    )
+
+# Students of several groups in one file: ?class_id=, ?specialty=, ?level=,
+# ?year= and ?group_id=1,2 (see exports.roster_filters), laid out with
+# ?layout=sheets (one sheet per group, the default), combined (one sheet) or
+# zip (one file per group). Streamed from one query on the latest snapshot.
+@app.route('/export_students')
+def export_students_roster():
+    layout = request.args.get('layout') or 'sheets'
+    if layout not in ROSTER_LAYOUTS:
+        return f"layout must be one of: {', '.join(ROSTER_LAYOUTS)}", 400
+    try:
+        filters = roster_filters(request.args)
+        chunks = stream_students_roster(snapshot.get_report_connection(), filters, layout)
+    except ValueError as e:
+        return str(e), 400
+    except LookupError as e:
+        return str(e), 404
+
+    download_name = f"students_class_{filters['class_id']}" if 'class_id' in filters else 'students'
+    if layout == 'zip':
+        mimetype, download_name = 'application/zip', download_name + '.zip'
+    else:
+        mimetype, download_name = XLSX_MIMETYPE, download_name + '.xlsx'
+    # The request, and so its connection, lasts until the file is sent
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment;filename={download_name}'}
+    )
+
+@app.route('/edit_student/<int:student_id>/<int:group_id>', methods=['GET', 'POST'])
+def edit_student(student_id, group_id):
+    conn = get_db_connection()
+
+    # Fetch the student details
+    student = conn.execute(
+        'SELECT * FROM students WHERE id = ?', (student_id,)
+    ).fetchone()
+
+    if not student:
+        flash('Student not found.', 'error')
+        return redirect(url_for('view_students', group_id=group_id))
+    
+    if request.method == 'POST':
+        # Get the updated data from the form
+        name = request.form.get('name')
+        surname = request.form.get('surname')
+
+        if not name or not surname:
+            flash('Name and surname are required.', 'error')
+        else:
+            try:
+                # Update the student's details in the database
+                conn.execute(
+                    'UPDATE students SET name = ?, surname = ? WHERE id = ?',
+                    (name, surname, student_id)
+                )
+                conn.commit()
+                flash('Student updated successfully!', 'success')
+            except Exception as e:
+                flash(f'Error updating student: {str(e)}', 'error')
+        
+        return redirect(url_for('view_students', group_id=group_id))
+    
+    # Render the edit form
+    return render_template('edit-student.html', student=student, group_id=group_id)
+@app.route('/group/<int:group_id>/student/<int:student_id>/delete', methods=['GET'])
+def delete_student(group_id, student_id):
+    conn = get_db_connection()
+    conn.execute('DELETE FROM students WHERE id = ?', (student_id,))
+    conn.commit()
+    return redirect(url_for('view_students', group_id=group_id))
+
+
+@app.route('/session/<int:session_id>/manage_students', methods=['GET', 'POST'])
+def manage_students(session_id):
+    conn = get_db_connection()
+
+    # The session, its group and the group's students with their attendance,
+    # in one query
+    roster = repository.load_session_roster(conn, session_id)
+    if roster is None:
+        return "Session not found", 404
+    session_data, group, students = roster
+
+    return render_template('manage_student.html', group_id=session_data['group_id'], session_id=session_id,
+                           students=students)
+
+
+
+@app.route('/save_attendance/<int:group_id>/<int:session_id>', methods=['POST'])
+def save_attendance(group_id, session_id):
+    conn = get_db_connection()
+    
+    try:
+        # Get the list of students in the group
+        student_ids = repository.student_ids_of_group(conn, group_id)
+
+        records = []
+        for student_id in student_ids:
+            status = request.form.get(f'attendance_{student_id}[status]')
+            observation = request.form.get(f'attendance_{student_id}[observation]')
+            records.append((student_id, status, observation))
+
+        # Upsert every row and adjust sessions_attended in one transaction
+        save_session_attendance(conn, session_id, records)
+
+        return redirect(url_for('view_sessions', group_id=group_id))
+    except Exception as e:
+        conn.rollback()
+        return f"An error occurred: {str(e)}", 500
+
+@app.route('/group/<int:group_id>/sessions', methods=['GET'])
+@http_cache.cached(lambda group_id: [('group', group_id)])
+def view_sessions(group_id):
+    conn = get_db_connection()
+    try:
+        # Fetch the group name and class_id for navigation
+        group_info = repository.get_group(conn, group_id)
+        if not group_info:
+            return "Group not found", 404
+
+        # Fetch all sessions for the given group
+        sessions = repository.sessions_of_group(conn, group_id)
+
+        group_name = group_info['name']
+        class_id = group_info['class_id']
+        return render_template('sessions.html', sessions=sessions, group_id=group_id, group_name=group_name, class_id=class_id)
+
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+@app.route('/group/<int:group_id>/session/add', methods=['GET', 'POST'])
+def add_session(group_id):
+    if request.method == 'POST':
+        session_date = request.form['session-date']
+        session_time = request.form['session-time']
+
+        conn = get_db_connection()
+        conn.execute(
+            'INSERT INTO sessions (group_id, date, time) VALUES (?, ?, ?)',
+            (group_id, session_date, session_time)
+        )
+        conn.commit()
+
+        return redirect(url_for('view_sessions', group_id=group_id))
+
+    return render_template('add-session.html', group_id=group_id)
+
+# Weekly sessions of a group, or of every group of a class (?group_id= or
+# ?class_id=), for a whole date range at once: Preview lists the sessions and
+# those that already exist, Create writes them in one transaction
+@app.route('/sessions/schedule', methods=['GET', 'POST'])
+def schedule_sessions_page():
+    conn = get_db_connection()
+    values = request.values.to_dict()
+    try:
+        if values.get('group_id'):
+            group = repository.get_group(conn, int(values['group_id']))
+            class_data, groups = None, [group] if group else []
+        else:
+            group, class_data = None, repository.get_class(conn, int(values.get('class_id') or 0))
+            groups = repository.groups_of_class(conn, class_data['id']) if class_data else []
+    except ValueError:
+        return "Invalid group or class.", 400
+    if not group and not class_data:
+        return "Group or class not found.", 404
+
+    result = error = None
+    if request.method == 'POST':
+        try:
+            schedule = scheduling.parse_schedule(values)
+            result = scheduling.schedule_sessions(conn, schedule, dry_run=values.get('action') != 'create')
+        except (ValueError, LookupError, sqlite3.IntegrityError) as e:
+            error = str(e)
+
+    group_names = {row['id']: row['name'] for row in groups}
+    return render_template('schedule-sessions.html', group=group, class_data=class_data, values=values,
+                           result=result, error=error, group_names=group_names), 400 if error else 200
+
+@app.route('/group/<int:group_id>/session/edit/<int:session_id>', methods=['GET', 'POST'])
+def edit_session(group_id, session_id):
+    conn = get_db_connection()
+    session = repository.get_session(conn, session_id)
+
+    if request.method == 'POST':
+        session_date = request.form['session-date']
+        session_time = request.form['session-time']
+
+        conn.execute(
+            'UPDATE sessions SET  date = ?, time = ? WHERE id = ?',
+            ( session_date, session_time, session_id)
+        )
+        conn.commit()
+
+        return redirect(url_for('view_sessions', group_id=group_id))
+
+    return render_template('edit-session.html', session=session, group_id=group_id)
+
+@app.route('/group/<int:group_id>/session/delete/<int:session_id>', methods=['POST'])
+def delete_session(group_id, session_id):
+    try:
+        conn = get_db_connection()
+        conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+        conn.commit()
+        return redirect(url_for('view_sessions', group_id=group_id))
+    except Exception as e:
+        return f"An error occurred while deleting the session: {e}"
+
+
+
+@app.route('/export_session/<int:session_id>')
+def export_session(session_id):
+    if jobs.get_queue().processes:
+        return offloaded_export('session', {'session_id': session_id})
+
+    conn = snapshot.get_report_connection()
+
+    # Retrieve session details
+    session = repository.get_session(conn, session_id)
+    if not session:
+        return "Session not found", 404
+
+    # Retrieve student attendance for the session
+    students = conn.execute('''
+        SELECT s.name, s.surname, a.status, a.observation
+        FROM students s
+        JOIN attendance a ON s.id = a.student_id
+        WHERE a.session_id = ?
+    ''', (session_id,)).fetchall()
+
+
+    # Create Excel file in memory
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    worksheet = workbook.add_worksheet('Session Attendance')
+
+    # Write session details
+    worksheet.write('A1', 'Session ID')
+    worksheet.write('B1', session['id'])
+    worksheet.write('A2', 'Group ID')
+    worksheet.write('B2', session['group_id'] if 'group_id' in session.keys() else 'N/A')
+    worksheet.write('A3', 'Name')
+    worksheet.write('B3', session['name'] if 'name' in session.keys() else 'N/A')
+    worksheet.write('A4', 'Date')
+    worksheet.write('B4', session['date'] if 'date' in session.keys() else 'N/A')
+    worksheet.write('A5', 'Time')
+    worksheet.write('B5', session['time'] if 'time' in session.keys() else 'N/A')
+
+    # Write attendance table header
+    worksheet.write('A7', 'Name')
+    worksheet.write('B7', 'Surname')
+    worksheet.write('C7', 'Status')
+    worksheet.write('D7', 'Observation')
+
+    # Write attendance data
+    row = 7
+    for student in students:
+        worksheet.write(row, 0, student['name'])
+        worksheet.write(row, 1, student['surname'])
+        worksheet.write(row, 2, student['status'])
+        worksheet.write(row, 3, student['observation'])
+        row += 1
+
+    workbook.close()
+    output.seek(0)
+
+    # Send the file as a response
+    return send_file(
+        output,
+        as_attachment=True,
+        download_name=f'session_{session_id}_attendance.xlsx',
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+
+
+# Queue an export in the background, answers with the job to poll
+@app.route('/exports/<export_type>', methods=['POST'])
+def submit_export(export_type):
+    values = request.get_json(silent=True) or request.form.to_dict()
+    try:
+        job = jobs.get_queue().submit(get_db_connection(), export_type, values)
+    except KeyError:
+        return jsonify({'error': f'Unknown export type: {export_type}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(export_job_json(job)), 202
+
+# Status and progress of an export job
+@app.route('/exports/jobs/<job_id>')
+def export_job_status(job_id):
+    job = jobs.get_queue().get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(export_job_json(job))
+
+# Download the file of a finished export job
+@app.route('/exports/jobs/<job_id>/download')
+def download_export(job_id):
+    queue = jobs.get_queue()
+    job = queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status != 'done':
+        return jsonify(export_job_json(job)), 409
+
+    path = queue.result_path(job)
+    if not path:
+        return jsonify({'error': 'Export expired, please request it again'}), 410
+    return send_file(path, as_attachment=True, download_name=job.download_name, mimetype=XLSX_MIMETYPE)
+
+# Jobs by status and cache usage
+@app.route('/exports')
+def export_stats():
+    return jsonify(jobs.get_queue().stats())
+
+# With EXPORT_PROCESSES set, the export routes have their file built by an
+# export worker process (through the job queue, so also cached and shared
+# with identical requests) and send it once it is ready. The request thread
+# only waits meanwhile, without a pooled connection and for EXPORT_WAIT
+# seconds at most; a longer export answers with its job to poll instead.
+def offloaded_export(export_type, values):
+    queue = jobs.get_queue()
+    job = queue.submit(get_db_connection(), export_type, values)
+    db.release_db_connection()
+    if not queue.wait(job, app.config['EXPORT_WAIT']):
+        return jsonify(export_job_json(job)), 202
+    if job.status != 'done':
+        return job.error, 404 if job.not_found else 500
+
+    path = queue.result_path(job)
+    if not path:
+        return "Export expired, please request it again", 410
+    return send_file(path, as_attachment=True, download_name=job.download_name, mimetype=XLSX_MIMETYPE)
+
+def export_job_json(job):
+    data = job.to_dict()
+    data['status_url'] = url_for('export_job_status', job_id=job.id)
+    if job.status == 'done':
+        data['download_url'] = url_for('download_export', job_id=job.id)
+    return data
+
+
+@app.route('/')
+def index():
+    return redirect('/classes')
+DOSSER_PATH = "./uploads"
+
+# One background watcher over DOSSER_PATH keeps the file list in memory and
+# pushes the changes to the notification page
+file_watcher.init_app(app, DOSSER_PATH)
+
+# Hashes of the uploaded files for the download ETags and digests
+downloads.init_app(app, file_watcher.get_watcher(app))
+
+@app.route('/notification')
+def notification():
+    return render_template('notification.html')
+
+@app.route('/files')
+def list_files():
+    return jsonify(file_watcher.get_watcher().list_files())
+
+# Server-Sent Events: a 'snapshot' of the files, then 'files' events with the
+# added/removed names. Reconnecting clients send Last-Event-ID and only get
+# what they missed.
+@app.route('/files/events')
+def file_events():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return Response(
+        file_watcher.stream_events(file_watcher.get_watcher(), last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Resumable downloads: byte ranges (206), If-Range/If-None-Match against the
+# file's SHA-256 ETag, and a Repr-Digest header to check the whole file
+@app.route('/download/<filename>')
+def download_file(filename):
+    response = downloads.send_upload(downloads.get_index(), filename, as_attachment=True)
+    if response is None:
+        return "File not found", 404
+    return response
+
+# Read-only JSON listings paginated by keyset: pass next_cursor back as
+# ?cursor= for the following page. ?fields=, ?sort= (prefix with - for
+# descending), ?limit= and the filters of each resource are in api.RESOURCES.
+@app.route('/api/<resource>')
+def api_list(resource):
+    if resource not in api.RESOURCES:
+        return jsonify({'error': f'Unknown resource: {resource}'}), 404
+    try:
+        page = api.list_resource(get_db_connection(), resource, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if page['next_cursor']:
+        page['next_url'] = url_for('api_list', resource=resource, **dict(request.args.to_dict(), cursor=page['next_cursor']))
+    return jsonify(page)
+
+# Students of all groups whose name or surname start with the words of ?q=
+# (accents ignored), best matches first, with their group and class;
+# paginated with ?limit= and ?cursor= like /api/<resource>
+@app.route('/api/students/search')
+def api_search_students():
+    try:
+        page = api.search_students(get_db_connection(), request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if page['next_cursor']:
+        page['next_url'] = url_for('api_search_students', **dict(request.args.to_dict(), cursor=page['next_cursor']))
+    return jsonify(page)
+
+# Attendance changes from the tablets, any number of students and sessions
+# at once (see attendance_writer.parse_changes for the body). Each change is
+# kept unless the row was changed at a later client time. Answers once the
+# changes are committed to disk, with how many were applied; a request that
+# timed out can be sent again as is.
+@app.route('/api/attendance', methods=['POST'])
+def api_save_attendance():
+    try:
+        records = attendance_writer.parse_changes(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Every student must be in the group of the session
+    conn = get_db_connection()
+    rosters = {}
+    for student_id, session_id, status, observation, changed_at in records:
+        if session_id not in rosters:
+            session = repository.get_session(conn, session_id)
+            if not session:
+                return jsonify({'error': f'Session {session_id} not found'}), 404
+            rosters[session_id] = set(repository.student_ids_of_group(conn, session['group_id']))
+        if student_id not in rosters[session_id]:
+            return jsonify({'error': f'Student {student_id} is not in the group of session {session_id}'}), 400
+    # Do not hold a pooled connection while waiting for the writer
+    db.release_db_connection()
+
+    submission = attendance_writer.get_writer().write(records)
+    if not submission.done.is_set():
+        return jsonify({'error': 'The changes were not written in time, send them again'}), 504
+    if submission.error:
+        return jsonify({'error': submission.error}), 409
+    return jsonify({
+        'changes': len(records),
+        'applied': submission.applied,
+        'ignored': len(records) - submission.applied,
+    })
+
+# Create recurring sessions in one transaction (see scheduling.parse_schedule
+# for the body). With "dry_run": true, answers with the sessions that would
+# be created and the conflicts without writing. 409 when on_conflict is
+# abort and some of the sessions already exist.
+@app.route('/api/sessions/schedule', methods=['POST'])
+def api_schedule_sessions():
+    values = request.get_json(silent=True)
+    try:
+        schedule = scheduling.parse_schedule(values)
+        result = scheduling.schedule_sessions(get_db_connection(), schedule, dry_run=values.get('dry_run') is True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except sqlite3.IntegrityError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(result), 409 if result['aborted'] and not result['dry_run'] else 200
+
+# Attendance statistics of a date range (date_debut/date_fin), narrowed like
+# the report by class_id, group_id or specialty: present, absent, justified
+# and unrecorded counts and the attendance rate, per student or per session,
+# with the overall totals
+@app.route('/stats/attendance/<by>')
+def attendance_stats(by):
+    if by not in ('students', 'sessions'):
+        return jsonify({'error': 'Statistics are by students or by sessions'}), 404
+    date_debut = request.args.get('date_debut')
+    date_fin = request.args.get('date_fin')
+    if not date_debut or not date_fin:
+        return jsonify({'error': 'Please provide both start and end dates.'}), 400
+    try:
+        scope = report_scope(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    matrix = load_attendance_matrix(snapshot.get_report_connection(), date_debut, date_fin, scope)
+    return jsonify({
+        'date_debut': date_debut,
+        'date_fin': date_fin,
+        'scope': scope,
+        'summary': matrix.summary(),
+        by: matrix.student_stats() if by == 'students' else matrix.session_stats(),
+    })
+
+# Attendance counts per week or month from the rollup tables, by students,
+# groups or classes: ?period=week|month, ?from= and ?to= dates, the report's
+# class_id/group_id/specialty plus student_id, and bounds on the counts such
+# as ?min_absent=4 (see analytics.build_rollup_query)
+@app.route('/analytics/<by>')
+def attendance_analytics(by):
+    if by not in analytics.DIMENSIONS:
+        return jsonify({'error': f"Analytics are by {', '.join(analytics.DIMENSIONS)}"}), 404
+    try:
+        return jsonify(analytics.rollup(snapshot.get_report_connection(), by, request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# Prometheus scrape endpoint: route latency, query time per SQL fingerprint,
+# template render time, export sizes, plus the pool and cache counters.
+# Set SLOW_QUERY_MS to also log slow queries.
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+# Connection pool counters: reused connections (hits), newly opened ones
+# (misses) and time spent waiting for a free connection
+@app.route('/db-stats')
+def db_stats():
+    return jsonify(db.get_pool().stats())
+
+# Snapshot counters: copies taken or skipped, copy time, age of the current one
+@app.route('/snapshot-stats')
+def snapshot_stats():
+    return jsonify(snapshot.get_snapshots().stats())
+
+# Attendance writer counters: submissions, changes applied, transactions
+@app.route('/attendance-writer-stats')
+def attendance_writer_stats():
+    return jsonify(attendance_writer.get_writer().stats())
+
+# Response cache counters: hits, misses, 304 answers and evictions
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify(http_cache.get_cache().stats())
+
+
+
+# Development server only, run python serve.py in production
+if __name__ == '__main__':
+    app.run(debug=True)
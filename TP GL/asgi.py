@@ -0,0 +1,88 @@
+import asyncio
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+import attendance_writer
+import db
+import file_watcher
+import jobs
+import snapshot
+from app import app
+
+
+# The app as an ASGI application, for uvicorn or any other ASGI server
+# (serve.py runs it). The Flask routes run unchanged in a thread pool with
+# one thread per pooled connection, so a request never waits for a
+# connection and a slow one only takes its own thread. /files/events is
+# served on the event loop instead: its clients stay connected for hours and
+# would otherwise each keep a thread.
+def create_application(app):
+    wsgi = WSGIMiddleware(app, workers=db.get_pool(app).size)
+    watcher = file_watcher.get_watcher(app)
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await lifespan(app, receive, send)
+        elif scope['type'] == 'http' and scope['path'] == '/files/events' and scope['method'] == 'GET':
+            await file_events(watcher, scope, receive, send)
+        else:
+            await wsgi(scope, receive, send)
+
+    return application
+
+
+async def lifespan(app, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            jobs.get_queue(app).shutdown()
+            attendance_writer.get_writer(app).shutdown()
+            snapshot.get_snapshots(app).shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# Same stream as the /files/events route, until the client disconnects
+async def file_events(watcher, scope, receive, send):
+    last_event_id = dict(scope['headers']).get(b'last-event-id', b'').decode('latin-1')
+    if not last_event_id:
+        query = parse_qs(scope['query_string'].decode('latin-1'))
+        last_event_id = query.get('last_event_id', [None])[0]
+
+    async def stream():
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        async for chunk in file_watcher.stream_events_async(watcher, last_event_id):
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(disconnected())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        # The server shutting down ends the open streams, clients reconnect
+        for task in tasks:
+            task.cancel()
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    for task in pending:
+        task.cancel()
+    for task in done:
+        task.result()  # re-raise a failure of the stream
+
+
+# asgi:application
+application = create_application(app)
@@ -0,0 +1,107 @@
+import sys
+import time
+
+import click
+
+import db
+
+
+# Insert the row, or overwrite status/observation if the student already has
+# one for this session (attendance's primary key is (student_id, session_id)).
+# The row is stamped with the server time, so changes sent later through the
+# JSON API with an older client timestamp do not undo it (see
+# attendance_writer.UPSERT_CHANGE).
+UPSERT_ATTENDANCE = '''
+    INSERT INTO attendance (student_id, session_id, status, observation, changed_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, session_id)
+    DO UPDATE SET status = excluded.status, observation = excluded.observation, changed_at = excluded.changed_at
+'''
+
+
+# Save the attendance of a whole session in one transaction.
+# records is a list of (student_id, status, observation) tuples, written with
+# one batched upsert whatever the number of students. The attendance_summary
+# triggers adjust the per-student counts (and students.sessions_attended)
+# only when a status really changes, so saving the same session twice does
+# not count it twice.
+def save_session_attendance(conn, session_id, records):
+    changed_at = int(time.time() * 1000)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany(
+            UPSERT_ATTENDANCE,
+            [(student_id, session_id, status, observation, changed_at) for student_id, status, observation in records]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# Per-student counts computed from scratch, in attendance_summary's layout
+RECOMPUTE_SUMMARY = '''
+    SELECT student_id,
+           SUM(status IS 'present'),
+           SUM(status IS 'absent'),
+           SUM(status IS 'justified')
+    FROM attendance
+    GROUP BY student_id
+'''
+
+
+# Refill attendance_summary and students.sessions_attended from the
+# attendance table (the caller commits)
+def rebuild_attendance_summary(conn):
+    conn.execute('DELETE FROM attendance_summary')
+    conn.execute(f'''
+        INSERT INTO attendance_summary (student_id, present, absent, justified)
+        {RECOMPUTE_SUMMARY}
+    ''')
+    conn.execute('''
+        UPDATE students
+        SET sessions_attended = IFNULL((SELECT present FROM attendance_summary
+                                        WHERE attendance_summary.student_id = students.id), 0)
+    ''')
+
+
+# Students whose stored counts differ from a full recount, as
+# (student_id, stored (present, absent, justified), recounted) tuples
+def verify_attendance_summary(conn):
+    stored = {row[0]: tuple(row[1:]) for row in conn.execute('''
+        SELECT s.id, IFNULL(sm.present, 0), IFNULL(sm.absent, 0), IFNULL(sm.justified, 0), s.sessions_attended
+        FROM students s
+        LEFT JOIN attendance_summary sm ON sm.student_id = s.id
+    ''')}
+    recounted = {row[0]: tuple(row[1:]) for row in conn.execute(RECOMPUTE_SUMMARY)}
+
+    mismatches = []
+    for student_id, (present, absent, justified, sessions_attended) in stored.items():
+        expected = recounted.get(student_id, (0, 0, 0))
+        if (present, absent, justified) != expected or sessions_attended != expected[0]:
+            mismatches.append((student_id, (present, absent, justified), expected))
+    return mismatches
+
+
+def init_app(app):
+    @app.cli.command('attendance-summary')
+    @click.option('--rebuild', is_flag=True, help='Recompute the counts from the attendance table.')
+    def attendance_summary_command(rebuild):
+        """Check (or rebuild) the per-student attendance counts."""
+        conn = db.get_pool(app).connect()
+        try:
+            if rebuild:
+                conn.execute('BEGIN IMMEDIATE')
+                rebuild_attendance_summary(conn)
+                conn.commit()
+                click.echo('attendance_summary rebuilt.')
+            mismatches = verify_attendance_summary(conn)
+        finally:
+            conn.close()
+
+        for student_id, stored, expected in mismatches[:20]:
+            click.echo(f'student {student_id}: stored {stored}, recounted {expected}', err=True)
+        if mismatches:
+            click.echo(f'{len(mismatches)} students out of sync, run with --rebuild.', err=True)
+            sys.exit(1)
+        click.echo('attendance_summary matches the attendance table.')
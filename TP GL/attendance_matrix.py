@@ -0,0 +1,214 @@
+import numpy as np
+
+
+# Status codes of the matrix cells. Anything else found in the attendance
+# table (NULL, older spellings) gets the next free code, so the report still
+# prints it as stored.
+UNRECORDED = 0
+PRESENT = 1
+ABSENT = 2
+JUSTIFIED = 3
+NOT_SCHEDULED = 4  # session of another group than the student's, left blank
+
+# The statuses an attendance rate counts as recorded (the rate is present
+# over these), for the statistics here and the analytics rollups alike. A
+# NULL or any other status is printed as stored but counts as neither.
+RECORDED_STATUSES = {'present': PRESENT, 'absent': ABSENT, 'justified': JUSTIFIED}
+
+# How the report prints a cell with no attendance row
+UNRECORDED_LABEL = 'Present'
+
+# Attendance rows are turned into arrays this many at a time
+FETCH_SIZE = 50000
+
+# Optional narrowing of a report, parameter -> (type, condition on the
+# sessions of the date window joined with their group and class)
+SCOPE_PARAMS = {'class_id': int, 'group_id': int, 'specialty': str}
+SCOPE_FILTERS = {
+    'class_id': 'g.class_id = ?',
+    'group_id': 'se.group_id = ?',
+    'specialty': 'c.specialty = ?',
+}
+
+
+# The scope of a report from request values, only the parameters given.
+# Raises ValueError for a malformed id.
+def report_scope(values):
+    scope = {}
+    for name, convert in SCOPE_PARAMS.items():
+        value = values.get(name)
+        if value not in (None, ''):
+            try:
+                scope[name] = convert(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid parameter: {name}')
+    return scope
+
+
+# The three queries of a report, as {name: (sql, params)}: its sessions,
+# the students of the groups that held them, and their attendance. Each is
+# one join over sessions (by date, or by group and date), groups and
+# classes, so the session ids never travel as a list of placeholders.
+def report_queries(date_debut, date_fin, scope=None):
+    where, params = ['se.date BETWEEN ? AND ?'], [date_debut, date_fin]
+    for name, condition in SCOPE_FILTERS.items():
+        if (scope or {}).get(name) is not None:
+            where.append(condition)
+            params.append(scope[name])
+    sessions = f'''
+        FROM sessions se
+        JOIN groups g ON g.id = se.group_id
+        JOIN classes c ON c.id = g.class_id
+        WHERE {' AND '.join(where)}
+    '''
+    return {
+        'sessions': (f'SELECT se.id, se.date, se.group_id {sessions} ORDER BY se.date, se.time, se.id', params),
+        'students': (f'''
+            SELECT st.id, st.name, st.surname, st.group_id
+            FROM students st
+            WHERE st.group_id IN (SELECT se.group_id {sessions})
+            ORDER BY st.id
+        ''', params),
+        'attendance': (f'''
+            SELECT a.student_id, a.session_id, a.status
+            FROM sessions se
+            JOIN groups g ON g.id = se.group_id
+            JOIN classes c ON c.id = g.class_id
+            JOIN attendance a ON a.session_id = se.id
+            WHERE {' AND '.join(where)}
+        ''', params),
+    }
+
+
+# Students x sessions attendance statuses of a date range, one int8 status
+# code per cell (students in id order, sessions by date).
+# Totals and rates are computed on whole rows/columns with NumPy instead of
+# looking each cell up in a dict.
+class AttendanceMatrix:
+
+    def __init__(self, students, sessions, codes, labels):
+        self.students = students    # (id, name, surname, group_id) per row
+        self.sessions = sessions    # session rows, one per column
+        self.codes = codes          # int8 array, len(students) x len(sessions)
+        self.labels = labels        # report text of each code
+
+    # Count of each status per student (axis=1) or per session (axis=0)
+    def totals(self, axis):
+        present = np.count_nonzero(self.codes == PRESENT, axis=axis)
+        absent = np.count_nonzero(self.codes == ABSENT, axis=axis)
+        justified = np.count_nonzero(self.codes == JUSTIFIED, axis=axis)
+        unrecorded = np.count_nonzero(self.codes == UNRECORDED, axis=axis)
+        recorded = present + absent + justified
+
+        # Share of the RECORDED_STATUSES that are 'present', NaN if none
+        rate = np.full(np.shape(present), np.nan)
+        np.divide(present, recorded, out=rate, where=np.asarray(recorded) > 0)
+        return {
+            'present': present,
+            'absent': absent,
+            'justified': justified,
+            'unrecorded': unrecorded,
+            'attendance_rate': rate,
+        }
+
+    def summary(self):
+        totals = self.totals(axis=None)
+        stats = {name: _json_value(value) for name, value in totals.items()}
+        stats['students'] = len(self.students)
+        stats['sessions'] = len(self.sessions)
+        return stats
+
+    def student_stats(self):
+        totals = self.totals(axis=1)
+        return [
+            dict({'id': student[0], 'name': student[1], 'surname': student[2], 'group_id': student[3]},
+                 **_row_stats(totals, index))
+            for index, student in enumerate(self.students)
+        ]
+
+    def session_stats(self):
+        totals = self.totals(axis=0)
+        return [
+            dict({'id': session[0], 'date': session[1], 'group_id': session[2]}, **_row_stats(totals, index))
+            for index, session in enumerate(self.sessions)
+        ]
+
+    # Rows of the attendance report: a header, then one row per student with
+    # the status of each session
+    def report_rows(self):
+        headers = ['Student Name', 'Student Surname']
+        headers.extend([f" ({session[1]})" for session in self.sessions])
+        yield headers
+
+        labels = np.array(self.labels, dtype=object)
+        for (student_id, name, surname, group_id), codes in zip(self.students, self.codes):
+            yield [name, surname] + labels[codes].tolist()
+
+
+def _json_value(value):
+    value = value.item() if hasattr(value, 'item') else value
+    if isinstance(value, float):
+        return None if value != value else round(value, 4)
+    return value
+
+
+def _row_stats(totals, index):
+    return {name: _json_value(values[index]) for name, values in totals.items()}
+
+
+# Load the matrix of a date range. scope may narrow it to a class_id,
+# group_id and/or specialty; the rows are the students of the groups that
+# held sessions in the range, each one scheduled only for the sessions of
+# their own group.
+def load_attendance_matrix(conn, date_debut, date_fin, scope=None):
+    queries = report_queries(date_debut, date_fin, scope)
+    cursor = conn.cursor()
+    cursor.row_factory = None  # plain tuples, cheaper than sqlite3.Row
+
+    sessions = cursor.execute(*queries['sessions']).fetchall()
+    if not sessions:
+        return AttendanceMatrix([], [], np.zeros((0, 0), dtype=np.int8), [UNRECORDED_LABEL])
+    students = cursor.execute(*queries['students']).fetchall()
+
+    student_ids = np.fromiter((student[0] for student in students), dtype=np.int64, count=len(students))
+    student_groups = np.fromiter((student[3] for student in students), dtype=np.int64, count=len(students))
+    session_ids = np.fromiter((session[0] for session in sessions), dtype=np.int64, count=len(sessions))
+    session_groups = np.fromiter((session[2] for session in sessions), dtype=np.int64, count=len(sessions))
+    session_order = np.argsort(session_ids)
+    sorted_session_ids = session_ids[session_order]
+
+    # Filled in place, one group's block at a time, so no students x sessions
+    # array wider than the int8 matrix is ever allocated
+    codes = np.full((len(students), len(sessions)), NOT_SCHEDULED, dtype=np.int8)
+    for group_id in np.unique(session_groups):
+        codes[np.ix_(np.flatnonzero(student_groups == group_id), np.flatnonzero(session_groups == group_id))] = UNRECORDED
+    labels = [UNRECORDED_LABEL, 'present', 'absent', 'justified', None]
+    label_codes = dict(RECORDED_STATUSES)
+
+    def status_code(status):
+        code = label_codes.get(status)
+        if code is None:
+            if len(labels) > np.iinfo(np.int8).max:
+                raise ValueError('Too many different attendance statuses')
+            code = label_codes[status] = len(labels)
+            labels.append(status)
+        return code
+
+    cursor.execute(*queries['attendance'])
+    while True:
+        chunk = cursor.fetchmany(FETCH_SIZE)
+        if not chunk:
+            break
+        chunk_students = np.fromiter((row[0] for row in chunk), dtype=np.int64, count=len(chunk))
+        chunk_sessions = np.fromiter((row[1] for row in chunk), dtype=np.int64, count=len(chunk))
+        chunk_codes = np.fromiter((status_code(row[2]) for row in chunk), dtype=np.int8, count=len(chunk))
+
+        # Dense offsets: the students are sorted by id, the sessions through
+        # their sort order; rows of students outside the matrix are dropped
+        rows = np.searchsorted(student_ids, chunk_students)
+        found = rows < len(student_ids)
+        found[found] = student_ids[rows[found]] == chunk_students[found]
+        columns = session_order[np.searchsorted(sorted_session_ids, chunk_sessions)]
+        codes[rows[found], columns[found]] = chunk_codes[found]
+
+    return AttendanceMatrix(students, sessions, codes, labels)
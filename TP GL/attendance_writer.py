@@ -0,0 +1,218 @@
+import os
+import queue
+import threading
+import time
+
+from flask import current_app
+
+import db
+
+
+# How long the writer keeps collecting submissions after the first one before
+# committing them together, and the most changes it puts in one transaction
+BATCH_WINDOW = float(os.environ.get('ATTENDANCE_BATCH_WINDOW_MS', '5')) / 1000
+BATCH_MAX_CHANGES = int(os.environ.get('ATTENDANCE_BATCH_MAX', '5000'))
+# Seconds a request waits for its changes to be committed
+ACK_TIMEOUT = float(os.environ.get('ATTENDANCE_ACK_TIMEOUT', '10'))
+# Client timestamps further ahead of the server clock are refused, they would
+# win every later conflict
+MAX_CLOCK_SKEW_MS = 5 * 60 * 1000
+
+STATUSES = ('present', 'absent', 'justified')
+
+# One change of one student at one session, kept only if it is not older than
+# what is stored (last write wins on the client timestamp, ties go to the
+# last one written). A status or observation left out keeps its stored value.
+UPSERT_CHANGE = '''
+    INSERT INTO attendance (student_id, session_id, status, observation, changed_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, session_id)
+    DO UPDATE SET status = IFNULL(excluded.status, status),
+                  observation = IFNULL(excluded.observation, observation),
+                  changed_at = excluded.changed_at
+    WHERE changed_at IS NULL OR excluded.changed_at >= changed_at
+'''
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+# Validate a JSON body {"changes": [{"session_id", "student_id", "status",
+# "observation", "changed_at"}, ...]} into (student_id, session_id, status,
+# observation, changed_at) tuples. changed_at is the client's clock in
+# milliseconds since the epoch. Raises ValueError.
+def parse_changes(payload):
+    changes = payload.get('changes') if isinstance(payload, dict) else None
+    if not isinstance(changes, list) or not changes:
+        raise ValueError('Expected {"changes": [...]} with at least one change')
+    if len(changes) > BATCH_MAX_CHANGES:
+        raise ValueError(f'At most {BATCH_MAX_CHANGES} changes per request')
+
+    latest = now_ms() + MAX_CLOCK_SKEW_MS
+    records = []
+    for index, change in enumerate(changes):
+        if not isinstance(change, dict):
+            raise ValueError(f'changes[{index}] is not an object')
+        for name in ('session_id', 'student_id', 'changed_at'):
+            if not isinstance(change.get(name), int) or isinstance(change.get(name), bool):
+                raise ValueError(f'changes[{index}].{name} must be an integer')
+        status = change.get('status')
+        observation = change.get('observation')
+        if status is None and observation is None:
+            raise ValueError(f'changes[{index}] has neither a status nor an observation')
+        if status is not None and status not in STATUSES:
+            raise ValueError(f"changes[{index}].status must be one of: {', '.join(STATUSES)}")
+        if observation is not None and not isinstance(observation, str):
+            raise ValueError(f'changes[{index}].observation must be a string')
+        if change['changed_at'] > latest:
+            raise ValueError(f'changes[{index}].changed_at is ahead of the server clock')
+        records.append((change['student_id'], change['session_id'], status, observation, change['changed_at']))
+    return records
+
+
+class Submission:
+
+    def __init__(self, records):
+        self.records = records
+        self.applied = 0  # rows written, the others were older than the stored ones
+        self.error = None
+        self.done = threading.Event()
+
+
+# Single writer for the attendance changes of the JSON API.
+# Requests queue their changes and wait; one thread takes everything queued
+# within BATCH_WINDOW and commits it in one transaction, so a burst of
+# tablets costs a few commits instead of one write lock each. The writer's
+# connection syncs every commit (synchronous FULL), so a submission is
+# acknowledged only once it is on disk.
+class AttendanceWriter:
+
+    def __init__(self, pool, window=BATCH_WINDOW, max_changes=BATCH_MAX_CHANGES):
+        self.pool = pool
+        self.window = window
+        self.max_changes = max_changes
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+
+        # Counters exposed through stats()
+        self.submissions = 0
+        self.changes = 0
+        self.applied = 0
+        self.transactions = 0
+        self.failures = 0
+        self.commit_time = 0.0
+
+    # Queue the changes and block until they are committed (or timeout).
+    # Returns the submission, whose done event is unset on timeout.
+    def write(self, records, timeout=ACK_TIMEOUT):
+        if self._stopping:
+            raise RuntimeError('The attendance writer is shut down')
+        self._start()
+        submission = Submission(records)
+        self._queue.put(submission)
+        submission.done.wait(timeout)
+        return submission
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = self.pool.connect()
+        conn.execute('PRAGMA synchronous = FULL')
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._commit(conn, batch)
+        finally:
+            conn.close()
+
+    # Wait for a submission, then gather the others that arrive within the
+    # window, up to max_changes. None once shut down.
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first.records)
+        deadline = time.perf_counter() + self.window
+        while size < self.max_changes:
+            remaining = deadline - time.perf_counter()
+            try:
+                submission = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if submission is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(submission)
+            size += len(submission.records)
+        return batch
+
+    def _commit(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            self._write(conn, batch)
+        except Exception:
+            # One bad submission (a student deleted meanwhile, a value sqlite3
+            # cannot bind) must not fail the others, nor stop the writer:
+            # write them one transaction each
+            for submission in batch:
+                try:
+                    self._write(conn, [submission])
+                except Exception as e:
+                    submission.applied = 0
+                    submission.error = str(e)
+                    self.failures += 1
+        self.commit_time += time.perf_counter() - start
+
+        for submission in batch:
+            self.submissions += 1
+            self.changes += len(submission.records)
+            self.applied += submission.applied
+            submission.done.set()
+
+    def _write(self, conn, batch):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for submission in batch:
+                submission.applied = conn.executemany(UPSERT_CHANGE, submission.records).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.transactions += 1
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'submissions': self.submissions,
+            'changes': self.changes,
+            'applied': self.applied,
+            'transactions': self.transactions,
+            'failures': self.failures,
+            'commit_time_seconds': round(self.commit_time, 6),
+        }
+
+    # Commit what is queued and stop the thread
+    def shutdown(self, timeout=5):
+        self._stopping = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+def get_writer(app=None):
+    app = app or current_app
+    return app.extensions['attendance_writer']
+
+
+def init_app(app):
+    app.extensions['attendance_writer'] = AttendanceWriter(db.get_pool(app))
@@ -0,0 +1,136 @@
+# Deterministic synthetic school.db for the benchmarks.
+#
+# Run from the "TP GL" directory:
+#
+#     python -m bench.generate /tmp/bench.db --scale medium
+#     python -m bench.generate /tmp/bench.db --classes 20 --groups 4 --students 35 --sessions 60
+#
+# Fills the current schema (classes -> groups -> students -> sessions ->
+# attendance) through the migrations, so the triggers keep the summary and
+# version tables exactly as the app would. The same arguments and seed
+# always give the same database.
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+import db
+import migrations
+
+
+# classes, groups per class, students per group, sessions per group
+SCALES = {
+    'tiny': {'classes': 1, 'groups': 2, 'students': 20, 'sessions': 10},
+    'small': {'classes': 4, 'groups': 3, 'students': 30, 'sessions': 20},
+    'medium': {'classes': 12, 'groups': 4, 'students': 35, 'sessions': 40},
+    'large': {'classes': 40, 'groups': 5, 'students': 40, 'sessions': 60},
+}
+
+SPECIALTIES = ('Informatique', 'Mathematiques', 'Physique', 'Chimie', 'Biologie')
+GROUP_TYPES = ('TD', 'TP')
+FIRST_NAMES = (
+    'Amine', 'Yacine', 'Sara', 'Lina', 'Mohamed', 'Douaa', 'Rayane', 'Ines', 'Karim', 'Nour',
+    'Walid', 'Imane', 'Sofiane', 'Meriem', 'Anis', 'Yasmine', 'Bilal', 'Amel', 'Riad', 'Lyna',
+)
+SURNAMES = (
+    'Benali', 'Bouteldja', 'Fellah', 'Ghezlaoui', 'Haddad', 'Khelifi', 'Mansouri', 'Saidi',
+    'Zeroual', 'Belkacem', 'Cherif', 'Djebbar', 'Hamidi', 'Larbi', 'Meziane', 'Rahmani',
+)
+TIME_SLOTS = ('08:00', '09:40', '11:20', '13:10', '14:50')
+
+# Share of each status; the rest of the cells have no attendance row
+STATUS_WEIGHTS = (('present', 0.80), ('absent', 0.12), ('justified', 0.05))
+
+FIRST_DAY = datetime.date(2024, 9, 15)
+
+
+def generate(path, classes, groups, students, sessions, seed=0):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+
+    conn = sqlite3.connect(path)
+    for name, value in db.PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    migrations.migrate(conn)
+
+    with conn:
+        for c in range(classes):
+            class_id = conn.execute(
+                'INSERT INTO classes (name, specialty, level, year) VALUES (?, ?, ?, ?)',
+                (f'C{c + 1}', SPECIALTIES[c % len(SPECIALTIES)], str(c % 5 + 1), '2024-2025')
+            ).lastrowid
+
+            for g in range(groups):
+                group_id = conn.execute(
+                    'INSERT INTO groups (name, type, class_id) VALUES (?, ?, ?)',
+                    (f'G{g + 1}', GROUP_TYPES[g % len(GROUP_TYPES)], class_id)
+                ).lastrowid
+
+                conn.executemany('INSERT INTO students (name, surname, group_id) VALUES (?, ?, ?)', [
+                    (rng.choice(SURNAMES), rng.choice(FIRST_NAMES), group_id)
+                    for _ in range(students)
+                ])
+                student_ids = [row[0] for row in conn.execute('SELECT id FROM students WHERE group_id = ?', (group_id,))]
+
+                # One session a week per group, on a day and slot of its own
+                for s in range(sessions):
+                    day = FIRST_DAY + datetime.timedelta(days=7 * s + group_id % 5)
+                    session_id = conn.execute(
+                        'INSERT INTO sessions (group_id, date, time) VALUES (?, ?, ?)',
+                        (group_id, day.isoformat(), TIME_SLOTS[group_id % len(TIME_SLOTS)])
+                    ).lastrowid
+
+                    records = []
+                    for student_id in student_ids:
+                        draw = rng.random()
+                        for status, weight in STATUS_WEIGHTS:
+                            if draw < weight:
+                                records.append((student_id, session_id, status, ''))
+                                break
+                            draw -= weight
+                    conn.executemany(
+                        'INSERT INTO attendance (student_id, session_id, status, observation) VALUES (?, ?, ?, ?)',
+                        records
+                    )
+
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in db.DATA_TABLES}
+    conn.close()
+    return counts
+
+
+def scale_arguments(parser):
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--classes', type=int)
+    parser.add_argument('--groups', type=int, help='groups per class')
+    parser.add_argument('--students', type=int, help='students per group')
+    parser.add_argument('--sessions', type=int, help='sessions per group')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+# The scale preset, with any explicitly given size overriding it
+def scale_from(args):
+    scale = dict(SCALES[args.scale])
+    for name in scale:
+        if getattr(args, name) is not None:
+            scale[name] = getattr(args, name)
+    return scale
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic school database')
+    parser.add_argument('path')
+    scale_arguments(parser)
+    args = parser.parse_args()
+
+    scale = scale_from(args)
+    start = time.perf_counter()
+    counts = generate(args.path, seed=args.seed, **scale)
+    print(f"{args.path}: {', '.join(f'{count} {table}' for table, count in counts.items())}"
+          f' in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
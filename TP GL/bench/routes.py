@@ -0,0 +1,239 @@
+# Benchmark: latency and memory of every page, export and JSON route on a
+# generated database, with an optional comparison against a saved baseline.
+#
+# Run from the "TP GL" directory:
+#
+#     python -m bench.routes --scale medium --save baseline.json
+#     python -m bench.routes --scale medium --baseline baseline.json
+#
+# Each route is requested through the Flask test client (no server, no
+# network): a few warm-up calls, then --iterations timed calls for the
+# p50/p95/p99 latencies, then a few calls under tracemalloc for the peak
+# memory. The response cache is off unless --http-cache, so the numbers are
+# those of building each response. With --baseline, routes whose p95 grew by
+# more than --threshold (and by more than --min-ms) are flagged and the exit
+# status is 1.
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench.generate import generate, scale_arguments, scale_from
+
+
+WARMUP = 3
+MEMORY_ITERATIONS = 3
+
+
+def attendance_form(ids):
+    return {
+        f'attendance_{student_id}[status]': status
+        for student_id, status in zip(ids['student_ids'], ('present', 'absent', 'justified') * len(ids['student_ids']))
+    }
+
+
+def report_form(ids):
+    return {'date_debut': ids['date_debut'], 'date_fin': ids['date_fin']}
+
+
+# name, method, url, form builder. Only requests that leave the database as
+# they found it: save_attendance re-saves the same statuses every time.
+ROUTES = [
+    ('classes', 'GET', '/classes', None),
+    ('groups', 'GET', '/class/{class_id}/groups', None),
+    ('view_students', 'GET', '/group/{group_id}/students', None),
+    ('view_sessions', 'GET', '/group/{group_id}/sessions', None),
+    ('add_session_form', 'GET', '/group/{group_id}/session/add', None),
+    ('edit_student_form', 'GET', '/edit_student/{student_id}/{group_id}', None),
+    ('manage_students', 'GET', '/session/{session_id}/manage_students', None),
+    ('save_attendance', 'POST', '/save_attendance/{group_id}/{session_id}', attendance_form),
+    ('export_students', 'GET', '/export_students/{group_id}', None),
+    ('export_session', 'GET', '/export_session/{session_id}', None),
+    ('export_attendance', 'POST', '/export-attendance', report_form),
+    ('export_attendance_class', 'POST', '/export-attendance?class_id={class_id}', report_form),
+    ('export_jobs', 'GET', '/exports', None),
+    ('api_classes', 'GET', '/api/classes', None),
+    ('api_students', 'GET', '/api/students?limit=100', None),
+    ('api_group_students', 'GET', '/api/students?group_id={group_id}&sort=name', None),
+    ('api_sessions', 'GET', '/api/sessions?sort=-date&limit=200', None),
+    ('stats_students', 'GET', '/stats/attendance/students?date_debut={date_debut}&date_fin={date_fin}', None),
+    ('stats_sessions', 'GET', '/stats/attendance/sessions?date_debut={date_debut}&date_fin={date_fin}'
+                              '&class_id={class_id}', None),
+    ('analytics_students', 'GET', '/analytics/students?class_id={class_id}&min_absent=1', None),
+    ('analytics_groups_week', 'GET', '/analytics/groups?period=week', None),
+    ('notification', 'GET', '/notification', None),
+    ('files', 'GET', '/files', None),
+    ('metrics', 'GET', '/metrics', None),
+    ('db_stats', 'GET', '/db-stats', None),
+]
+
+
+# Ids the routes are requested with: the first group of the database, its
+# class, its first session and student, and the whole date range
+def sample_ids(path):
+    conn = sqlite3.connect(path)
+    group_id, class_id = conn.execute('SELECT id, class_id FROM groups ORDER BY id LIMIT 1').fetchone()
+    session_id = conn.execute('SELECT id FROM sessions WHERE group_id = ? ORDER BY id LIMIT 1', (group_id,)).fetchone()[0]
+    student_ids = [row[0] for row in conn.execute('SELECT id FROM students WHERE group_id = ? ORDER BY id', (group_id,))]
+    date_debut, date_fin = conn.execute('SELECT MIN(date), MAX(date) FROM sessions').fetchone()
+    conn.close()
+    return {
+        'class_id': class_id,
+        'group_id': group_id,
+        'session_id': session_id,
+        'student_id': student_ids[0],
+        'student_ids': student_ids,
+        'date_debut': date_debut,
+        'date_fin': date_fin,
+    }
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def request_once(client, method, url, data):
+    response = client.open(url, method=method, data=data)
+    body = response.get_data()  # runs streamed responses to the end
+    response.close()
+    if response.status_code >= 400:
+        raise RuntimeError(f'{method} {url}: {response.status_code} {body[:200]!r}')
+    return len(body)
+
+
+def measure(client, method, url, data, iterations):
+    for _ in range(WARMUP):
+        request_once(client, method, url, data)
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        size = request_once(client, method, url, data)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    tracemalloc.start()
+    peak = 0
+    for _ in range(MEMORY_ITERATIONS):
+        tracemalloc.reset_peak()
+        request_once(client, method, url, data)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'peak_kb': round(peak / 1024, 1),
+        'bytes': size,
+    }
+
+
+# The app on the benchmark database. db was already imported (by
+# bench.generate) with its environment read, so the defaults that init_app
+# copies into app.config are set on the modules before the app is created.
+def create_app(path, workdir, http_cache_on):
+    import db
+    import http_cache
+    import jobs
+    db.DATABASE = path
+    jobs.EXPORT_CACHE_DIR = os.path.join(workdir, 'export_cache')
+    if not http_cache_on:
+        http_cache.HTTP_CACHE_BYTES = 0
+
+    from app import app
+    if app.config['DATABASE'] != path:
+        raise RuntimeError(f"The app uses {app.config['DATABASE']}, not {path}")
+    return app
+
+
+def run(app, path, iterations, only=None):
+    ids = sample_ids(path)
+
+    results = {}
+    with app.test_client() as client:
+        for name, method, url, form in ROUTES:
+            if only and name not in only:
+                continue
+            url = url.format(**ids)
+            results[name] = measure(client, method, url, form(ids) if form else None, iterations)
+            print(f"{name:<26}{results[name]['p50_ms']:>10.2f}{results[name]['p95_ms']:>10.2f}"
+                  f"{results[name]['p99_ms']:>10.2f}{results[name]['peak_kb']:>12.1f}", flush=True)
+    return results
+
+
+# Routes slower than the baseline: p95 up by more than threshold (a
+# fraction) and by more than min_ms, so sub-millisecond noise is ignored
+def compare(results, baseline, threshold, min_ms):
+    regressions = []
+    print(f"\n{'route':<26}{'base p95':>10}{'p95':>10}{'change':>10}")
+    for name, current in results.items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            print(f'{name:<26}{"-":>10}{current["p95_ms"]:>10.2f}{"new":>10}')
+            continue
+        change = current['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+        regressed = change > threshold and current['p95_ms'] - before['p95_ms'] > min_ms
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<26}{before['p95_ms']:>10.2f}{current['p95_ms']:>10.2f}{change:>+10.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the routes on a generated database')
+    parser.add_argument('--db', help='existing database to use instead of generating one (it is modified)')
+    scale_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--route', action='append', help='only this route (repeatable)')
+    parser.add_argument('--http-cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--save', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--min-ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    scale = scale_from(args)
+    with tempfile.TemporaryDirectory(prefix='school-bench-') as workdir:
+        path = args.db
+        if path is None:
+            path = os.path.join(workdir, 'school.db')
+            generate(path, seed=args.seed, **scale)
+
+        app = create_app(path, workdir, args.http_cache)
+        print(f"{'route':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak KiB':>12}")
+        results = run(app, path, args.iterations, args.route)
+
+    report = {
+        'scale': None if args.db else dict(scale, seed=args.seed),
+        'iterations': args.iterations,
+        'http_cache': args.http_cache,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'routes': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != report['scale'] or baseline.get('http_cache') != report['http_cache']:
+            print('warning: the baseline was run with other settings', file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# Benchmark: per-row save_attendance loop vs the batched upsert.
+#
+# Run from the "TP GL" directory:
+#
+#     python -m bench.save_attendance --students 40 500 2000
+#
+# For each roster size the session is saved twice (first save inserts, second
+# save re-submits the same form) and the script prints the wall time, the
+# number of statements sent to SQLite, the number of transactions, and
+# whether students.sessions_attended still matches the attendance table.
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import db
+import migrations
+from attendance import save_session_attendance
+
+
+# Connection that counts the statements the application sends to SQLite
+class CountingConnection(sqlite3.Connection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = 0
+        self.transactions = 0
+
+    def execute(self, *args):
+        self.statements += 1
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        self.statements += 1
+        return super().executemany(*args)
+
+    def commit(self):
+        if self.in_transaction:
+            self.transactions += 1
+        return super().commit()
+
+
+# The loop save_attendance used before the batched upsert. Its increment of
+# students.sessions_attended is left out: the attendance_summary triggers
+# keep that counter on both paths now, and would count it twice.
+def legacy_save(conn, session_id, records):
+    for student_id, status, observation in records:
+        existing_attendance = conn.execute('SELECT * FROM attendance WHERE student_id = ? AND session_id = ?',
+                                           (student_id, session_id)).fetchone()
+        if existing_attendance:
+            conn.execute('''UPDATE attendance
+                            SET status = ?, observation = ?
+                            WHERE student_id = ? AND session_id = ?''',
+                         (status, observation, student_id, session_id))
+        else:
+            conn.execute('''INSERT INTO attendance (student_id, session_id, status, observation)
+                            VALUES (?, ?, ?, ?)''',
+                         (student_id, session_id, status, observation))
+    conn.commit()
+
+
+def open_database(path):
+    conn = sqlite3.connect(path, factory=CountingConnection)
+    conn.row_factory = sqlite3.Row
+    for name, value in db.PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+# One class, one group of n students and one session
+def populate(conn, n):
+    migrations.migrate(conn)
+    conn.execute("INSERT INTO classes (name, specialty, level, year) VALUES ('Bench', 'Bench', '1', '2024-2025')")
+    group_id = conn.execute("INSERT INTO groups (name, type, class_id) VALUES ('G1', 'TD', 1)").lastrowid
+    conn.executemany(
+        'INSERT INTO students (name, surname, group_id) VALUES (?, ?, ?)',
+        [(f'Name{i}', f'Surname{i}', group_id) for i in range(n)]
+    )
+    session_id = conn.execute(
+        "INSERT INTO sessions (group_id, date, time) VALUES (?, '2024-10-01', '08:00')", (group_id,)
+    ).lastrowid
+    conn.commit()
+    student_ids = [row['id'] for row in conn.execute('SELECT id FROM students WHERE group_id = ?', (group_id,))]
+    return session_id, student_ids
+
+
+def counters_match(conn):
+    mismatches = conn.execute('''
+        SELECT COUNT(*) FROM students s
+        WHERE s.sessions_attended != (SELECT COUNT(*) FROM attendance a
+                                      WHERE a.student_id = s.id AND a.status = 'present')
+    ''').fetchone()[0]
+    return mismatches == 0
+
+
+def run(save, n):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = open_database(os.path.join(tmp, 'bench.db'))
+        session_id, student_ids = populate(conn, n)
+        statuses = ('present', 'absent', 'present', 'justified')
+        records = [(student_id, statuses[i % len(statuses)], '') for i, student_id in enumerate(student_ids)]
+
+        results = []
+        for label in ('insert', 'resave'):
+            conn.statements = conn.transactions = 0
+            start = time.perf_counter()
+            save(conn, session_id, records)
+            elapsed = time.perf_counter() - start
+            results.append((label, elapsed * 1000, conn.statements, conn.transactions))
+
+        correct = counters_match(conn)
+        conn.close()
+    return results, correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark save_attendance')
+    parser.add_argument('--students', type=int, nargs='+', default=[40, 500, 2000])
+    args = parser.parse_args()
+
+    print(f"{'impl':<8} {'students':>8} {'save':<7} {'ms':>9} {'statements':>10} {'txns':>5}  counters ok")
+    for n in args.students:
+        for name, save in (('legacy', legacy_save), ('batched', save_session_attendance)):
+            results, correct = run(save, n)
+            for label, ms, statements, transactions in results:
+                print(f'{name:<8} {n:>8} {label:<7} {ms:>9.2f} {statements:>10} {transactions:>5}  {correct}')
+
+
+if __name__ == '__main__':
+    main()
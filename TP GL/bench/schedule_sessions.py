@@ -0,0 +1,75 @@
+# Benchmark: setting up a semester's sessions, one add_session post per
+# session vs one scheduling.schedule_sessions call.
+#
+# Run from the "TP GL" directory:
+#
+#     python -m bench.schedule_sessions --groups 10 100
+#
+# Prints sessions/sec for both on a fresh database holding the given number
+# of groups, each with two weekly slots over a 20 week semester.
+import argparse
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+
+import db
+import migrations
+import scheduling
+
+
+START = datetime.date(2024, 9, 2)
+END = datetime.date(2025, 1, 19)
+SLOTS = [(0, '09:40'), (3, '14:00')]
+
+
+# What add_session does for every session of every group: an insert and a
+# commit each
+def per_session(conn, group_ids):
+    schedule = scheduling.Schedule(SLOTS, START, END)
+    created = 0
+    for group_id in group_ids:
+        for date, time_ in schedule.occurrences():
+            conn.execute('INSERT INTO sessions (group_id, date, time) VALUES (?, ?, ?)', (group_id, date, time_))
+            conn.commit()
+            created += 1
+    return created
+
+
+def scheduled(conn, group_ids):
+    schedule = scheduling.Schedule(SLOTS, START, END, class_id=1)
+    return scheduling.schedule_sessions(conn, schedule)['created']
+
+
+def fresh_database(path, groups):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    for name, value in db.PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    migrations.migrate(conn)
+    conn.execute("INSERT INTO classes (name, specialty, level, year) VALUES ('Bench', 'Bench', '1', '2024-2025')")
+    conn.executemany("INSERT INTO groups (name, type, class_id) VALUES (?, 'TD', 1)", [(f'G{i}',) for i in range(groups)])
+    conn.commit()
+    return conn, [row[0] for row in conn.execute('SELECT id FROM groups')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the session scheduler')
+    parser.add_argument('--groups', type=int, nargs='+', default=[10, 100])
+    args = parser.parse_args()
+
+    print(f"{'impl':<12} {'groups':>7} {'sessions':>9} {'seconds':>8} {'sessions/sec':>13}")
+    for groups in args.groups:
+        with tempfile.TemporaryDirectory() as directory:
+            for label, run in (('per session', per_session), ('scheduler', scheduled)):
+                conn, group_ids = fresh_database(os.path.join(directory, f"{label.replace(' ', '_')}.db"), groups)
+                start = time.perf_counter()
+                created = run(conn, group_ids)
+                elapsed = time.perf_counter() - start
+                conn.close()
+                print(f'{label:<12} {groups:>7} {created:>9} {elapsed:>8.3f} {created / elapsed:>13.0f}')
+
+
+if __name__ == '__main__':
+    main()
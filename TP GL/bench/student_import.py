@@ -0,0 +1,120 @@
+# Benchmark: student import throughput, old add_students_excel loop vs the
+# streaming pipeline.
+#
+# Run from the "TP GL" directory:
+#
+#     python -m bench.student_import --rows 1000 10000 50000
+#
+# Prints rows/sec and peak traced memory for the old per-row import (full
+# openpyxl workbook, one INSERT per row) and for the pipeline on the same
+# .xlsx file, and for the pipeline on the equivalent .csv file.
+import argparse
+import csv
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+import xlsxwriter
+
+import db
+import migrations
+from student_import import read_student_rows, import_students, summarize
+
+
+# The loop add_students_excel used before the pipeline
+def legacy_import(conn, group_id, path):
+    workbook = openpyxl.load_workbook(path)
+    sheet = workbook.active
+    added = 0
+    for row in sheet.iter_rows(min_row=2, values_only=True):
+        name, surname = row
+        if name and surname:
+            conn.execute('INSERT INTO students (name, surname, group_id) VALUES (?, ?, ?)', (name, surname, group_id))
+            added += 1
+    conn.commit()
+    return added
+
+
+def pipeline_import(conn, group_id, path):
+    with open(path, 'rb') as stream:
+        report = import_students(conn, group_id, read_student_rows(stream, path))
+    return summarize(report)['added']
+
+
+# n data rows, every 50th one repeats an earlier student
+def write_files(directory, n):
+    rows = []
+    for i in range(n):
+        j = i - 1 if i % 50 == 49 else i
+        rows.append((f'Name{j}', f'Surname{j}'))
+
+    xlsx_path = os.path.join(directory, 'students.xlsx')
+    workbook = xlsxwriter.Workbook(xlsx_path, {'constant_memory': True})
+    sheet = workbook.add_worksheet()
+    sheet.write_row(0, 0, ['Name', 'Surname'])
+    for index, row in enumerate(rows, 1):
+        sheet.write_row(index, 0, row)
+    workbook.close()
+
+    csv_path = os.path.join(directory, 'students.csv')
+    with open(csv_path, 'w', newline='', encoding='utf-8') as output:
+        writer = csv.writer(output, delimiter=';')
+        writer.writerow(['Name', 'Surname'])
+        writer.writerows(rows)
+    return xlsx_path, csv_path
+
+
+def fresh_database(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    for name, value in db.PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    migrations.migrate(conn)
+    conn.execute("INSERT INTO classes (name, specialty, level, year) VALUES ('Bench', 'Bench', '1', '2024-2025')")
+    group_id = conn.execute("INSERT INTO groups (name, type, class_id) VALUES ('G1', 'TD', 1)").lastrowid
+    conn.commit()
+    return conn, group_id
+
+
+# Timed without tracing, then run again on a new database under tracemalloc
+# for the peak memory (tracing slows the import down several times)
+def measure(run, directory, label, path):
+    conn, group_id = fresh_database(os.path.join(directory, f'{label}.db'))
+    start = time.perf_counter()
+    added = run(conn, group_id, path)
+    elapsed = time.perf_counter() - start
+    conn.close()
+
+    conn, group_id = fresh_database(os.path.join(directory, f'{label}_traced.db'))
+    tracemalloc.start()
+    run(conn, group_id, path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    conn.close()
+    return added, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the student import')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    print(f"{'impl':<14} {'rows':>7} {'added':>7} {'seconds':>8} {'rows/sec':>10} {'peak MB':>8}")
+    for n in args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            xlsx_path, csv_path = write_files(directory, n)
+            runs = (
+                ('legacy xlsx', legacy_import, xlsx_path),
+                ('pipeline xlsx', pipeline_import, xlsx_path),
+                ('pipeline csv', pipeline_import, csv_path),
+            )
+            for label, run, path in runs:
+                added, elapsed, peak = measure(run, directory, label.replace(' ', '_'), path)
+                print(f'{label:<14} {n:>7} {added:>7} {elapsed:>8.3f} {n / elapsed:>10.0f} {peak / 1e6:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, current_app, request
+from werkzeug.security import safe_join
+
+# brotli is in requirements.txt; without it the responses are gzip only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Set COMPRESS_RESPONSES=0 when a proxy in front of the app compresses
+COMPRESS_RESPONSES = os.environ.get('COMPRESS_RESPONSES', '1') != '0'
+# Smaller bodies do not shrink enough to be worth it
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '512'))
+
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+)
+
+# Pages and JSON are compressed on every request (or once per cached page),
+# static files once: quick settings for the first, the smallest output for
+# the second
+DYNAMIC_LEVELS = {'br': 4, 'gzip': 6}
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+
+
+def encodings():
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def compress(body, encoding, levels=DYNAMIC_LEVELS):
+    if encoding == 'br':
+        return brotli.compress(body, quality=levels['br'])
+    # mtime=0: the same body always gives the same bytes (and ETag)
+    return gzip.compress(body, compresslevel=levels['gzip'], mtime=0)
+
+
+# The encoding to answer the current request with, brotli first, or None
+def choose_encoding(mimetype, size):
+    if not current_app.config['COMPRESS_RESPONSES'] or size < COMPRESS_MIN_BYTES:
+        return None
+    if mimetype not in COMPRESSIBLE_TYPES:
+        return None
+    for encoding in encodings():
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+# after_request: compress whole text responses built in memory. Files
+# (passed through) and streams (exports, event streams) are left alone, and
+# so are the responses already encoded by http_cache or the static files.
+def compress_response(response):
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+    encoding = choose_encoding(response.mimetype, response.content_length or 0)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+
+class StaticFile:
+
+    def __init__(self, path, mtime, size, body):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {None: body}
+        for encoding in encodings():
+            compressed = compress(body, encoding, STATIC_LEVELS)
+            if len(compressed) < len(body):
+                self.bodies[encoding] = compressed
+
+
+# The compressible files of the static folder, read and compressed once at
+# startup and again only when a file changes on disk
+class StaticFiles:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = safe_join(self.folder, filename)
+        if path is None or mimetypes.guess_type(path)[0] not in COMPRESSIBLE_TYPES:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self._files.get(path)
+        if entry is None or (entry.mtime, entry.size) != (stat.st_mtime, stat.st_size):
+            with open(path, 'rb') as f:
+                entry = StaticFile(path, stat.st_mtime, stat.st_size, f.read())
+            with self._lock:
+                self._files[path] = entry
+        return entry
+
+    def preload(self):
+        for directory, _, names in os.walk(self.folder):
+            for name in names:
+                self.get(os.path.relpath(os.path.join(directory, name), self.folder))
+
+
+# The static route: compressible files from memory in the best encoding the
+# client takes, the others through Flask's send_static_file
+def send_static_file(filename):
+    entry = current_app.extensions['static_files'].get(filename)
+    if entry is None:
+        return current_app.send_static_file(filename)
+
+    encoding = choose_encoding(entry.mimetype, entry.size)
+    if encoding not in entry.bodies:
+        encoding = None
+    response = Response(entry.bodies[encoding], mimetype=entry.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(f'{entry.etag}-{encoding}' if encoding else entry.etag)
+    response.last_modified = entry.mtime
+    max_age = current_app.get_send_file_max_age(filename)
+    if max_age is not None:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_RESPONSES', COMPRESS_RESPONSES)
+    app.after_request(compress_response)
+    if app.has_static_folder:
+        app.extensions['static_files'] = StaticFiles(app.static_folder)
+        app.extensions['static_files'].preload()
+        app.view_functions['static'] = send_static_file
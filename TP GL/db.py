@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g
+
+
+DATABASE = os.environ.get('SCHOOL_DB', 'school.db')
+POOL_SIZE = int(os.environ.get('SCHOOL_DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.environ.get('SCHOOL_DB_POOL_TIMEOUT', '10'))
+# Prepared statements kept per connection (sqlite3's default is 128), enough
+# for the constant statements of repository.py plus the API and report variants
+STATEMENT_CACHE_SIZE = int(os.environ.get('SCHOOL_DB_STATEMENT_CACHE', '256'))
+
+# Pragmas applied to every new connection.
+# WAL lets readers and the writer work at the same time, NORMAL sync is safe
+# under WAL, and the cache/mmap sizes keep hot pages out of the syscall path.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),      # in KiB when negative, ~16 MB per connection
+    ('mmap_size', 268435456),    # 256 MB
+    ('busy_timeout', 5000),      # ms
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'ON'),      # deletes cascade (see migrations.add_cascading_foreign_keys)
+)
+
+DATA_TABLES = ('classes', 'groups', 'students', 'sessions', 'attendance')
+
+
+# Bounded pool of long-lived connections.
+# A connection is checked out once per app context (so every call to
+# get_db_connection() inside a request returns the same one) and handed
+# back on teardown. Idle connections are reused last-in first-out so the
+# warmest page cache is picked first.
+class ConnectionPool:
+
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT, pragmas=PRAGMAS):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.factory = sqlite3.Connection  # metrics swaps in a timed subclass
+        self._idle = []
+        self._opened = 0
+        self._available = threading.Condition(threading.Lock())
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def connect(self):
+        conn = sqlite3.connect(self.database, timeout=self.timeout, check_same_thread=False,
+                               factory=self.factory, cached_statements=STATEMENT_CACHE_SIZE,
+                               uri=self.database.startswith('file:'))
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        with self._available:
+            if not self._idle and self._opened >= self.size:
+                # Pool exhausted, wait for another request to hand one back
+                self.waits += 1
+                start = time.perf_counter()
+                deadline = start + self.timeout
+                while not self._idle and self._opened >= self.size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        self.wait_time += time.perf_counter() - start
+                        raise sqlite3.OperationalError('database connection pool exhausted')
+                    self._available.wait(remaining)
+                self.wait_time += time.perf_counter() - start
+
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+
+            self.misses += 1
+            self._opened += 1
+
+        # Open the new connection outside the lock
+        try:
+            return self.connect()
+        except Exception:
+            with self._available:
+                self._opened -= 1
+                self._available.notify()
+            raise
+
+    def release(self, conn):
+        try:
+            # Never hand out a connection with a half-finished transaction
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self.discard(conn)
+            return
+
+        with self._available:
+            self._idle.append(conn)
+            self._available.notify()
+
+    # Connection checked out for as long as the with block runs, for work
+    # that outlives the request's app context (streamed responses, jobs)
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._available:
+                self._opened -= 1
+                self._available.notify()
+
+    def close_all(self):
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._available.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._available:
+            return {
+                'database': self.database,
+                'size': self.size,
+                'open': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._opened - len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'wait_time_seconds': round(self.wait_time, 6),
+                'timeouts': self.timeouts,
+            }
+
+
+# Current value of the data_version counter, None on a database created
+# before the counter existed (callers then skip caching)
+def data_version(conn):
+    try:
+        row = conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def get_pool(app=None):
+    app = app or current_app
+    return app.extensions['school_db_pool']
+
+
+# Function to connect to the database
+def get_db_connection():
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def release_db_connection(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE', DATABASE)
+    app.extensions['school_db_pool'] = ConnectionPool(app.config['DATABASE'])
+    app.teardown_appcontext(release_db_connection)
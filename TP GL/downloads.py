@@ -0,0 +1,138 @@
+import base64
+import hashlib
+import os
+import stat
+import threading
+
+from flask import current_app, send_from_directory
+from werkzeug.security import safe_join
+
+import db
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class FileMetadata:
+
+    def __init__(self, name, size, mtime_ns, sha256):
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+
+    def matches(self, st):
+        return self.size == st.st_size and self.mtime_ns == st.st_mtime_ns
+
+    def digest_base64(self):
+        return base64.b64encode(bytes.fromhex(self.sha256)).decode('ascii')
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Size, mtime and SHA-256 of the files in the uploads directory, stored in
+# the upload_metadata table so a restart does not hash everything again.
+# Files are hashed in the file watcher's thread when they appear; a request
+# only stats its file and re-hashes it if it was rewritten in place since.
+class MetadataIndex:
+
+    def __init__(self, watcher, pool):
+        self.watcher = watcher
+        self.directory = watcher.directory
+        self.pool = pool
+        self._entries = None
+        self._synced = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._entries is None:
+                with self.pool.connection() as conn:
+                    self._entries = {
+                        row['name']: FileMetadata(row['name'], row['size'], row['mtime_ns'], row['sha256'])
+                        for row in conn.execute('SELECT name, size, mtime_ns, sha256 FROM upload_metadata')
+                    }
+        return self._entries
+
+    # Metadata of a file, None if it is not a regular file of the directory
+    def lookup(self, name):
+        entries = self._load()
+        path = safe_join(self.directory, name)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        entry = entries.get(name)
+        if entry is not None and entry.matches(st):
+            return entry
+
+        sha256 = sha256_file(path)
+        after = os.stat(path)
+        entry = FileMetadata(name, after.st_size, after.st_mtime_ns, sha256)
+        if (st.st_size, st.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+            return entry  # still being written, hash it again next time
+        entries[name] = entry
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO upload_metadata (name, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE
+                SET size = excluded.size, mtime_ns = excluded.mtime_ns, sha256 = excluded.sha256
+            ''', (name, entry.size, entry.mtime_ns, entry.sha256))
+            conn.commit()
+        return entry
+
+    # file_watcher listener. Its first call lists every file, rows of files
+    # deleted while the app was down are dropped then.
+    def files_changed(self, added, removed):
+        entries = self._load()
+        if not self._synced:
+            self._synced = True
+            removed = sorted(set(entries) - set(added))
+        for name in added:
+            self.lookup(name)
+        if removed:
+            for name in removed:
+                entries.pop(name, None)
+            with self.pool.connection() as conn:
+                conn.executemany('DELETE FROM upload_metadata WHERE name = ?', [(name,) for name in removed])
+                conn.commit()
+
+
+# send_from_directory with the file's SHA-256 as a strong ETag and as digest
+# headers (RFC 9530 Repr-Digest, and the older RFC 3230 Digest); both
+# describe the whole file, also in a 206. Werkzeug answers Range (206, or 416), If-Range and
+# If-None-Match (304) itself and hands the file to the server's
+# wsgi.file_wrapper, which gunicorn and uWSGI serve with sendfile(); with
+# USE_X_SENDFILE the front server sends the file instead.
+def send_upload(index, name, **kwargs):
+    index.watcher.start()
+    entry = index.lookup(name)
+    if entry is None:
+        return None
+    response = send_from_directory(index.directory, name, etag=entry.sha256, max_age=0, **kwargs)
+    response.headers['Repr-Digest'] = f'sha-256=:{entry.digest_base64()}:'
+    response.headers['Digest'] = f'SHA-256={entry.digest_base64()}'
+    return response
+
+
+def get_index(app=None):
+    app = app or current_app
+    return app.extensions['upload_metadata']
+
+
+def init_app(app, watcher):
+    app.config.setdefault('USE_X_SENDFILE', os.environ.get('USE_X_SENDFILE') == '1')
+    index = MetadataIndex(watcher, db.get_pool(app))
+    watcher.listeners.append(index.files_changed)
+    app.extensions['upload_metadata'] = index
@@ -0,0 +1,181 @@
+import re
+from itertools import groupby
+
+from xlsx_stream import stream_xlsx, stream_zip
+
+
+# Filters of the students export of several groups: classes by id,
+# specialty, level or year, and groups by id (several, comma-separated or
+# repeated)
+ROSTER_FILTERS = {
+    'class_id': ('c.id = ?', int),
+    'specialty': ('c.specialty = ?', str),
+    'level': ('c.level = ?', str),
+    'year': ('c.year = ?', str),
+}
+
+# sheets: one sheet per group, combined: a single sheet with the class and
+# group of each student, zip: one .xlsx file per group
+ROSTER_LAYOUTS = ('sheets', 'combined', 'zip')
+
+# The groups of the export, and all their students in one ordered query.
+# Both walk classes by id, then idx_groups_class (class_id, name, type) and
+# idx_students_group (group_id, name, surname), so the rows come out in
+# order without a sort, and in the same group order. CROSS JOIN keeps SQLite
+# to that nesting: reading students first would sort the whole table.
+ROSTER_GROUPS = '''
+    SELECT g.id, g.name, g.type, c.name AS class_name
+    FROM classes c
+    CROSS JOIN groups g ON g.class_id = c.id
+    WHERE {where}
+    ORDER BY c.id, g.name, g.type, g.id
+'''
+ROSTER_STUDENTS = '''
+    SELECT g.id AS group_id, g.name AS group_name, g.type AS group_type, c.name AS class_name,
+           s.name, s.surname
+    FROM classes c
+    CROSS JOIN groups g ON g.class_id = c.id
+    CROSS JOIN students s ON s.group_id = g.id
+    WHERE {where}
+    ORDER BY c.id, g.name, g.type, g.id, s.name, s.surname
+'''
+
+# Excel refuses these in sheet names
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+# The attendance report (an attendance_matrix.AttendanceMatrix) as a stream
+# of .xlsx bytes. The matrix is already in memory, so the body needs no
+# database connection once the request has returned.
+def stream_attendance_report(matrix):
+    yield from stream_xlsx([('Attendance Report', matrix.report_rows())])
+
+
+# Rows of the students export of one group
+def students_export_rows(conn, group_id):
+    yield ['Name', 'Surname']
+    for student in conn.execute('SELECT name, surname FROM students WHERE group_id = ?', (group_id,)):
+        yield [student['name'], student['surname']]
+
+
+# Read the filters of the students export of several groups (see
+# ROSTER_FILTERS) from the query string. Raises ValueError.
+def roster_filters(values):
+    filters = {}
+    for name, (condition, convert) in ROSTER_FILTERS.items():
+        value = values.get(name)
+        if value not in (None, ''):
+            try:
+                filters[name] = convert(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid parameter: {name}')
+
+    group_ids = []
+    for value in values.getlist('group_id') if hasattr(values, 'getlist') else [values.get('group_id')]:
+        for item in str(value or '').split(','):
+            if item.strip():
+                try:
+                    group_ids.append(int(item))
+                except ValueError:
+                    raise ValueError('Invalid parameter: group_id')
+    if group_ids:
+        filters['group_id'] = group_ids
+    return filters
+
+
+# The two roster queries for the filters, as (groups sql, students sql,
+# params)
+def roster_queries(filters):
+    where, params = [], []
+    for name, (condition, convert) in ROSTER_FILTERS.items():
+        if name in filters:
+            where.append(condition)
+            params.append(filters[name])
+    if filters.get('group_id'):
+        where.append(f"g.id IN ({', '.join('?' * len(filters['group_id']))})")
+        params.extend(filters['group_id'])
+    where = ' AND '.join(where) or '1'
+    return ROSTER_GROUPS.format(where=where), ROSTER_STUDENTS.format(where=where), params
+
+
+# A distinct sheet (and file) name per group, "<class> <group>", within
+# Excel's 31 characters
+def sheet_names(groups):
+    names, used = [], set()
+    for group in groups:
+        base = INVALID_SHEET_CHARS.sub('_', f"{group['class_name']} {group['name']}").strip()[:31] or 'Group'
+        name, number = base, 1
+        while name.casefold() in used:
+            number += 1
+            suffix = f' ({number})'
+            name = base[:31 - len(suffix)] + suffix
+        used.add(name.casefold())
+        names.append(name)
+    return names
+
+
+# The sheets of the groups, each with its rows. The rows of all groups come
+# from one cursor over ROSTER_STUDENTS, shared in group order, so the sheets
+# must be read in order, each to the end (stream_xlsx and stream_zip do). A
+# group without students gets the header alone.
+def roster_sheets(groups, students):
+    students = groupby(students, key=lambda row: row['group_id'])
+    pending = [next(students, None)]
+
+    def rows(group_id):
+        yield ['Name', 'Surname']
+        if pending[0] is not None and pending[0][0] == group_id:
+            for student in pending[0][1]:
+                yield [student['name'], student['surname']]
+            pending[0] = next(students, None)
+
+    return [(name, rows(group['id'])) for name, group in zip(sheet_names(groups), groups)]
+
+
+# Rows of the single sheet of all the groups
+def roster_combined_rows(students):
+    yield ['Class', 'Group', 'Type', 'Name', 'Surname']
+    for student in students:
+        yield [student['class_name'], student['group_name'], student['group_type'], student['name'], student['surname']]
+
+
+# The students export of several groups as a stream of bytes: an .xlsx file
+# (one sheet per group, or combined) or a .zip of one .xlsx per group. Only
+# the list of groups and the current row are held in memory, however many
+# groups and students there are; the connection is read until the stream
+# ends. Raises LookupError when no group matches the filters.
+def stream_students_roster(conn, filters, layout):
+    groups_sql, students_sql, params = roster_queries(filters)
+    groups = conn.execute(groups_sql, params).fetchall()
+    if not groups:
+        raise LookupError('No groups match the selected filters.')
+
+    students = conn.execute(students_sql, params)
+    if layout == 'combined':
+        return stream_xlsx([('Students', roster_combined_rows(students))])
+    sheets = roster_sheets(groups, students)
+    if layout == 'zip':
+        return stream_zip([(f'{name}.xlsx', stream_xlsx([('Students', rows)])) for name, rows in sheets])
+    return stream_xlsx(sheets)
+
+
+# Rows of the attendance sheet of one session, laid out like export_session:
+# the session details in A1:B5, then the attendance table from row 7
+def session_export_rows(conn, session):
+    keys = session.keys()
+    yield ['Session ID', session['id']]
+    yield ['Group ID', session['group_id'] if 'group_id' in keys else 'N/A']
+    yield ['Name', session['name'] if 'name' in keys else 'N/A']
+    yield ['Date', session['date'] if 'date' in keys else 'N/A']
+    yield ['Time', session['time'] if 'time' in keys else 'N/A']
+    yield []
+    yield ['Name', 'Surname', 'Status', 'Observation']
+
+    students = conn.execute('''
+        SELECT s.name, s.surname, a.status, a.observation
+        FROM students s
+        JOIN attendance a ON s.id = a.student_id
+        WHERE a.session_id = ?
+    ''', (session['id'],))
+    for student in students:
+        yield [student['name'], student['surname'], student['status'], student['observation']]
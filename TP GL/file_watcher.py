@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import current_app
+
+
+WATCH_INTERVAL = float(os.environ.get('UPLOADS_WATCH_INTERVAL', '1'))
+
+# The directory listing is re-read when the directory's mtime changes, and
+# at least this often in case a change landed within one mtime tick
+FULL_SCAN_INTERVAL = 60
+
+# Deltas kept for clients resuming with Last-Event-ID; older clients get a
+# fresh snapshot instead
+EVENT_LOG_SIZE = 500
+
+# Seconds between keep-alive comments on an idle event stream
+KEEPALIVE = 15
+
+# Reconnection delay suggested to EventSource clients, in ms
+RETRY_MS = 3000
+
+log = logging.getLogger(__name__)
+
+
+# One background thread watching a directory for added and removed files.
+# The file names are kept in memory for /files, and every change is recorded
+# as a numbered delta for the /files/events stream. Event ids carry a token
+# of this process, so an id from before a restart is not mistaken for one
+# of ours.
+class FileWatcher:
+
+    def __init__(self, directory, interval=WATCH_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.files = frozenset()
+        self.last_event = 0
+        self.scans = 0
+        self._token = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=EVENT_LOG_SIZE)
+        self._changed = threading.Condition(threading.Lock())
+        self._dir_mtime = None
+        self._last_full_scan = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Called from the watcher thread as listener(added, removed), first
+        # with every file already there
+        self.listeners = []
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self.scan(force=True)
+                self._thread = threading.Thread(target=self._run, name='file-watcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        self._notify(sorted(self.files), [])
+        while True:
+            time.sleep(self.interval)
+            try:
+                added, removed = self.scan()
+            except OSError:
+                continue
+            if added or removed:
+                self._notify(added, removed)
+
+    def _notify(self, added, removed):
+        for listener in self.listeners:
+            try:
+                listener(added, removed)
+            except Exception:
+                log.exception('File watcher listener failed')
+
+    # Re-read the directory if it changed and record what was added/removed,
+    # returns the (added, removed) names
+    def scan(self, force=False):
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        now = time.monotonic()
+        if not force and mtime == self._dir_mtime and now - self._last_full_scan < FULL_SCAN_INTERVAL:
+            return [], []
+        self._dir_mtime = mtime
+        self._last_full_scan = now
+
+        files = frozenset()
+        if mtime is not None:
+            with os.scandir(self.directory) as entries:
+                files = frozenset(entry.name for entry in entries if entry.is_file())
+        baseline = self.scans == 0
+        self.scans += 1
+
+        with self._changed:
+            added, removed = sorted(files - self.files), sorted(self.files - files)
+            self.files = files
+            if (added or removed) and not baseline:
+                self.last_event += 1
+                self._events.append((self.last_event, added, removed))
+                self._changed.notify_all()
+        return added, removed
+
+    def list_files(self):
+        self.start()
+        return sorted(self.files)
+
+    def event_id(self, number):
+        return f'{self._token}-{number}'
+
+    # Position in the event log of a Last-Event-ID, None if unknown
+    def parse_event_id(self, event_id):
+        token, _, number = (event_id or '').partition('-')
+        if token != self._token or not number.isdigit():
+            return None
+        return int(number)
+
+    # Wait up to timeout for events after position `since` (None for a new
+    # client). Returns (new position, [(event id, event name, data)]): a
+    # 'snapshot' with every file when the client cannot be caught up from
+    # the log, otherwise one 'files' delta per change.
+    def wait(self, since, timeout):
+        self.start()
+        with self._changed:
+            if since == self.last_event:
+                self._changed.wait(timeout)
+            return self._events_after(since)
+
+    # wait() for the event loop: the watcher only moves on once per interval,
+    # so checking the event counter that often misses nothing and holds no
+    # thread while the client is idle
+    async def wait_async(self, since, timeout):
+        self.start()
+        deadline = time.monotonic() + timeout
+        while since == self.last_event and time.monotonic() < deadline:
+            await asyncio.sleep(min(self.interval, max(deadline - time.monotonic(), 0)))
+        with self._changed:
+            return self._events_after(since)
+
+    def _events_after(self, since):
+        oldest = self._events[0][0] if self._events else self.last_event + 1
+        if since is None or since > self.last_event or since + 1 < oldest:
+            snapshot = {'files': sorted(self.files)}
+            return self.last_event, [(self.event_id(self.last_event), 'snapshot', snapshot)]
+
+        events = [
+            (self.event_id(number), 'files', {'added': added, 'removed': removed})
+            for number, added, removed in self._events
+            if number > since
+        ]
+        return self.last_event, events
+
+
+# Server-Sent Events for a client, resuming after last_event_id if the log
+# still has it. Runs until the client goes away.
+def stream_events(watcher, last_event_id=None):
+    yield f'retry: {RETRY_MS}\n\n'
+    since = watcher.parse_event_id(last_event_id)
+    while True:
+        since, events = watcher.wait(since, KEEPALIVE)
+        if not events:
+            yield ': keep-alive\n\n'
+        for event_id, name, data in events:
+            yield _format_event(event_id, name, data)
+
+
+# stream_events() for an ASGI server (see asgi.py)
+async def stream_events_async(watcher, last_event_id=None):
+    yield f'retry: {RETRY_MS}\n\n'
+    since = watcher.parse_event_id(last_event_id)
+    while True:
+        since, events = await watcher.wait_async(since, KEEPALIVE)
+        if not events:
+            yield ': keep-alive\n\n'
+        for event_id, name, data in events:
+            yield _format_event(event_id, name, data)
+
+
+def _format_event(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+def get_watcher(app=None):
+    app = app or current_app
+    return app.extensions['file_watcher']
+
+
+# The watcher thread starts on first use, so CLI commands do not start it
+def init_app(app, directory):
+    app.extensions['file_watcher'] = FileWatcher(directory)
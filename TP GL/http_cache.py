@@ -0,0 +1,164 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, make_response, request
+
+import compression
+from db import get_db_connection
+
+
+HTTP_CACHE_BYTES = int(os.environ.get('HTTP_CACHE_BYTES', str(32 * 1024 * 1024)))
+
+# Response headers kept with a cached body (Content-Length is recomputed)
+KEPT_HEADERS = ('Content-Type', 'Content-Disposition')
+
+
+# Version of one entity, bumped by the entity_version triggers every time a
+# write touches something its pages show (see migrations.create_entity_versions):
+#   ('classes', 0)     the class list
+#   ('class', id)      a class and its groups
+#   ('group', id)      a group, its students, sessions and their attendance
+def entity_version(conn, entity, entity_id):
+    row = conn.execute(
+        'SELECT version FROM entity_version WHERE entity = ? AND entity_id = ?', (entity, entity_id)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+class CachedResponse:
+
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+        # Strong ETag: two responses share it only if their bytes are equal
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.size = len(body)
+        self.mimetype = dict(headers).get('Content-Type', '').split(';')[0]
+        self._encoded = {}
+
+    # The body compressed with encoding, compressed on first use only
+    def encoded(self, encoding):
+        if encoding not in self._encoded:
+            self._encoded[encoding] = compression.compress(self.body, encoding)
+        return self._encoded[encoding]
+
+
+# Rendered responses, least recently used first, limited to max_bytes of
+# bodies. Keys include the entity versions the page was rendered at, so
+# entries of older versions are simply never asked for again and age out.
+class ResponseCache:
+
+    def __init__(self, max_bytes=HTTP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.size
+            self._entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+            }
+
+
+def get_cache(app=None):
+    app = app or current_app
+    return app.extensions['http_cache']
+
+
+# Cache a GET view per URL and entity versions. scopes is called with the
+# view arguments and returns the (entity, id) pairs the page depends on.
+# The response carries a strong ETag and is answered with 304 Not Modified
+# when the client already has it; only 200 responses are cached.
+def cached(scopes):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if request.method != 'GET':
+                return view(**kwargs)
+
+            conn = get_db_connection()
+            versions = tuple(
+                (entity, entity_id, entity_version(conn, entity, entity_id))
+                for entity, entity_id in scopes(**kwargs)
+            )
+            key = (request.endpoint, request.full_path, versions)
+
+            cache = get_cache()
+            entry = cache.get(key)
+            if entry is None:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                response.direct_passthrough = False
+                headers = [(name, response.headers[name]) for name in KEPT_HEADERS if name in response.headers]
+                entry = CachedResponse(response.get_data(), headers)
+                cache.put(key, entry)
+
+            # Each encoding of the body is a different representation with
+            # its own ETag
+            encoding = compression.choose_encoding(entry.mimetype, entry.size)
+            if encoding:
+                response = Response(entry.encoded(encoding), headers=entry.headers)
+                response.headers['Content-Encoding'] = encoding
+                response.set_etag(f'{entry.etag}-{encoding}')
+            else:
+                response = Response(entry.body, headers=entry.headers)
+                response.set_etag(entry.etag)
+            # Stored by the browser, but revalidated on every use
+            response.headers['Cache-Control'] = 'no-cache'
+            response.make_conditional(request)
+            if response.status_code == 304:
+                cache.not_modified += 1
+            return response
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    app.config.setdefault('HTTP_CACHE_BYTES', HTTP_CACHE_BYTES)
+    app.extensions['http_cache'] = ResponseCache(app.config['HTTP_CACHE_BYTES'])
@@ -0,0 +1,365 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from flask import current_app
+
+import db
+import snapshot
+from attendance_matrix import SCOPE_PARAMS, load_attendance_matrix, report_scope
+from exports import students_export_rows, session_export_rows
+from xlsx_stream import stream_xlsx
+
+
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', '2'))
+# Worker processes that build the files; 0 builds them in the export threads.
+# With processes, workbook generation does not hold this process's GIL, so
+# it cannot slow the request threads down, and the export routes use them too.
+EXPORT_PROCESSES = int(os.environ.get('EXPORT_PROCESSES', '0'))
+# Seconds an export route waits for its worker process before it answers
+# with the job to poll instead of the file
+EXPORT_WAIT = float(os.environ.get('EXPORT_WAIT', '30'))
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', './export_cache')
+EXPORT_CACHE_BYTES = int(os.environ.get('EXPORT_CACHE_BYTES', str(512 * 1024 * 1024)))
+
+# Finished jobs are forgotten after an hour (their files stay in the cache)
+JOB_TTL = 3600
+
+
+def _attendance_sheets(conn, params):
+    scope = {name: params[name] for name in SCOPE_PARAMS if name in params}
+    matrix = load_attendance_matrix(conn, params['date_debut'], params['date_fin'], scope)
+    if not matrix.sessions:
+        raise LookupError('No sessions found in the selected date range.')
+    return len(matrix.students) + 1, [('Attendance Report', matrix.report_rows())]
+
+
+def _students_sheets(conn, params):
+    total = conn.execute('SELECT COUNT(*) FROM students WHERE group_id = ?', (params['group_id'],)).fetchone()[0] + 1
+    return total, [('Students', students_export_rows(conn, params['group_id']))]
+
+
+def _session_sheets(conn, params):
+    session = conn.execute('SELECT * FROM sessions WHERE id = ?', (params['session_id'],)).fetchone()
+    if not session:
+        raise LookupError('Session not found')
+    total = conn.execute('SELECT COUNT(*) FROM attendance WHERE session_id = ?', (session['id'],)).fetchone()[0] + 7
+    return total, [('Session Attendance', session_export_rows(conn, session))]
+
+
+# export type -> (parameters and their types, download name, sheet builder)
+# Builders return the number of rows they will produce (headers included)
+# so jobs can report progress, and the sheets to write
+EXPORT_TYPES = {
+    'attendance': ({'date_debut': str, 'date_fin': str}, 'Attendance_Report.xlsx', _attendance_sheets),
+    'students': ({'group_id': int}, 'students_group_{group_id}.xlsx', _students_sheets),
+    'session': ({'session_id': int}, 'session_{session_id}_attendance.xlsx', _session_sheets),
+}
+
+# Parsers of the optional parameters of an export
+OPTIONAL_PARAMS = {
+    'attendance': report_scope,
+}
+
+
+# Write the chunks to a temporary file and move it into place, so a
+# half-written export is never served
+def write_file(path, chunks):
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# Runs in an export worker process: build the export on a connection of its
+# own (to the database or snapshot given), in one read transaction, and
+# write it to path. Returns the number of rows written.
+def build_export_file(database, pragmas, export_type, params, path):
+    conn = db.ConnectionPool(database, pragmas=pragmas).connect()
+    try:
+        conn.execute('BEGIN')
+        rows_total, sheets = EXPORT_TYPES[export_type][2](conn, params)
+        write_file(path, stream_xlsx(sheets))
+    finally:
+        conn.close()
+    return rows_total
+
+
+# Export workers leave Ctrl+C to the server, which shuts them down
+def _ignore_interrupts():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# Finished exports on disk, one file per (export type, parameters, data
+# version), evicted least recently used first once the directory grows past
+# max_bytes
+class ExportCache:
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, export_type, params, version):
+        payload = json.dumps([export_type, params, version], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.xlsx')
+
+    # Path of the file of key, None if it is not cached. Only the lookups of
+    # new requests count as hits or misses, not fetching a job's own file.
+    def get(self, key, count=True):
+        path = self.path(key)
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            if count:
+                self.misses += 1
+            return None
+        if count:
+            self.hits += 1
+        return path
+
+    def put(self, key, chunks):
+        write_file(self.path(key), chunks)
+        self.evict(keep=key)
+        return self.path(key)
+
+    def evict(self, keep=None):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.xlsx'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for mtime, size, path in entries)
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if keep and path == self.path(keep):
+                    continue
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        files = [entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.xlsx')]
+        return {
+            'directory': self.directory,
+            'files': len(files),
+            'bytes': sum(files),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class ExportJob:
+
+    def __init__(self, export_type, params, cache_key, download_name):
+        self.id = uuid.uuid4().hex
+        self.export_type = export_type
+        self.params = params
+        self.cache_key = cache_key
+        self.download_name = download_name
+        self.status = 'queued'
+        self.rows_done = 0
+        self.rows_total = None
+        self.error = None
+        self.cached = False
+        self.created = time.time()
+        self.finished = None
+        self.not_found = False  # failed on a missing session or date range
+        self.done = threading.Event()
+
+    def track(self, rows):
+        for row in rows:
+            yield row
+            self.rows_done += 1
+
+    def to_dict(self):
+        progress = None
+        if self.status == 'done':
+            progress = 1.0
+        elif self.rows_total:
+            progress = round(min(self.rows_done / self.rows_total, 1.0), 4)
+        return {
+            'id': self.id,
+            'type': self.export_type,
+            'params': self.params,
+            'status': self.status,
+            'progress': progress,
+            'rows_done': self.rows_done,
+            'rows_total': self.rows_total,
+            'cached': self.cached,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+
+# Background export runner.
+# Jobs run on a small thread pool and read the latest database snapshot
+# (see snapshot.Snapshots), or are handed by those threads to worker
+# processes that open the same snapshot; an identical export that is
+# already queued or running is shared rather than started twice, and one
+# whose file is in the cache completes immediately.
+class ExportJobQueue:
+
+    def __init__(self, snapshots, cache, workers=EXPORT_WORKERS, processes=EXPORT_PROCESSES):
+        self.snapshots = snapshots
+        self.cache = cache
+        # One thread per running job, which waits on its worker process if any
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, processes), thread_name_prefix='export')
+        self.processes = None
+        if processes:
+            # spawn: the app's threads and open connections are not forked
+            self.processes = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_ignore_interrupts)
+        self.jobs = {}
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    def parse_params(self, export_type, values):
+        if export_type not in EXPORT_TYPES:
+            raise KeyError(export_type)
+        fields, download_name, build = EXPORT_TYPES[export_type]
+        params = {}
+        for name, convert in fields.items():
+            value = values.get(name)
+            if value in (None, ''):
+                raise ValueError(f'Missing parameter: {name}')
+            try:
+                params[name] = convert(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid parameter: {name}')
+        if export_type in OPTIONAL_PARAMS:
+            params.update(OPTIONAL_PARAMS[export_type](values))
+        return params
+
+    # Queue an export, or share the identical one queued or cached. conn is
+    # a live connection: the cache key takes its data_version, so a request
+    # made after a write never gets the file built before it.
+    def submit(self, conn, export_type, values):
+        params = self.parse_params(export_type, values)
+        fields, download_name, build = EXPORT_TYPES[export_type]
+
+        version = db.data_version(conn)
+        key = self.cache.key(export_type, params, version) if version is not None else None
+
+        with self._lock:
+            self._forget_old_jobs()
+            if key and key in self.pending:
+                return self.pending[key]
+
+            job = ExportJob(export_type, params, key, download_name.format(**params))
+            self.jobs[job.id] = job
+
+            if key and self.cache.get(key):
+                job.status = 'done'
+                job.cached = True
+                job.finished = time.time()
+                job.done.set()
+                return job
+
+            # Not cacheable without a data version, keep the file under the job id
+            job.cache_key = key or job.id
+            self.pending[job.cache_key] = job
+
+        self.executor.submit(self._run, job, build)
+        return job
+
+    def _run(self, job, build):
+        job.status = 'running'
+        try:
+            # pinned() gives the snapshot only if it is up to date with the
+            # live database, else the live database itself, so the file is
+            # never older than the data its cache key (or the entity
+            # versions http_cache keys the response on) was read from. The
+            # snapshot is kept until the export is written, even if a newer
+            # one replaces it meanwhile.
+            if self.processes:
+                with self.snapshots.pinned() as pool:
+                    # No progress until the worker is done
+                    future = self.processes.submit(build_export_file, pool.database, pool.pragmas, job.export_type,
+                                                   job.params, self.cache.path(job.cache_key))
+                    job.rows_total = job.rows_done = future.result()
+                self.cache.evict(keep=job.cache_key)
+            else:
+                with self.snapshots.connection() as conn:
+                    job.rows_total, sheets = build(conn, job.params)
+                    sheets = [(name, job.track(rows)) for name, rows in sheets]
+                    self.cache.put(job.cache_key, stream_xlsx(sheets))
+            job.status = 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            job.not_found = isinstance(e, LookupError)
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self.pending.pop(job.cache_key, None)
+            job.done.set()
+
+    # Block until the job is finished (or timeout), returns whether it is
+    def wait(self, job, timeout=None):
+        return job.done.wait(timeout)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    # Path of a finished job's file, None if it was evicted meanwhile
+    def result_path(self, job):
+        return self.cache.get(job.cache_key, count=False)
+
+    def _forget_old_jobs(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and now - job.finished > JOB_TTL:
+                del self.jobs[job_id]
+
+    def stats(self):
+        statuses = {}
+        for job in list(self.jobs.values()):
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {'jobs': statuses, 'processes': self.processes is not None, 'cache': self.cache.stats()}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.processes:
+            self.processes.shutdown(wait=False, cancel_futures=True)
+
+
+def get_queue(app=None):
+    app = app or current_app
+    return app.extensions['export_jobs']
+
+
+def init_app(app):
+    app.config.setdefault('EXPORT_CACHE_DIR', EXPORT_CACHE_DIR)
+    app.config.setdefault('EXPORT_CACHE_BYTES', EXPORT_CACHE_BYTES)
+    app.config.setdefault('EXPORT_PROCESSES', EXPORT_PROCESSES)
+    app.config.setdefault('EXPORT_WAIT', EXPORT_WAIT)
+    cache = ExportCache(app.config['EXPORT_CACHE_DIR'], app.config['EXPORT_CACHE_BYTES'])
+    app.extensions['export_jobs'] = ExportJobQueue(snapshot.get_snapshots(app), cache, processes=app.config['EXPORT_PROCESSES'])
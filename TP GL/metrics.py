@@ -0,0 +1,310 @@
+import bisect
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import jinja2
+from flask import g, request
+
+import attendance_writer
+import db
+import http_cache
+import rendering
+import snapshot
+from xlsx_stream import XLSX_MIMETYPE
+
+
+# Queries slower than this many ms are logged to the 'school.slow_query'
+# logger; unset (the default) turns the log off
+SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+# Distinct SQL fingerprints timed in series of their own; the API's field
+# and sort choices make new statements, so the queries past this many are
+# counted together under fingerprint="other"
+QUERY_FINGERPRINTS = int(os.environ.get('QUERY_FINGERPRINTS', '500'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+# A full Content-Type, charset included: pass it as content_type, not mimetype
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+slow_query_log = logging.getLogger('school.slow_query')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+# Minimal Prometheus metrics, enough for the text exposition format.
+# Each series is keyed by its tuple of label values; updates take one lock
+# and do no allocation beyond a new series.
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(self.labels, labels, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labels, labels)} {values[-1]}'
+            yield f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}'
+
+
+# A gauge of 1 per set of label values, which only carries the labels (an
+# info metric), for at most `limit` sets
+class Info:
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels, limit):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.limit = limit
+        self._values = set()
+        self._lock = threading.Lock()
+
+    # Returns whether the labels are recorded, False once the limit is reached
+    def add(self, labels):
+        with self._lock:
+            if labels not in self._values:
+                if len(self._values) >= self.limit:
+                    return False
+                self._values.add(labels)
+            return True
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values)
+        for labels in values:
+            yield f'{self.name}{_format_labels(self.labels, labels)} 1'
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # functions returning {name: value} gauges
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        for collect in self.collectors:
+            for name, value in collect().items():
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'school_request_seconds', 'Time to build the response of a route.',
+    ('endpoint', 'method', 'status')))
+QUERY_SECONDS = REGISTRY.register(Histogram(
+    'school_query_seconds', 'Time of execute() per SQL fingerprint (until the first row).',
+    ('fingerprint',), QUERY_BUCKETS))
+QUERY_INFO = REGISTRY.register(Info(
+    'school_query_info', 'SQL text of the fingerprints of school_query_seconds.',
+    ('fingerprint', 'sql'), QUERY_FINGERPRINTS))
+SLOW_QUERIES = REGISTRY.register(Counter(
+    'school_slow_queries_total', 'Queries slower than SLOW_QUERY_MS.', ('fingerprint',)))
+TEMPLATE_SECONDS = REGISTRY.register(Histogram(
+    'school_template_render_seconds', 'Jinja template render time.', ('template',), QUERY_BUCKETS))
+EXPORT_BYTES = REGISTRY.register(Histogram(
+    'school_export_bytes', 'Size of the Excel files sent.', ('endpoint',), BYTES_BUCKETS))
+EXPORT_STREAM_SECONDS = REGISTRY.register(Histogram(
+    'school_export_stream_seconds', 'Time to generate and send a streamed Excel file.', ('endpoint',)))
+
+
+# SQL text with literals replaced by ?, runs of placeholders in IN lists
+# folded and whitespace collapsed, so the same statement with different
+# values is counted once. Results are memoised by raw text.
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+_fingerprints = {}
+
+
+def fingerprint(sql):
+    cached = _fingerprints.get(sql)
+    if cached is None:
+        normalized = _SPACES.sub(' ', _LITERALS.sub('?', sql)).strip()
+        normalized = _PLACEHOLDER_LISTS.sub('(?, ...)', normalized)
+        cached = (hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12], normalized[:200])
+        if len(_fingerprints) > 5000:
+            _fingerprints.clear()
+        _fingerprints[sql] = cached
+    return cached
+
+
+def observe_query(sql, seconds):
+    key, text = fingerprint(sql)
+    series = key if QUERY_INFO.add((key, text)) else 'other'
+    QUERY_SECONDS.observe((series,), seconds)
+    if SLOW_QUERY_MS is not None and seconds * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc((series,))
+        slow_query_log.warning('%.1f ms [%s] %s', seconds * 1000, key, text)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+
+# Connection class for the pool: every execute goes through a timed cursor
+# (sqlite3's own Connection.execute would bypass a cursor subclass)
+class InstrumentedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class TimedTemplate(jinja2.Template):
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            TEMPLATE_SECONDS.observe((self.name or '<string>',), time.perf_counter() - start)
+
+
+def _count_export(chunks, endpoint, start):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        EXPORT_BYTES.observe((endpoint,), size)
+        EXPORT_STREAM_SECONDS.observe((endpoint,), time.perf_counter() - start)
+
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe((endpoint, request.method, str(response.status_code)), time.perf_counter() - start)
+
+    if response.mimetype == XLSX_MIMETYPE and response.status_code in (200, 206):
+        if response.content_length is not None:
+            EXPORT_BYTES.observe((endpoint,), response.content_length)
+        elif response.is_streamed:
+            response.response = _count_export(response.response, endpoint, time.perf_counter())
+    return response
+
+
+# Requests that raised never reach after_request
+def _record_failure(exception=None):
+    start = g.pop('metrics_start', None)
+    if start is not None and exception is not None:
+        REQUEST_SECONDS.observe((request.endpoint or 'unmatched', request.method, '500'), time.perf_counter() - start)
+
+
+def _numbers(prefix, stats):
+    return {
+        f'{prefix}_{name}': value
+        for name, value in stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+
+def init_app(app):
+    db.get_pool(app).factory = InstrumentedConnection
+    app.jinja_env.template_class = TimedTemplate
+
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.teardown_request(_record_failure)
+
+    REGISTRY.collectors.append(lambda: _numbers('school_db_pool', db.get_pool(app).stats()))
+    REGISTRY.collectors.append(lambda: _numbers('school_http_cache', http_cache.get_cache(app).stats()))
+    REGISTRY.collectors.append(lambda: _numbers('school_attendance_writer', attendance_writer.get_writer(app).stats()))
+    REGISTRY.collectors.append(lambda: _numbers('school_fragment_cache', rendering.get_fragments(app).stats()))
+    REGISTRY.collectors.append(lambda: _numbers('school_snapshot', snapshot.get_snapshots(app).stats()))
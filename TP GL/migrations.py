@@ -0,0 +1,659 @@
+import logging
+import re
+import sqlite3
+import sys
+import time
+
+import click
+
+import db
+import api
+import exports
+import analytics
+import attendance_matrix
+import repository
+import scheduling
+from attendance import rebuild_attendance_summary
+
+
+log = logging.getLogger(__name__)
+
+# Schema migrations.
+# Each migration runs once, in order, inside its own transaction; the last
+# applied version is stored in PRAGMA user_version. Statements use IF NOT
+# EXISTS so databases created before the runner existed upgrade cleanly.
+
+def create_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS classes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        specialty TEXT NOT NULL,
+        level TEXT NOT NULL,
+        year TEXT NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS groups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        type TEXT NOT NULL,
+        class_id INTEGER NOT NULL,
+        FOREIGN KEY (class_id) REFERENCES classes (id)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS students (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        surname TEXT NOT NULL,
+        sessions_attended INTEGER DEFAULT 0,
+        group_id INTEGER NOT NULL,
+        FOREIGN KEY (group_id) REFERENCES groups (id)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        time TIME NOT NULL,
+        FOREIGN KEY (group_id) REFERENCES groups (id)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS attendance (
+        student_id INTEGER,
+        session_id INTEGER,
+        status TEXT, -- 'present', 'absent', or 'justified'
+        observation TEXT,
+        PRIMARY KEY (student_id, session_id),
+        FOREIGN KEY (student_id) REFERENCES students(id),
+        FOREIGN KEY (session_id) REFERENCES sessions(id)
+    )''')
+
+
+# Single counter bumped by every write to the data tables, so caches can
+# tell whether the data changed since they computed something
+def create_data_version(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )''')
+    conn.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+    for table in db.DATA_TABLES:
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_{operation.lower()}_data_version
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END''')
+
+
+# Indexes for the filters used on every page. The extra columns make them
+# covering for the listed queries, so SQLite never visits the table rows.
+def create_hot_path_indexes(conn):
+    # groups(): SELECT * FROM groups WHERE class_id = ?
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_groups_class ON groups (class_id, name, type)')
+    # view_students, manage_students, save_attendance, export_students
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_group ON students (group_id, name, surname)')
+    # view_sessions: SELECT * FROM sessions WHERE group_id = ?
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_group ON sessions (group_id, date, time)')
+    # export_attendance: sessions WHERE date BETWEEN ? AND ? ORDER BY date
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_date ON sessions (date)')
+    # export_session, save_attendance: attendance WHERE session_id = ?
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_session ON attendance (session_id, student_id, status)')
+    # view_students: COUNT(*) FROM attendance WHERE student_id = ? AND status = 'present'
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_status ON attendance (student_id, status)')
+
+
+# Per-student present/absent/justified counts, kept exact by triggers on
+# attendance so the students page does not have to count attendance rows.
+# students.sessions_attended follows the present count.
+# (The missing summary row is added with INSERT ... WHERE NOT EXISTS rather
+# than INSERT OR IGNORE: inside a trigger fired by the attendance upsert the
+# outer statement's conflict handling would override the OR IGNORE.)
+def create_attendance_summary(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS attendance_summary (
+        student_id INTEGER PRIMARY KEY,
+        present INTEGER NOT NULL DEFAULT 0,
+        absent INTEGER NOT NULL DEFAULT 0,
+        justified INTEGER NOT NULL DEFAULT 0
+    )''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS attendance_summary_insert
+        AFTER INSERT ON attendance
+        BEGIN
+            INSERT INTO attendance_summary (student_id)
+            SELECT NEW.student_id
+            WHERE NOT EXISTS (SELECT 1 FROM attendance_summary WHERE student_id = NEW.student_id);
+            UPDATE attendance_summary
+            SET present = present + (NEW.status IS 'present'),
+                absent = absent + (NEW.status IS 'absent'),
+                justified = justified + (NEW.status IS 'justified')
+            WHERE student_id = NEW.student_id;
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS attendance_summary_update
+        AFTER UPDATE OF student_id, status ON attendance
+        WHEN OLD.status IS NOT NEW.status OR OLD.student_id IS NOT NEW.student_id
+        BEGIN
+            UPDATE attendance_summary
+            SET present = present - (OLD.status IS 'present'),
+                absent = absent - (OLD.status IS 'absent'),
+                justified = justified - (OLD.status IS 'justified')
+            WHERE student_id = OLD.student_id;
+            INSERT INTO attendance_summary (student_id)
+            SELECT NEW.student_id
+            WHERE NOT EXISTS (SELECT 1 FROM attendance_summary WHERE student_id = NEW.student_id);
+            UPDATE attendance_summary
+            SET present = present + (NEW.status IS 'present'),
+                absent = absent + (NEW.status IS 'absent'),
+                justified = justified + (NEW.status IS 'justified')
+            WHERE student_id = NEW.student_id;
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS attendance_summary_delete
+        AFTER DELETE ON attendance
+        BEGIN
+            UPDATE attendance_summary
+            SET present = present - (OLD.status IS 'present'),
+                absent = absent - (OLD.status IS 'absent'),
+                justified = justified - (OLD.status IS 'justified')
+            WHERE student_id = OLD.student_id;
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS attendance_summary_student_delete
+        AFTER DELETE ON students
+        BEGIN
+            DELETE FROM attendance_summary WHERE student_id = OLD.id;
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS attendance_summary_sessions_attended
+        AFTER UPDATE OF present ON attendance_summary
+        WHEN NEW.present IS NOT OLD.present
+        BEGIN
+            UPDATE students SET sessions_attended = NEW.present WHERE id = NEW.student_id;
+        END''')
+
+    # Only the correlated count on the students page used this index
+    conn.execute('DROP INDEX IF EXISTS idx_attendance_student_status')
+
+    rebuild_attendance_summary(conn)
+
+
+# Indexes matching the sort keys of the JSON API (api.RESOURCES), so a page
+# is an index seek from the cursor instead of a scan and sort of the table.
+# Per-class and per-group listings are served by the hot path indexes.
+def create_api_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_classes_name ON classes (name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_name ON students (name, surname)')
+    # Also serves export_attendance's date range, replaces idx_sessions_date
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_date_time ON sessions (date, time)')
+    conn.execute('DROP INDEX IF EXISTS idx_sessions_date')
+
+
+# Trigger statements adding 1 to the version of an entity (see
+# http_cache.entity_version), creating its row on first use
+def _bump_entity(entity, entity_id):
+    return f'''
+            INSERT INTO entity_version (entity, entity_id, version)
+            SELECT '{entity}', {entity_id}, 0
+            WHERE {entity_id} IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM entity_version WHERE entity = '{entity}' AND entity_id = {entity_id});
+            UPDATE entity_version SET version = version + 1
+            WHERE entity = '{entity}' AND entity_id = {entity_id};'''
+
+
+# Per-entity version counters for the HTTP cache, bumped by triggers so every
+# write path (routes, imports, CLI commands) invalidates the pages it affects
+def create_entity_versions(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS entity_version (
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (entity, entity_id)
+    ) WITHOUT ROWID''')
+
+    # table -> entities to bump, as (entity, id expression with {row} for NEW/OLD)
+    affects = {
+        'classes': [('classes', '0'), ('class', '{row}.id')],
+        'groups': [('class', '{row}.class_id'), ('group', '{row}.id')],
+        'students': [('group', '{row}.group_id')],
+        'sessions': [('group', '{row}.group_id')],
+        'attendance': [('group', '(SELECT group_id FROM sessions WHERE id = {row}.session_id)')],
+    }
+    for table, entities in affects.items():
+        for operation, rows in (('INSERT', ('NEW',)), ('UPDATE', ('OLD', 'NEW')), ('DELETE', ('OLD',))):
+            body = ''.join(
+                _bump_entity(entity, entity_id.format(row=row))
+                for row in rows
+                for entity, entity_id in entities
+            )
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_{operation.lower()}_entity_version
+                AFTER {operation} ON {table}
+                BEGIN{body}
+                END''')
+
+
+# Size, mtime and SHA-256 of the uploaded files (see downloads.MetadataIndex)
+def create_upload_metadata(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS upload_metadata (
+        name TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha256 TEXT NOT NULL
+    ) WITHOUT ROWID''')
+
+
+# Rows whose parent is gone, directly or further up (a student of a group
+# whose class is gone), per table, children first: deleting them in this
+# order cascades nothing, so each delete removes exactly the rows selected
+_GROUPS = 'SELECT id FROM groups WHERE class_id IN (SELECT id FROM classes)'
+ORPHANS = [
+    ('attendance', f'student_id NOT IN (SELECT id FROM students WHERE group_id IN ({_GROUPS})) '
+                   f'OR session_id NOT IN (SELECT id FROM sessions WHERE group_id IN ({_GROUPS}))'),
+    ('students', f'group_id NOT IN ({_GROUPS})'),
+    ('sessions', f'group_id NOT IN ({_GROUPS})'),
+    ('groups', 'class_id NOT IN (SELECT id FROM classes)'),
+]
+
+
+# Copy the orphaned rows into a new SQLite file next to the database
+# (<database>-orphans-<time>.db, one table per table) so that a purge can be
+# undone by hand. Returns the file's path and the rows copied per table, or
+# (None, {}) when there are no orphans.
+def backup_orphans(conn):
+    found = {}
+    for table, condition in ORPHANS:
+        cursor = conn.execute(f'SELECT * FROM {table} WHERE {condition}')
+        rows = cursor.fetchall()
+        if rows:
+            found[table] = ([column[0] for column in cursor.description], rows)
+    if not found:
+        return None, {}
+
+    database = conn.execute('PRAGMA database_list').fetchone()[2]
+    if not database:
+        raise RuntimeError(f"Orphaned rows in an in-memory database, not deleted: {', '.join(found)}")
+    path = f"{database}-orphans-{time.strftime('%Y%m%d-%H%M%S')}.db"
+    backup = sqlite3.connect(path)
+    try:
+        for table, (columns, rows) in found.items():
+            backup.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+            backup.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})", rows)
+        backup.commit()
+    finally:
+        backup.close()
+    return path, {table: len(rows) for table, (columns, rows) in found.items()}
+
+
+# Delete the orphaned rows (through the usual triggers, so the summaries and
+# versions follow), returns the number deleted per table
+def purge_orphans(conn):
+    return {table: conn.execute(f'DELETE FROM {table} WHERE {condition}').rowcount for table, condition in ORPHANS}
+
+
+def describe_counts(counts):
+    return ', '.join(f'{count} {table}' for table, count in counts.items())
+
+
+_REFERENCES = re.compile(r'(REFERENCES\s+\w+\s*\(\s*\w+\s*\))(?!\s*ON\s+DELETE)', re.IGNORECASE)
+
+
+# ON DELETE CASCADE on every foreign key, which db.PRAGMAS now enforces.
+# Only the constraint text changes, not how rows are stored, so the table
+# definitions are edited in place (the SQLite procedure for constraint
+# changes, see "Making Other Kinds Of Table Schema Changes" in the ALTER
+# TABLE documentation); the tables keep their indexes and triggers.
+# Existing orphans would violate the keys: they are copied to a backup file
+# (see backup_orphans), then deleted, and both are logged.
+def add_cascading_foreign_keys(conn):
+    version = conn.execute('PRAGMA schema_version').fetchone()[0]
+    conn.execute('PRAGMA writable_schema = ON')
+    try:
+        for table in db.DATA_TABLES:
+            sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+            conn.execute("UPDATE sqlite_master SET sql = ? WHERE type = 'table' AND name = ?",
+                         (_REFERENCES.sub(r'\1 ON DELETE CASCADE', sql), table))
+        conn.execute(f'PRAGMA schema_version = {version + 1}')
+    finally:
+        conn.execute('PRAGMA writable_schema = OFF')
+
+    path, counts = backup_orphans(conn)
+    if counts:
+        deleted = purge_orphans(conn)
+        log.warning('Deleted orphaned rows (%s), copied first to %s', describe_counts(deleted), path)
+    violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+    if violations:
+        raise RuntimeError(f'Foreign key violations left: {[tuple(row) for row in violations[:10]]}')
+
+
+# Full-text index of the student names for /api/students/search: an FTS5
+# table over students.name and surname, kept in step by triggers. Accents
+# are folded and 2 and 3 letter prefixes are indexed, so "bene" finds
+# "Bénédicte" without scanning the students.
+def create_student_search(conn):
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+        name, surname,
+        content = 'students', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS students_fts_insert
+        AFTER INSERT ON students
+        BEGIN
+            INSERT INTO students_fts (rowid, name, surname) VALUES (NEW.id, NEW.name, NEW.surname);
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS students_fts_delete
+        AFTER DELETE ON students
+        BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name, surname) VALUES ('delete', OLD.id, OLD.name, OLD.surname);
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS students_fts_update
+        AFTER UPDATE OF name, surname ON students
+        BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name, surname) VALUES ('delete', OLD.id, OLD.name, OLD.surname);
+            INSERT INTO students_fts (rowid, name, surname) VALUES (NEW.id, NEW.name, NEW.surname);
+        END''')
+    conn.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+
+# Time of the last change of each attendance row, in milliseconds since the
+# epoch: the client's clock for the JSON API, the server's for the form. NULL
+# for rows written before, which any change overrides.
+def add_attendance_changed_at(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(attendance)')]
+    if 'changed_at' not in columns:
+        conn.execute('ALTER TABLE attendance ADD COLUMN changed_at INTEGER')
+
+
+ROLLUP_KEY = '(period, period_start, group_id, student_id)'
+ROLLUP_COLUMNS = '(period, period_start, group_id, student_id, present, absent, justified)'
+RECORDED = "IN ('present', 'absent', 'justified')"
+
+
+def _add_counts():
+    return ', '.join(f'{status} = {status} + excluded.{status}' for status in analytics.STATUSES)
+
+
+# Statements adding (op '+') or removing (op '-') the status of one
+# attendance row ({row} is NEW or OLD) to the rollups of its session's week
+# and month. Nothing happens when the session is already gone: its delete
+# trigger has removed all its rows.
+def _rollup_row(row, op):
+    body = ''
+    for period, start in analytics.PERIODS.items():
+        if op == '+':
+            body += f'''
+            INSERT INTO attendance_rollup {ROLLUP_COLUMNS}
+            SELECT '{period}', {start.format('se.date')}, se.group_id, {row}.student_id,
+                   {', '.join(f"{row}.status IS '{status}'" for status in analytics.STATUSES)}
+            FROM sessions se
+            WHERE se.id = {row}.session_id AND {row}.status {RECORDED}
+            ON CONFLICT {ROLLUP_KEY} DO UPDATE SET {_add_counts()};'''
+        else:
+            body += f'''
+            UPDATE attendance_rollup
+            SET {', '.join(f"{status} = attendance_rollup.{status} - ({row}.status IS '{status}')" for status in analytics.STATUSES)}
+            FROM sessions se
+            WHERE se.id = {row}.session_id AND {row}.status {RECORDED}
+              AND attendance_rollup.period = '{period}' AND attendance_rollup.period_start = {start.format('se.date')}
+              AND attendance_rollup.group_id = se.group_id AND attendance_rollup.student_id = {row}.student_id;'''
+    return body
+
+
+# Same for all the attendance rows of a session ({session} is NEW or OLD),
+# when the session is deleted or moved to another date or group
+def _rollup_session(session, op):
+    counts = f'''SELECT student_id, {', '.join(f"SUM(status IS '{status}') AS {status}" for status in analytics.STATUSES)}
+                FROM attendance
+                WHERE session_id = {session}.id AND status {RECORDED}
+                GROUP BY student_id'''
+    body = ''
+    for period, start in analytics.PERIODS.items():
+        if op == '+':
+            body += f'''
+            INSERT INTO attendance_rollup {ROLLUP_COLUMNS}
+            SELECT '{period}', {start.format(f'{session}.date')}, {session}.group_id, x.student_id,
+                   x.present, x.absent, x.justified
+            FROM ({counts}) x
+            WHERE true
+            ON CONFLICT {ROLLUP_KEY} DO UPDATE SET {_add_counts()};'''
+        else:
+            body += f'''
+            UPDATE attendance_rollup
+            SET {', '.join(f'{status} = attendance_rollup.{status} - x.{status}' for status in analytics.STATUSES)}
+            FROM ({counts}) x
+            WHERE attendance_rollup.period = '{period}' AND attendance_rollup.period_start = {start.format(f'{session}.date')}
+              AND attendance_rollup.group_id = {session}.group_id AND attendance_rollup.student_id = x.student_id;'''
+    return body
+
+
+# Weekly and monthly counts of each status per student and group of the
+# session, for /analytics: kept exact by triggers on every write to
+# attendance and sessions, so the analytics never scan the attendance table
+# (see analytics.verify_rollups and 'flask attendance-rollups')
+def create_attendance_rollups(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS attendance_rollup (
+        period TEXT NOT NULL,         -- 'week' or 'month'
+        period_start DATE NOT NULL,   -- its first day
+        group_id INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        present INTEGER NOT NULL DEFAULT 0,
+        absent INTEGER NOT NULL DEFAULT 0,
+        justified INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, period_start, group_id, student_id)
+    ) WITHOUT ROWID''')
+    # A group's or class's periods, and a student's
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_rollup_group ON attendance_rollup (group_id, period, period_start)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_rollup_student ON attendance_rollup (student_id, period, period_start)')
+
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS attendance_rollup_insert
+        AFTER INSERT ON attendance
+        BEGIN{_rollup_row('NEW', '+')}
+        END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS attendance_rollup_update
+        AFTER UPDATE OF student_id, session_id, status ON attendance
+        WHEN OLD.status IS NOT NEW.status OR OLD.student_id IS NOT NEW.student_id
+          OR OLD.session_id IS NOT NEW.session_id
+        BEGIN{_rollup_row('OLD', '-')}{_rollup_row('NEW', '+')}
+        END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS attendance_rollup_delete
+        AFTER DELETE ON attendance
+        BEGIN{_rollup_row('OLD', '-')}
+        END''')
+    # Before the delete, while the cascaded attendance rows are still there
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS sessions_rollup_delete
+        BEFORE DELETE ON sessions
+        BEGIN{_rollup_session('OLD', '-')}
+        END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS sessions_rollup_update
+        AFTER UPDATE OF date, group_id ON sessions
+        WHEN OLD.date IS NOT NEW.date OR OLD.group_id IS NOT NEW.group_id
+        BEGIN{_rollup_session('OLD', '-')}{_rollup_session('NEW', '+')}
+        END''')
+
+    analytics.rebuild_rollups(conn)
+
+
+# (version, description, function), never reorder or edit applied entries
+MIGRATIONS = [
+    (1, 'base tables', create_tables),
+    (2, 'data version counter', create_data_version),
+    (3, 'hot path indexes', create_hot_path_indexes),
+    (4, 'attendance summary', create_attendance_summary),
+    (5, 'api sort indexes', create_api_indexes),
+    (6, 'entity versions', create_entity_versions),
+    (7, 'upload metadata', create_upload_metadata),
+    (8, 'cascading foreign keys', add_cascading_foreign_keys),
+    (9, 'student search', create_student_search),
+    (10, 'attendance change times', add_attendance_changed_at),
+    (11, 'attendance rollups', create_attendance_rollups),
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+# Apply the migrations the database has not seen yet, returns the list of
+# versions applied. Safe to call on every start: each step re-checks the
+# version under a write lock, so concurrent workers do not apply it twice.
+def migrate(conn):
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(conn) < version:
+                apply(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
+
+
+# Queries run on every page load, with the tables (as named in the plan, so
+# by alias) they may legitimately scan in full. Keep these in step with the
+# SQL in app.py and repository.py.
+# The attendance report queries for one scope, as HOT_QUERIES entries
+def report_queries(label, scope):
+    queries = attendance_matrix.report_queries('2024-01-01', '2024-12-31', scope)
+    return [(f'attendance report {name} ({label})', sql, params, ()) for name, (sql, params) in queries.items()]
+
+
+HOT_QUERIES = [
+    ('groups', repository.GROUPS_OF_CLASS, (1,), ()),
+    ('manage_students', repository.SESSION_ROSTER, (1,), ()),
+    ('save_attendance students', repository.STUDENT_IDS_OF_GROUP, (1,), ()),
+    ('save_attendance previous', 'SELECT student_id, status FROM attendance WHERE session_id = ?', (1,), ()),
+    ('view_sessions', repository.SESSIONS_OF_GROUP, (1,), ()),
+    # export_attendance and /stats/attendance, whole range and narrowed
+    *report_queries('all', {}),
+    *report_queries('group', {'group_id': 1}),
+    *report_queries('class', {'class_id': 1}),
+    *report_queries('specialty', {'specialty': 'Informatique'}),
+    ('export_session', '''
+        SELECT s.name, s.surname, a.status, a.observation
+        FROM students s
+        JOIN attendance a ON s.id = a.student_id
+        WHERE a.session_id = ?
+    ''', (1,), ()),
+    ('export_students', 'SELECT name, surname FROM students WHERE group_id = ?', (1,), ()),
+]
+
+
+# The two queries of the students export of several groups, as HOT_QUERIES
+# entries
+def roster_queries(label, filters, allowed):
+    groups, students, params = exports.roster_queries(filters)
+    return [(f'export students {label} groups', groups, params, allowed),
+            (f'export students {label} rows', students, params, allowed)]
+
+
+# A page of the JSON API, built exactly like the /api/<resource> route does,
+# starting after a cursor
+def api_query(resource, args):
+    name = f"api {resource} {' '.join(f'{key}={value}' for key, value in args.items())}"
+    args = dict(args)
+    sort = args.get('sort', 'id')
+    size = len(api.RESOURCES[resource]['sorts'][sort.lstrip('-')])
+    args['cursor'] = api.encode_cursor(sort, [1] * size)
+    sql, params = api.build_query(resource, args)[:2]
+    return (name, sql, params, ())
+
+
+HOT_QUERIES += [
+    api_query('classes', {'sort': 'name'}),
+    api_query('groups', {'class_id': 1, 'sort': 'name'}),
+    api_query('students', {'sort': 'name'}),
+    # view_students' first page
+    api_query('students', {'group_id': 1, 'sort': 'name'}),
+    api_query('students', {'sort': '-id'}),
+    api_query('sessions', {'sort': 'date', 'date_from': '2024-01-01'}),
+    api_query('sessions', {'group_id': 1, 'sort': 'date'}),
+    # The full-text index is read as a virtual table, the rest by primary key
+    ('api students search', *api.build_search({'q': 'ben', 'cursor': api.encode_cursor('rank', [-1.0, 1])})[:2], ('f',)),
+    # /analytics, a month of a class
+    *[(f'analytics {by}', *analytics.build_rollup_query(by, {'class_id': 1, 'from': '2024-10-01', 'to': '2024-10-31'})[:2], ())
+      for by in analytics.DIMENSIONS],
+    # The conflicts of a semester's schedule
+    ('schedule sessions', scheduling.SESSIONS_IN_RANGE, (1, '2024-09-01', '2025-01-31'), ()),
+    # The students export of a class, and of a level (the classes are few)
+    *roster_queries('class', {'class_id': 1}, ()),
+    *roster_queries('level', {'level': '1'}, ('c',)),
+]
+
+SCAN = re.compile(r'^SCAN (\w+)')
+
+
+# Run EXPLAIN QUERY PLAN on every hot query and return the full table scans
+# that are not expected, as (query name, plan line) pairs
+def find_scans(conn, queries=None):
+    problems = []
+    for name, sql, params, allowed in queries or HOT_QUERIES:
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            match = SCAN.match(row[3])
+            if match and match.group(1) not in allowed:
+                problems.append((name, row[3]))
+    return problems
+
+
+def database_size(conn):
+    return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+
+def init_app(app):
+    # Bring the schema up to date before the first request
+    conn = db.get_pool(app).connect()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations."""
+        conn = db.get_pool(app).connect()
+        try:
+            applied = migrate(conn)
+            click.echo(f'Schema at version {schema_version(conn)}, applied: {applied or "nothing"}')
+        finally:
+            conn.close()
+
+    # Deletes are cascaded by the database, this is only for orphans left by
+    # writes made without foreign key enforcement (other tools, old copies)
+    @app.cli.command('compact')
+    def compact_command():
+        """Delete orphaned rows, then VACUUM and ANALYZE the database."""
+        conn = db.get_pool(app).connect()
+        try:
+            before = database_size(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                path, counts = backup_orphans(conn)
+                deleted = purge_orphans(conn)
+                deleted['empty attendance_rollup'] = analytics.prune_rollups(conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            conn.execute('VACUUM')
+            conn.execute('ANALYZE')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            after = database_size(conn)
+        finally:
+            conn.close()
+        click.echo(f'Orphans deleted: {describe_counts(deleted)}')
+        if path:
+            click.echo(f'Orphaned rows copied to {path}')
+        click.echo(f'Database size: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB')
+
+    # Plans are checked on an empty copy of the schema: with no statistics the
+    # planner only goes by the indexes, so the result does not depend on how
+    # much data a particular database holds
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Fail if a hot-path query is planned as a full table scan."""
+        conn = sqlite3.connect(':memory:')
+        try:
+            migrate(conn)
+            problems = find_scans(conn)
+        finally:
+            conn.close()
+        for name, detail in problems:
+            click.echo(f'{name}: {detail}', err=True)
+        if problems:
+            sys.exit(1)
+        click.echo(f'{len(HOT_QUERIES)} hot queries checked, no table scans.')
@@ -0,0 +1,107 @@
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+from markupsafe import Markup
+
+
+FRAGMENT_CACHE_BYTES = int(os.environ.get('FRAGMENT_CACHE_BYTES', str(8 * 1024 * 1024)))
+
+
+# Rendered fragments (the rows of the long pages), least recently used
+# first, limited to max_bytes of text. A fragment is keyed by its template
+# and every value it is rendered with, so a row whose student or session
+# changed gets a new key and is rendered again while the unchanged rows of
+# the same page are reused; the old entries age out.
+class FragmentCache:
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        if len(html) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._entries[key] = html
+            self.bytes += len(html)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def get_fragments(app=None):
+    app = app or current_app
+    return app.extensions['fragment_cache']
+
+
+# Rows (sqlite3.Row or dict) and plain values as a hashable cache key part
+def _freeze(value):
+    if hasattr(value, 'keys'):
+        return tuple((key, value[key]) for key in value.keys())
+    return value
+
+
+# {{ fragment('fragments/student_row.html', student=student, group_id=group.id) }}
+# renders the template with only those values, through the fragment cache.
+# The fragment must not depend on anything else (no loop.index, no g), and
+# the URLs it builds depend on the application root, which is in the key.
+def fragment(template_name, **context):
+    key = (template_name, request.script_root,
+           tuple((name, _freeze(value)) for name, value in sorted(context.items())))
+    cache = get_fragments()
+    html = cache.get(key)
+    if html is None:
+        html = current_app.jinja_env.get_template(template_name).render(context)
+        cache.put(key, html)
+    return Markup(html)
+
+
+# Compile every page and fragment now rather than on its first request.
+# Compiled templates stay in the Jinja cache; they are only checked for
+# changes on disk when auto-reload is on (the debug server).
+def precompile_templates(app):
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def init_app(app):
+    app.config.setdefault('FRAGMENT_CACHE_BYTES', FRAGMENT_CACHE_BYTES)
+    app.extensions['fragment_cache'] = FragmentCache(app.config['FRAGMENT_CACHE_BYTES'])
+    app.jinja_env.globals['fragment'] = fragment
+    precompile_templates(app)
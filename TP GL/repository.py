@@ -0,0 +1,106 @@
+from flask import g
+
+
+# The statements of the pages, as constant SQL texts with every value
+# passed as a parameter: sqlite3 prepares each distinct text once per
+# connection and reuses it from the connection's statement cache (see
+# db.STATEMENT_CACHE_SIZE), and the pool keeps the connections open.
+ALL_CLASSES = 'SELECT * FROM classes'
+CLASS_BY_ID = 'SELECT * FROM classes WHERE id = ?'
+GROUP_BY_ID = 'SELECT * FROM groups WHERE id = ?'
+SESSION_BY_ID = 'SELECT * FROM sessions WHERE id = ?'
+GROUPS_OF_CLASS = 'SELECT * FROM groups WHERE class_id = ?'
+SESSIONS_OF_GROUP = 'SELECT * FROM sessions WHERE group_id = ?'
+STUDENT_IDS_OF_GROUP = 'SELECT id FROM students WHERE group_id = ?'
+
+# A session with its group and the group's students, each with their
+# attendance at the session: one row per student, or a single row with a
+# NULL student id for an empty group
+SESSION_ROSTER = '''
+    SELECT se.id AS session_id, se.group_id, se.date, se.time,
+           g.name AS group_name, g.type AS group_type, g.class_id,
+           st.id, st.name, st.surname, a.status, a.observation
+    FROM sessions se
+    LEFT JOIN groups g ON g.id = se.group_id
+    LEFT JOIN students st ON st.group_id = se.group_id
+    LEFT JOIN attendance a ON a.student_id = st.id AND a.session_id = se.id
+    WHERE se.id = ?
+'''
+
+ROW_BY_ID = {'classes': CLASS_BY_ID, 'groups': GROUP_BY_ID, 'sessions': SESSION_BY_ID}
+
+
+# Class, group and session rows already read in this request, by (table,
+# id), so each one is fetched at most once per request. Rows are plain
+# dicts (None for a missing id); the map is not refreshed after a write,
+# the routes that write redirect rather than read the row again.
+def _identity_map():
+    if 'identity_map' not in g:
+        g.identity_map = {}
+    return g.identity_map
+
+
+def _remember(table, rows):
+    identity_map = _identity_map()
+    return [identity_map.setdefault((table, row['id']), dict(row)) for row in rows]
+
+
+def get_row(conn, table, row_id):
+    identity_map = _identity_map()
+    key = (table, row_id)
+    if key not in identity_map:
+        row = conn.execute(ROW_BY_ID[table], (row_id,)).fetchone()
+        identity_map[key] = dict(row) if row else None
+    return identity_map[key]
+
+
+def get_class(conn, class_id):
+    return get_row(conn, 'classes', class_id)
+
+
+def get_group(conn, group_id):
+    return get_row(conn, 'groups', group_id)
+
+
+def get_session(conn, session_id):
+    return get_row(conn, 'sessions', session_id)
+
+
+def all_classes(conn):
+    return _remember('classes', conn.execute(ALL_CLASSES))
+
+
+def groups_of_class(conn, class_id):
+    return _remember('groups', conn.execute(GROUPS_OF_CLASS, (class_id,)))
+
+
+def sessions_of_group(conn, group_id):
+    return _remember('sessions', conn.execute(SESSIONS_OF_GROUP, (group_id,)))
+
+
+def student_ids_of_group(conn, group_id):
+    return [row['id'] for row in conn.execute(STUDENT_IDS_OF_GROUP, (group_id,))]
+
+
+# The session management page in one query: (session, group, students),
+# or None if the session does not exist. group is None if the session's
+# group is gone; students are rows with id, name, surname, status and
+# observation.
+def load_session_roster(conn, session_id):
+    rows = conn.execute(SESSION_ROSTER, (session_id,)).fetchall()
+    if not rows:
+        return None
+    first = rows[0]
+    identity_map = _identity_map()
+
+    session = identity_map.setdefault(('sessions', session_id), {
+        'id': first['session_id'], 'group_id': first['group_id'], 'date': first['date'], 'time': first['time'],
+    })
+    group = None
+    if first['class_id'] is not None:
+        group = identity_map.setdefault(('groups', first['group_id']), {
+            'id': first['group_id'], 'name': first['group_name'], 'type': first['group_type'],
+            'class_id': first['class_id'],
+        })
+    students = [row for row in rows if row['id'] is not None]
+    return session, group, students
@@ -0,0 +1,232 @@
+import datetime
+import os
+import re
+
+import repository
+
+
+# Most sessions one schedule may create, over all its groups
+MAX_SESSIONS = int(os.environ.get('SCHEDULE_MAX_SESSIONS', '10000'))
+
+# Day names, numbered like datetime.date.weekday() (Monday is 0)
+WEEKDAYS = {
+    name: number
+    for names in (
+        ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'),
+        ('lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche'),
+    )
+    for number, name in enumerate(names)
+}
+
+ON_CONFLICT = ('skip', 'abort')
+
+INSERT_SESSION = 'INSERT INTO sessions (group_id, date, time) VALUES (?, ?, ?)'
+# The sessions of a group over the schedule's dates, read from
+# idx_sessions_group (group_id, date, time) alone
+SESSIONS_IN_RANGE = 'SELECT id, date, time FROM sessions WHERE group_id = ? AND date BETWEEN ? AND ?'
+
+
+def _date(value, name):
+    try:
+        return datetime.date.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f'{name} must be a date (YYYY-MM-DD)')
+
+
+# Times are stored as HH:MM, like the session forms send them
+def _time(value, name):
+    try:
+        return datetime.datetime.strptime(str(value).strip(), '%H:%M').strftime('%H:%M')
+    except ValueError:
+        raise ValueError(f'{name} must be a time (HH:MM)')
+
+
+def _weekday(value, name):
+    if isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 6:
+        return value
+    if str(value).strip().casefold() not in WEEKDAYS:
+        raise ValueError(f'{name} must be a day name or a number from 0 (Monday) to 6')
+    return WEEKDAYS[str(value).strip().casefold()]
+
+
+# A list from a JSON array, or from form text with one item per line (or
+# separated by commas)
+def _items(value, name):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in re.split(r'[\n,;]', value) if item.strip()]
+    if not isinstance(value, list):
+        raise ValueError(f'{name} must be a list')
+    return value
+
+
+# {"weekday": "monday", "time": "09:40"} or "monday 09:40"
+def _slot(item, name):
+    if isinstance(item, dict):
+        weekday, time = item.get('weekday'), item.get('time')
+    else:
+        parts = str(item).split()
+        if len(parts) != 2:
+            raise ValueError(f'{name} must be a day and a time, e.g. "monday 09:40"')
+        weekday, time = parts
+    return _weekday(weekday, f'{name}.weekday'), _time(time, f'{name}.time')
+
+
+# "2024-11-01" or a range of dates such as "2024-12-22..2025-01-05"
+def _excluded(item, name):
+    first, _, last = str(item).partition('..')
+    first = _date(first, name)
+    last = _date(last, name) if last else first
+    if last < first:
+        raise ValueError(f'{name} ends before it starts')
+    return first, last
+
+
+# Weekly sessions of a group, or of every group of a class, between two
+# dates (both included), except on the excluded dates
+class Schedule:
+
+    def __init__(self, slots, start, end, excluded=(), every=1, group_id=None, class_id=None, on_conflict='skip'):
+        self.slots = sorted(set(slots))
+        self.start = start
+        self.end = end
+        self.excluded = excluded
+        self.every = every
+        self.group_id = group_id
+        self.class_id = class_id
+        self.on_conflict = on_conflict
+
+    def is_excluded(self, day):
+        return any(first <= day <= last for first, last in self.excluded)
+
+    # The (date, time) of every session, in order, as stored
+    def occurrences(self):
+        found = []
+        for weekday, time in self.slots:
+            day = self.start + datetime.timedelta(days=(weekday - self.start.weekday()) % 7)
+            while day <= self.end:
+                if not self.is_excluded(day):
+                    found.append((day.isoformat(), time))
+                    if len(found) > MAX_SESSIONS:
+                        raise ValueError(f'A schedule creates at most {MAX_SESSIONS} sessions')
+                day += datetime.timedelta(weeks=self.every)
+        return sorted(found)
+
+
+# Read a schedule from a JSON body or a form:
+#   group_id or class_id   the group, or every group of the class
+#   slots                  [{"weekday": "monday", "time": "09:40"}, ...] or
+#                          lines such as "monday 09:40" (French day names and
+#                          0 for Monday to 6 work too)
+#   start, end             first and last dates
+#   exclude                dates or date ranges ("2024-12-22..2025-01-05")
+#                          without sessions, e.g. the holidays
+#   every                  weeks between two sessions of a slot (default 1)
+#   on_conflict            skip (default) the sessions that already exist,
+#                          or abort and create none
+# Raises ValueError.
+def parse_schedule(values):
+    if not isinstance(values, dict):
+        raise ValueError('Expected the schedule as an object')
+
+    ids = {}
+    for name in ('group_id', 'class_id'):
+        if values.get(name) not in (None, ''):
+            try:
+                ids[name] = int(values[name])
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid parameter: {name}')
+    if len(ids) != 1:
+        raise ValueError('Give either a group_id or a class_id')
+
+    slots = [_slot(item, f'slots[{index}]') for index, item in enumerate(_items(values.get('slots'), 'slots'))]
+    if not slots:
+        raise ValueError('Give at least one slot, e.g. "monday 09:40"')
+
+    for name in ('start', 'end'):
+        if not values.get(name):
+            raise ValueError(f'Missing parameter: {name}')
+    start, end = _date(values['start'], 'start'), _date(values['end'], 'end')
+    if end < start:
+        raise ValueError('end is before start')
+
+    excluded = [_excluded(item, f'exclude[{index}]') for index, item in enumerate(_items(values.get('exclude'), 'exclude'))]
+
+    try:
+        every = int(values.get('every') or 1)
+    except (TypeError, ValueError):
+        raise ValueError('every must be a number of weeks')
+    if every < 1:
+        raise ValueError('every must be at least 1')
+
+    on_conflict = values.get('on_conflict') or 'skip'
+    if on_conflict not in ON_CONFLICT:
+        raise ValueError(f"on_conflict must be one of: {', '.join(ON_CONFLICT)}")
+
+    return Schedule(slots, start, end, excluded, every, on_conflict=on_conflict, **ids)
+
+
+# The groups the schedule is for. Raises LookupError for a missing group or
+# class.
+def schedule_groups(conn, schedule):
+    if schedule.group_id is not None:
+        group = conn.execute(repository.GROUP_BY_ID, (schedule.group_id,)).fetchone()
+        if not group:
+            raise LookupError(f'Group {schedule.group_id} not found')
+        return [group]
+    if not conn.execute(repository.CLASS_BY_ID, (schedule.class_id,)).fetchone():
+        raise LookupError(f'Class {schedule.class_id} not found')
+    return conn.execute(repository.GROUPS_OF_CLASS, (schedule.class_id,)).fetchall()
+
+
+# Split the sessions of the schedule into the new ones and those the group
+# already has at the same date and time
+def plan_sessions(conn, schedule, groups, occurrences):
+    sessions, conflicts = [], []
+    first, last = schedule.start.isoformat(), schedule.end.isoformat()
+    for group in groups:
+        existing = {(row['date'], row['time']): row['id'] for row in conn.execute(SESSIONS_IN_RANGE, (group['id'], first, last))}
+        for date, time in occurrences:
+            session = {'group_id': group['id'], 'date': date, 'time': time}
+            if (date, time) in existing:
+                session['session_id'] = existing[(date, time)]
+                conflicts.append(session)
+            else:
+                sessions.append(session)
+    return sessions, conflicts
+
+
+# Create the sessions of the schedule in one transaction, the conflicts
+# checked under the write lock so that no session is created twice. With
+# dry_run, only report what would be created. Returns the groups, the new
+# sessions (created or to be), the conflicts (with the id of the existing
+# session) and how many sessions were created; none if a conflict aborted.
+# Raises ValueError and LookupError.
+def schedule_sessions(conn, schedule, dry_run=False):
+    groups = schedule_groups(conn, schedule)
+    occurrences = schedule.occurrences()
+    if len(occurrences) * len(groups) > MAX_SESSIONS:
+        raise ValueError(f'A schedule creates at most {MAX_SESSIONS} sessions')
+
+    created = 0
+    if not dry_run:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        sessions, conflicts = plan_sessions(conn, schedule, groups, occurrences)
+        if not dry_run and not (conflicts and schedule.on_conflict == 'abort'):
+            conn.executemany(INSERT_SESSION, [(s['group_id'], s['date'], s['time']) for s in sessions])
+            conn.commit()
+            created = len(sessions)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+
+    return {
+        'dry_run': dry_run,
+        'groups': [group['id'] for group in groups],
+        'sessions': sessions,
+        'conflicts': conflicts,
+        'created': created,
+        'aborted': bool(conflicts) and schedule.on_conflict == 'abort',
+    }
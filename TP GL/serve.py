@@ -0,0 +1,41 @@
+# Production launcher: the app under uvicorn through asgi.py, with the
+# export files built in worker processes.
+#
+# Run from the "TP GL" directory:
+#
+#     python serve.py --host 0.0.0.0 --port 8000
+#
+# One server process is enough: requests run in its threads, exports in
+# its export processes, and the export jobs, caches and the uploads watcher
+# live in its memory (several processes would not share them).
+import argparse
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app under uvicorn')
+    parser.add_argument('--host', default=os.environ.get('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    parser.add_argument('--export-processes', type=int,
+                        help='worker processes for the exports (default: EXPORT_PROCESSES, or half the CPUs)')
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    # Read by jobs when the app is imported
+    if args.export_processes is not None:
+        os.environ['EXPORT_PROCESSES'] = str(args.export_processes)
+    os.environ.setdefault('EXPORT_PROCESSES', str(max(1, (os.cpu_count() or 2) // 2)))
+
+    import uvicorn
+    uvicorn.run(
+        'asgi:application',
+        host=args.host,
+        port=args.port,
+        log_level=args.log_level,
+        # Event streams never end by themselves, do not wait for them on shutdown
+        timeout_graceful_shutdown=5,
+    )
+
+
+if __name__ == '__main__':
+    main()
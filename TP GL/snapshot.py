@@ -0,0 +1,235 @@
+import atexit
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from urllib.request import pathname2url
+
+from flask import current_app, g
+
+import db
+
+
+log = logging.getLogger(__name__)
+
+
+# Seconds between two snapshots of the database; 0 turns snapshots off and
+# the reports read the live database
+SNAPSHOT_REFRESH = float(os.environ.get('SNAPSHOT_REFRESH', '30'))
+# Where the snapshot files go (in a directory of this process's own), the
+# system's temporary directory by default
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+SNAPSHOT_POOL_SIZE = int(os.environ.get('SNAPSHOT_POOL_SIZE', '4'))
+
+# A snapshot file never changes once written: it is opened immutable (no
+# locks, no journal) and read-only
+READ_PRAGMAS = (
+    ('cache_size', -16000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'MEMORY'),
+    ('query_only', 'ON'),
+)
+
+
+class Snapshot:
+
+    def __init__(self, path, version, size, factory):
+        self.path = path
+        self.version = version
+        self.taken = time.time()
+        uri = 'file:' + pathname2url(os.path.abspath(path)) + '?immutable=1'
+        self.pool = db.ConnectionPool(uri, size=size, pragmas=READ_PRAGMAS)
+        self.pool.factory = factory
+        self.users = 0
+        self.retired = False
+
+    def remove(self):
+        self.pool.close_all()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass  # still open (Windows), the directory goes at shutdown
+
+
+# Point-in-time copies of the database for the reports and exports.
+# A thread copies the live database with the online backup API every
+# `refresh` seconds (only if data_version moved) into a new file, and the
+# reports read the latest copy through a pool of their own. A report thus
+# never holds a read transaction on the live database, however long it
+# runs: it cannot delay the writers nor keep the WAL from being
+# checkpointed. A report that finds the copy behind the live data_version
+# (a write since the last refresh) reads the live database instead, through
+# a read-only pool, so it never misses a row committed before it started;
+# the copy is never taken on the request path. Either way all the queries
+# of a report run in one read transaction and see the same instant. A copy
+# is deleted once it is replaced and its last reader is done.
+class Snapshots:
+
+    def __init__(self, live, directory, refresh=SNAPSHOT_REFRESH, size=SNAPSHOT_POOL_SIZE):
+        self.live = live
+        self.directory = directory
+        self.refresh = refresh
+        self.size = size
+        self.current = None
+        self.generation = 0
+        # The live database, read only, for the reports a snapshot is behind
+        self.reader = db.ConnectionPool(live.database, size=size, pragmas=live.pragmas + (('query_only', 'ON'),))
+        self.reader.factory = live.factory
+        self._lock = threading.Lock()
+        self._take_lock = threading.Lock()  # one copy at a time
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Counters exposed through stats()
+        self.taken = 0
+        self.skipped = 0
+        self.live_reads = 0
+        self.copy_time = 0.0
+
+    # Copy the live database if it changed since the current snapshot
+    def take(self):
+        with self._take_lock:
+            with self.live.connection() as source:
+                version = db.data_version(source)
+                if self.current and version is not None and version == self.current.version:
+                    self.current.taken = time.time()
+                    self.skipped += 1
+                    return self.current
+
+                self.generation += 1
+                path = os.path.join(self.directory, f'snapshot-{self.generation}.db')
+                start = time.perf_counter()
+                target = sqlite3.connect(path)
+                try:
+                    source.backup(target)
+                    # A plain rollback-journal file, read without a -wal or -shm
+                    target.execute('PRAGMA journal_mode = DELETE')
+                finally:
+                    target.close()
+                self.copy_time += time.perf_counter() - start
+                self.taken += 1
+
+            snapshot = Snapshot(path, version, self.size, self.live.factory)
+            with self._lock:
+                previous, self.current = self.current, snapshot
+                if previous:
+                    previous.retired = True
+                    unused = previous.users == 0
+        if previous and unused:
+            previous.remove()
+        return snapshot
+
+    # The pool of the current snapshot if it is up to date with the live
+    # database, else the read-only live pool (also when snapshots are off),
+    # kept usable for as long as the with block runs
+    @contextmanager
+    def pinned(self):
+        with self._lock:
+            snapshot = self.current
+            if snapshot:
+                snapshot.users += 1
+        try:
+            if snapshot is not None:
+                with self.reader.connection() as conn:
+                    version = db.data_version(conn)
+                if version is None or version != snapshot.version:
+                    self._unpin(snapshot)
+                    snapshot = None
+            if snapshot is None:
+                self.live_reads += 1
+                yield self.reader
+            else:
+                yield snapshot.pool
+        finally:
+            if snapshot is not None:
+                self._unpin(snapshot)
+
+    def _unpin(self, snapshot):
+        with self._lock:
+            snapshot.users -= 1
+            unused = snapshot.retired and snapshot.users == 0
+        if unused:
+            snapshot.remove()
+
+    # A connection to pinned()'s pool in a read transaction, so every query
+    # on it sees the same instant
+    @contextmanager
+    def connection(self):
+        with self.pinned() as pool, pool.connection() as conn:
+            conn.execute('BEGIN')
+            yield conn
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='snapshot', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.take()
+            except (sqlite3.Error, OSError):
+                log.exception('Database snapshot failed')
+            self._stop.wait(self.refresh)
+
+    def stats(self):
+        current = self.current
+        return {
+            'refresh_seconds': self.refresh,
+            'generation': self.generation,
+            'taken': self.taken,
+            'skipped': self.skipped,
+            'live_reads': self.live_reads,
+            'copy_time_seconds': round(self.copy_time, 6),
+            'age_seconds': round(time.time() - current.taken, 3) if current else None,
+            'data_version': current.version if current else None,
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        with self._lock:
+            current, self.current = self.current, None
+        if current:
+            current.remove()
+        self.reader.close_all()
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def get_snapshots(app=None):
+    app = app or current_app
+    return app.extensions['snapshots']
+
+
+# Connection to the latest snapshot for the reports of this request,
+# handed back on teardown like get_db_connection's
+def get_report_connection():
+    if 'report_db' not in g:
+        g.report_db_stack = ExitStack()
+        g.report_db = g.report_db_stack.enter_context(get_snapshots().connection())
+    return g.report_db
+
+
+def release_report_connection(exception=None):
+    g.pop('report_db', None)
+    stack = g.pop('report_db_stack', None)
+    if stack is not None:
+        stack.close()
+
+
+def init_app(app):
+    app.config.setdefault('SNAPSHOT_REFRESH', SNAPSHOT_REFRESH)
+    directory = None
+    if app.config['SNAPSHOT_REFRESH'] > 0:
+        directory = tempfile.mkdtemp(prefix='school-snapshot-', dir=SNAPSHOT_DIR)
+    snapshots = Snapshots(db.get_pool(app), directory, app.config['SNAPSHOT_REFRESH'])
+    app.extensions['snapshots'] = snapshots
+    app.teardown_appcontext(release_report_connection)
+    if directory:
+        snapshots.start()
+        atexit.register(snapshots.shutdown)
@@ -0,0 +1,116 @@
+import csv
+import io
+import os
+import zipfile
+
+import openpyxl
+from openpyxl.utils.exceptions import InvalidFileException
+
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')
+CSV_EXTENSIONS = ('.csv',)
+
+# Rows inserted per transaction
+CHUNK_SIZE = 1000
+
+
+# Yield (row number, name, surname) for every data row of an uploaded file.
+# Excel files are read in openpyxl's read-only mode, which streams the sheet
+# instead of building it in memory; CSV files may use ',' or ';'. The first
+# row is a header, only the first two columns are used.
+def read_student_rows(stream, filename):
+    extension = os.path.splitext(filename.lower())[1]
+    if extension in EXCEL_EXTENSIONS:
+        rows = _excel_rows(stream)
+    elif extension in CSV_EXTENSIONS:
+        rows = _csv_rows(stream)
+    else:
+        raise ValueError("Invalid file format. Please upload an Excel (.xlsx) or CSV file.")
+
+    for row_number, row in enumerate(rows, 1):
+        if row_number == 1:
+            continue  # Skip header row
+        row = list(row[:2]) + [None] * (2 - len(row[:2]))
+        yield row_number, row[0], row[1]
+
+
+def _excel_rows(stream):
+    try:
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError, OSError) as e:
+        raise ValueError(f"Could not read the Excel file: {e}")
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    try:
+        yield from csv.reader(text, dialect)
+    finally:
+        text.detach()
+
+
+def _clean(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return ' '.join(str(value).split())
+
+
+# Insert the rows into the group, CHUNK_SIZE rows per transaction.
+# Rows without a name or surname are rejected, and so are students already
+# in the group (or earlier in the file), compared case-insensitively.
+# Returns the per-row report: dicts with row, name, surname, status
+# ('added', 'duplicate' or 'invalid') and reason.
+def import_students(conn, group_id, rows, chunk_size=CHUNK_SIZE):
+    seen = {
+        (row['name'].casefold(), row['surname'].casefold())
+        for row in conn.execute('SELECT name, surname FROM students WHERE group_id = ?', (group_id,))
+    }
+
+    report = []
+    pending = []
+    for row_number, name, surname in rows:
+        name, surname = _clean(name), _clean(surname)
+        entry = {'row': row_number, 'name': name, 'surname': surname, 'status': 'added', 'reason': ''}
+        key = (name.casefold(), surname.casefold())
+
+        if not name and not surname:
+            continue  # blank line
+        if not name or not surname:
+            entry['status'], entry['reason'] = 'invalid', 'Name and surname are required.'
+        elif key in seen:
+            entry['status'], entry['reason'] = 'duplicate', 'Already in this group.'
+        else:
+            seen.add(key)
+            pending.append((name, surname, group_id))
+            if len(pending) >= chunk_size:
+                _insert_chunk(conn, pending)
+                pending = []
+        report.append(entry)
+
+    if pending:
+        _insert_chunk(conn, pending)
+    return report
+
+
+def _insert_chunk(conn, students):
+    with conn:
+        conn.executemany('INSERT INTO students (name, surname, group_id) VALUES (?, ?, ?)', students)
+
+
+def summarize(report):
+    counts = {'added': 0, 'duplicate': 0, 'invalid': 0}
+    for entry in report:
+        counts[entry['status']] += 1
+    return counts
@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+# The modules read their settings from the environment when imported: give
+# the app a scratch database, export cache and snapshot directory
+DIRECTORY = tempfile.mkdtemp(prefix='school-tests-')
+os.environ['SCHOOL_DB'] = os.path.join(DIRECTORY, 'school.db')
+os.environ['EXPORT_CACHE_DIR'] = os.path.join(DIRECTORY, 'export_cache')
+os.environ['SNAPSHOT_DIR'] = DIRECTORY
+os.environ.pop('EXPORT_PROCESSES', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import jobs  # noqa: E402
+from app import app as flask_app  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Run SQL on the live database outside of any request, returns the last
+# inserted row id
+@pytest.fixture
+def write(app):
+    def write(sql, params=()):
+        with db.get_pool(app).connection() as conn:
+            row_id = conn.execute(sql, params).lastrowid
+            conn.commit()
+        return row_id
+    return write
+
+
+# A class with one group of one student, as (group id, student id)
+@pytest.fixture
+def group(write):
+    class_id = write("INSERT INTO classes (name, specialty, level, year) VALUES ('C1', 'Informatique', '1', '2024-2025')")
+    group_id = write("INSERT INTO groups (name, type, class_id) VALUES ('G1', 'TD', ?)", (class_id,))
+    student_id = write("INSERT INTO students (name, surname, group_id) VALUES ('Hamidi', 'Meriem', ?)", (group_id,))
+    return group_id, student_id
+
+
+# The export routes with EXPORT_PROCESSES set, as under serve.py
+@pytest.fixture
+def export_processes(app):
+    queue = jobs.get_queue(app)
+    queue.processes = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    yield queue
+    queue.processes.shutdown()
+    queue.processes = None
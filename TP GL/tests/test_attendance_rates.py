@@ -0,0 +1,15 @@
+# The attendance statistics and the analytics rollups give the same rate:
+# a NULL or unknown status counts as recorded in neither
+def test_stats_and_analytics_agree_on_the_rate(client, group, write):
+    group_id, student_id = group
+    others = [write("INSERT INTO students (name, surname, group_id) VALUES (?, 'Test', ?)", (name, group_id))
+              for name in ('Null', 'Late')]
+    session_id = write("INSERT INTO sessions (group_id, date, time) VALUES (?, '2031-05-05', '09:40')", (group_id,))
+    for student, status in zip([student_id] + others, ('present', None, 'late')):
+        write('INSERT INTO attendance (session_id, student_id, status) VALUES (?, ?, ?)', (session_id, student, status))
+
+    stats = client.get('/stats/attendance/students', query_string={
+        'date_debut': '2031-05-01', 'date_fin': '2031-05-31', 'group_id': group_id}).json
+    analytics = client.get('/analytics/groups', query_string={'group_id': group_id, 'from': '2031-05-01', 'to': '2031-05-31'}).json
+    assert stats['summary']['attendance_rate'] == 1.0
+    assert [(row['recorded'], row['attendance_rate']) for row in analytics['data']] == [(1, 1.0)]
@@ -0,0 +1,66 @@
+import io
+import time
+
+import openpyxl
+
+import db
+import jobs
+
+
+def run_export(client, export_type, values):
+    return finish(client, client.post(f'/exports/{export_type}', json=values).json)
+
+
+# Poll a job until it is done, returns it with the rows of its file
+def finish(client, job):
+    deadline = time.time() + 30
+    while job['status'] not in ('done', 'failed') and time.time() < deadline:
+        time.sleep(0.01)
+        job = client.get(job['status_url']).json
+    assert job['status'] == 'done', job
+    response = client.get(job['download_url'])
+    workbook = openpyxl.load_workbook(io.BytesIO(response.data), read_only=True)
+    return job, [list(row) for row in workbook.active.iter_rows(values_only=True)]
+
+
+# The same export before and after a write: the second one is built again
+# rather than served from the cache of the first
+def test_export_job_after_a_write_is_not_the_cached_file(client, group, write):
+    group_id, student_id = group
+    job, rows = run_export(client, 'students', {'group_id': group_id})
+    assert rows == [['Name', 'Surname'], ['Hamidi', 'Meriem']]
+    job, rows = run_export(client, 'students', {'group_id': group_id})
+    assert job['cached']
+
+    write("INSERT INTO students (name, surname, group_id) VALUES ('Rahmani', 'Sofiane', ?)", (group_id,))
+    job, rows = run_export(client, 'students', {'group_id': group_id})
+    assert not job['cached']
+    assert rows == [['Name', 'Surname'], ['Hamidi', 'Meriem'], ['Rahmani', 'Sofiane']]
+
+
+# An export route does not wait on its worker process for longer than
+# EXPORT_WAIT: it answers with the job to poll
+def test_offloaded_export_answers_with_the_job_after_export_wait(app, client, group, export_processes):
+    group_id, student_id = group
+    app.config['EXPORT_WAIT'] = 0
+    try:
+        response = client.get(f'/export_students/{group_id}')
+    finally:
+        app.config['EXPORT_WAIT'] = jobs.EXPORT_WAIT
+    assert response.status_code == 202
+    assert db.get_pool(app).stats()['in_use'] == 0
+    job, rows = finish(client, response.json)
+    assert rows == [['Name', 'Surname'], ['Hamidi', 'Meriem']]
+
+
+# One lookup per request: a miss for the first export, a hit for the
+# second, and none for downloading their files
+def test_export_cache_counts_each_lookup_once(app, client, group):
+    group_id, student_id = group
+    cache = jobs.get_queue(app).cache
+    hits, misses = cache.hits, cache.misses
+    job, rows = run_export(client, 'students', {'group_id': group_id})
+    assert (cache.hits, cache.misses) == (hits, misses + 1)
+    job, rows = run_export(client, 'students', {'group_id': group_id})
+    assert job['cached']
+    assert (cache.hits, cache.misses) == (hits + 1, misses + 1)
@@ -0,0 +1,32 @@
+import metrics
+
+
+# Scrapers parse the exposition format by its Content-Type: exactly one
+# charset parameter
+def test_metrics_content_type(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Each ?fields= choice is a new SQL text: past QUERY_FINGERPRINTS they all
+# go to one series, and the SQL text is only in school_query_info
+def test_query_series_are_bounded(client):
+    fields = ['id', 'name', 'surname', 'group_id', 'sessions_attended', 'absences', 'justified_absences']
+    info = metrics.QUERY_INFO
+    limit = info.limit
+    info.limit = len(info._values) + 2
+    try:
+        for count in range(1, len(fields) + 1):
+            for start in range(len(fields)):
+                chosen = (fields[start:] + fields[:start])[:count]
+                assert client.get('/api/students', query_string={'fields': ','.join(chosen)}).status_code == 200
+        fingerprints = {labels[0] for labels in metrics.QUERY_SECONDS._series}
+        assert 'other' in fingerprints
+        assert len(fingerprints) <= info.limit + 1
+    finally:
+        info.limit = limit
+
+    lines = client.get('/metrics').get_data(as_text=True).splitlines()
+    assert not any(line.startswith('school_query_seconds') and 'sql=' in line for line in lines)
+    assert any(line.startswith('school_query_info{') for line in lines)
@@ -0,0 +1,89 @@
+import io
+import time
+
+import openpyxl
+
+import db
+import snapshot
+
+
+def sheet_rows(response):
+    workbook = openpyxl.load_workbook(io.BytesIO(response.data), read_only=True)
+    return [list(row) for row in workbook.active.iter_rows(values_only=True)]
+
+
+def last_session_id(app, group_id):
+    with db.get_pool(app).connection() as conn:
+        return conn.execute('SELECT MAX(id) FROM sessions WHERE group_id = ?', (group_id,)).fetchone()[0]
+
+
+# A session added and marked right after a snapshot is in every report at
+# once, not only after the next refresh
+def test_reports_see_writes_made_since_the_last_snapshot(app, client, group):
+    group_id, student_id = group
+    snapshots = snapshot.get_snapshots(app)
+    snapshots.take()
+
+    response = client.post(f'/group/{group_id}/session/add', data={'session-date': '2031-03-03', 'session-time': '09:40'})
+    assert response.status_code == 302
+    session_id = last_session_id(app, group_id)
+    change = {'session_id': session_id, 'student_id': student_id, 'status': 'absent', 'changed_at': int(time.time() * 1000)}
+    assert client.post('/api/attendance', json={'changes': [change]}).status_code == 200
+    with db.get_pool(app).connection() as conn:
+        assert snapshots.current.version != db.data_version(conn)
+
+    response = client.get(f'/export_session/{session_id}')
+    assert response.status_code == 200
+    assert ['Hamidi', 'Meriem', 'absent', None] in sheet_rows(response)
+
+    response = client.post('/export-attendance', data={'date_debut': '2031-03-01', 'date_fin': '2031-03-31', 'group_id': group_id})
+    assert response.status_code == 200
+    assert sheet_rows(response)[1][:3] == ['Hamidi', 'Meriem', 'absent']
+
+    response = client.get('/stats/attendance/students', query_string={
+        'date_debut': '2031-03-01', 'date_fin': '2031-03-31', 'group_id': group_id})
+    assert response.status_code == 200
+    assert [(row['id'], row['absent']) for row in response.json['students']] == [(student_id, 1)]
+
+    response = client.get('/analytics/students', query_string={'group_id': group_id, 'from': '2031-03-01', 'to': '2031-03-31'})
+    assert response.status_code == 200
+    assert [(row['id'], row['absent']) for row in response.json['data']] == [(student_id, 1)]
+
+
+# A report never copies the database itself: behind the live data, it reads
+# the live database, and the copy waits for the next refresh
+def test_reports_behind_the_snapshot_do_not_copy_the_database(app, client, group, write):
+    group_id, student_id = group
+    session_id = write("INSERT INTO sessions (group_id, date, time) VALUES (?, '2031-04-07', '09:40')", (group_id,))
+    snapshots = snapshot.get_snapshots(app)
+    snapshots.take()
+    taken, live_reads = snapshots.taken, snapshots.live_reads
+    stats = {'date_debut': '2031-04-01', 'date_fin': '2031-04-30', 'group_id': group_id}
+
+    response = client.get('/stats/attendance/students', query_string=stats)
+    assert response.status_code == 200
+    assert [(row['id'], row['absent']) for row in response.json['students']] == [(student_id, 0)]
+    assert snapshots.live_reads == live_reads
+
+    write("INSERT INTO attendance (session_id, student_id, status) VALUES (?, ?, 'absent')", (session_id, student_id))
+    response = client.get('/stats/attendance/students', query_string=stats)
+    assert response.status_code == 200
+    assert [(row['id'], row['absent']) for row in response.json['students']] == [(student_id, 1)]
+    assert snapshots.live_reads == live_reads + 1
+    assert snapshots.taken == taken
+
+
+# The students export is cached under the group's version: the file built
+# by the worker process must already hold the write that bumped it
+def test_students_export_in_a_worker_process_follows_writes(app, client, group, write, export_processes):
+    group_id, student_id = group
+    snapshot.get_snapshots(app).take()
+    response = client.get(f'/export_students/{group_id}')
+    assert response.status_code == 200
+    assert sheet_rows(response) == [['Name', 'Surname'], ['Hamidi', 'Meriem']]
+
+    write("INSERT INTO students (name, surname, group_id) VALUES ('Rahmani', 'Sofiane', ?)", (group_id,))
+    response = client.get(f'/export_students/{group_id}')
+    assert response.status_code == 200
+    assert sheet_rows(response) == [['Name', 'Surname'], ['Hamidi', 'Meriem'], ['Rahmani', 'Sofiane']]
+    assert client.get(f'/export_students/{group_id}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
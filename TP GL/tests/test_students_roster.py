@@ -0,0 +1,18 @@
+import io
+
+import openpyxl
+
+
+# Sheet names are XML attribute values: a quote in a class or group name
+# must not break the workbook
+def test_roster_sheet_names_with_quotes(client, write):
+    class_id = write("""INSERT INTO classes (name, specialty, level, year) VALUES ('C"1', 'Informatique', '1', '2024-2025')""")
+    group_id = write("""INSERT INTO groups (name, type, class_id) VALUES ('G"1 & <A>', 'TD', ?)""", (class_id,))
+    write("INSERT INTO students (name, surname, group_id) VALUES ('Hamidi', 'Meriem', ?)", (group_id,))
+
+    response = client.get('/export_students', query_string={'class_id': class_id})
+    assert response.status_code == 200
+    workbook = openpyxl.load_workbook(io.BytesIO(response.data), read_only=True)
+    assert workbook.sheetnames == ['C"1 G"1 & <A>']
+    rows = [list(row) for row in workbook.active.iter_rows(values_only=True)]
+    assert ['Hamidi', 'Meriem'] in rows
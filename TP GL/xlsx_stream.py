@@ -0,0 +1,152 @@
+import re
+import zipfile
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Flush the generated bytes to the client every ~64 KB
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+{sheets}
+</Types>'''
+
+SHEET_CONTENT_TYPE = '<Override PartName="/xl/worksheets/sheet{index}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+
+ROOT_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>{sheets}</sheets>
+</workbook>'''
+
+WORKBOOK_SHEET = '<sheet name="{name}" sheetId="{index}" r:id="rId{index}"/>'
+
+WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+{sheets}
+</Relationships>'''
+
+WORKBOOK_REL = '<Relationship Id="rId{index}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{index}.xml"/>'
+
+SHEET_HEAD = (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+SHEET_TAIL = b'</sheetData></worksheet>'
+
+# Characters XML 1.0 does not allow, even escaped
+ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+# Write-only file object that keeps what zipfile writes until it is drained.
+# It has no tell()/seek(), so zipfile switches to streaming mode (data
+# descriptors after each entry) instead of seeking back into the output.
+class _ChunkSink:
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks, self.size = self.chunks, [], 0
+        return b''.join(chunks)
+
+
+def column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+@lru_cache(maxsize=4096)
+def _string_cell(value):
+    value = escape(ILLEGAL_XML_CHARS.sub('', value))
+    return f' t="inlineStr"><is><t xml:space="preserve">{value}</t></is></c>'
+
+
+def _row_xml(row_number, values, columns):
+    cells = []
+    for column, value in zip(columns, values):
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = str(value)
+        if isinstance(value, (int, float)):
+            cells.append(f'<c r="{column}{row_number}"><v>{value}</v></c>')
+        else:
+            cells.append(f'<c r="{column}{row_number}"{_string_cell(str(value))}')
+    return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+
+# Generate an .xlsx file as a stream of byte chunks.
+# sheets is a list of (sheet name, rows) pairs; each rows is an iterable of
+# lists consumed one row at a time, so only the current row and the zip
+# compressor state are in memory no matter how big the sheet is. Strings are
+# written inline, so there is no shared strings table to accumulate either.
+def stream_xlsx(sheets):
+    sink = _ChunkSink()
+    # Attribute values, so quotes are escaped too
+    names = [escape(ILLEGAL_XML_CHARS.sub('', name[:31]), {'"': '&quot;'}) for name, rows in sheets]
+    indexes = range(1, len(sheets) + 1)
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES.format(
+            sheets='\n'.join(SHEET_CONTENT_TYPE.format(index=index) for index in indexes)))
+        archive.writestr('_rels/.rels', ROOT_RELS)
+        archive.writestr('xl/workbook.xml', WORKBOOK.format(
+            sheets=''.join(WORKBOOK_SHEET.format(name=name, index=index) for name, index in zip(names, indexes))))
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS.format(
+            sheets='\n'.join(WORKBOOK_REL.format(index=index) for index in indexes)))
+        yield sink.drain()
+
+        for index, (name, rows) in zip(indexes, sheets):
+            with archive.open(f'xl/worksheets/sheet{index}.xml', 'w', force_zip64=True) as part:
+                part.write(SHEET_HEAD)
+                columns = []
+                for row_number, values in enumerate(rows, 1):
+                    if len(values) > len(columns):
+                        columns = [column_letter(i) for i in range(len(values))]
+                    part.write(_row_xml(row_number, values, columns).encode('utf-8'))
+                    if sink.size >= CHUNK_SIZE:
+                        yield sink.drain()
+                part.write(SHEET_TAIL)
+            yield sink.drain()
+
+    yield sink.drain()
+
+
+# Generate a .zip archive as a stream of byte chunks, like stream_xlsx.
+# files is a list of (file name, chunks) pairs, each read as it is written.
+# Entries are stored without compression: they are .xlsx files, which are
+# compressed already.
+def stream_zip(files):
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, chunks in files:
+            with archive.open(name, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    if sink.size >= CHUNK_SIZE:
+                        yield sink.drain()
+            yield sink.drain()
+
+    yield sink.drain()